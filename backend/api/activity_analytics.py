@@ -0,0 +1,189 @@
+"""Activity usage analytics built on aggregation pipelines.
+
+Per-user analytics run live. The pipeline first `$match`es on username and a
+`created_at` window, so it stays on the `activity_usages_username_created_at`
+index. A single `$facet` pass then groups by activity, by hour of day and by
+day of week. Durations are summed from the first numeric field found among
+metadata.duration_sec / duration_seconds / duration, or metadata.duration_ms.
+
+Dashboard queries across all users read the `activity_daily_stats`
+materialized view instead. It holds one document per (username, activity_key,
+UTC day) and is refreshed with `$merge` by the refresh_activity_stats command.
+
+The pipelines use $dateTrunc and multi-argument $ifNull (MongoDB 5.0+).
+"""
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+DAILY_STATS_COLLECTION = 'activity_daily_stats'
+DEFAULT_DAYS = 30
+MAX_DAYS = 366
+
+
+class InvalidAnalyticsQuery(ValueError):
+    pass
+
+
+def _number(path):
+    return {'$convert': {'input': path, 'to': 'double', 'onError': None, 'onNull': None}}
+
+
+DURATION_SECONDS = {'$ifNull': [
+    _number('$metadata.duration_sec'),
+    _number('$metadata.duration_seconds'),
+    _number('$metadata.duration'),
+    {'$divide': [_number('$metadata.duration_ms'), 1000]},
+    0,
+]}
+
+
+def parse_analytics_params(params):
+    try:
+        days = int(params.get('days') or DEFAULT_DAYS)
+    except (TypeError, ValueError):
+        raise InvalidAnalyticsQuery('days must be an integer')
+    if not 1 <= days <= MAX_DAYS:
+        raise InvalidAnalyticsQuery(f'days must be between 1 and {MAX_DAYS}')
+    tz = params.get('tz') or 'UTC'
+    try:
+        ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise InvalidAnalyticsQuery(f'Unknown time zone: {tz}')
+    return days, tz
+
+
+def user_pipeline(username, start, end, tz='UTC'):
+    return [
+        {'$match': {'username': username, 'created_at': {'$gte': start, '$lt': end}}},
+        {'$project': {'_id': 0, 'activity_key': 1, 'created_at': 1, 'duration': DURATION_SECONDS}},
+        {'$facet': {
+            'by_activity': [
+                {'$group': {
+                    '_id': '$activity_key',
+                    'count': {'$sum': 1},
+                    'total_duration_sec': {'$sum': '$duration'},
+                    'first_at': {'$min': '$created_at'},
+                    'last_at': {'$max': '$created_at'},
+                }},
+                {'$sort': {'count': -1, '_id': 1}},
+            ],
+            'by_hour': [
+                {'$group': {
+                    '_id': {'activity_key': '$activity_key', 'hour': {'$hour': {'date': '$created_at', 'timezone': tz}}},
+                    'count': {'$sum': 1},
+                }},
+            ],
+            'by_weekday': [
+                {'$group': {
+                    '_id': {'activity_key': '$activity_key',
+                            'weekday': {'$isoDayOfWeek': {'date': '$created_at', 'timezone': tz}}},
+                    'count': {'$sum': 1},
+                }},
+            ],
+        }},
+    ]
+
+
+def shape_user_result(facets):
+    """Turn the $facet output into per-activity totals and hour/weekday histograms"""
+    activities = []
+    for row in facets.get('by_activity', []):
+        total = round(row['total_duration_sec'], 3)
+        activities.append({
+            'activity_key': row['_id'],
+            'count': row['count'],
+            'total_duration_sec': total,
+            'avg_duration_sec': round(total / row['count'], 3) if row['count'] else 0,
+            'first_at': row['first_at'],
+            'last_at': row['last_at'],
+        })
+    by_hour = {}
+    for row in facets.get('by_hour', []):
+        by_hour.setdefault(row['_id']['activity_key'], [0] * 24)[row['_id']['hour']] = row['count']
+    by_weekday = {}  # Monday first
+    for row in facets.get('by_weekday', []):
+        by_weekday.setdefault(row['_id']['activity_key'], [0] * 7)[row['_id']['weekday'] - 1] = row['count']
+    return {'activities': activities, 'by_hour': by_hour, 'by_weekday': by_weekday}
+
+
+def user_activity_analytics(db, username, days=DEFAULT_DAYS, tz='UTC', now=None):
+    end = now or datetime.utcnow()
+    start = end - timedelta(days=days)
+    facets = next(db['activity_usages'].aggregate(user_pipeline(username, start, end, tz)), {})
+    result = shape_user_result(facets)
+    result.update({'username': username, 'from': start, 'to': end, 'tz': tz})
+    return result
+
+
+def daily_stats_pipeline(since=None, username=None):
+    """Recompute daily stats for days at or after `since` (all history if None) and $merge them.
+
+    `username` limits the refresh to one user's rows.
+    """
+    match = {'username': username if username else {'$type': 'string'}, 'created_at': {'$type': 'date'}}
+    if since is not None:
+        # Whole days only, so every merged day is recomputed from all of its entries
+        match['created_at'] = {'$gte': datetime(since.year, since.month, since.day)}
+    return [
+        {'$match': match},
+        {'$group': {
+            '_id': {
+                'username': '$username',
+                'activity_key': '$activity_key',
+                'day': {'$dateTrunc': {'date': '$created_at', 'unit': 'day'}},
+            },
+            'count': {'$sum': 1},
+            'total_duration_sec': {'$sum': DURATION_SECONDS},
+        }},
+        {'$project': {
+            '_id': 0,
+            'username': '$_id.username',
+            'activity_key': '$_id.activity_key',
+            'day': '$_id.day',
+            'count': 1,
+            'total_duration_sec': 1,
+            'refreshed_at': '$$NOW',
+        }},
+        {'$merge': {
+            'into': DAILY_STATS_COLLECTION,
+            'on': ['username', 'activity_key', 'day'],
+            'whenMatched': 'replace',
+            'whenNotMatched': 'insert',
+        }},
+    ]
+
+
+def refresh_daily_stats(db, since=None, username=None):
+    """Run the $merge refresh server-side; nothing is returned to the client"""
+    db['activity_usages'].aggregate(daily_stats_pipeline(since, username=username), allowDiskUse=True)
+
+
+def dashboard_activity_stats(db, days=DEFAULT_DAYS, now=None):
+    """Per-activity totals across all users, read from the materialized view"""
+    end = now or datetime.utcnow()
+    start = datetime(end.year, end.month, end.day) - timedelta(days=days - 1)
+    rows = db[DAILY_STATS_COLLECTION].aggregate([
+        {'$match': {'day': {'$gte': start}}},
+        {'$group': {
+            '_id': '$activity_key',
+            'count': {'$sum': '$count'},
+            'users': {'$addToSet': '$username'},
+            'total_duration_sec': {'$sum': '$total_duration_sec'},
+            'refreshed_at': {'$max': '$refreshed_at'},
+        }},
+        {'$project': {
+            'count': 1, 'total_duration_sec': 1, 'refreshed_at': 1, 'users': {'$size': '$users'},
+        }},
+        {'$sort': {'count': -1, '_id': 1}},
+    ])
+    activities = [
+        {
+            'activity_key': row['_id'],
+            'count': row['count'],
+            'users': row['users'],
+            'total_duration_sec': round(row['total_duration_sec'], 3),
+            'refreshed_at': row.get('refreshed_at'),
+        }
+        for row in rows
+    ]
+    return {'scope': 'all', 'from': start, 'to': end, 'activities': activities}
@@ -0,0 +1,174 @@
+"""Async (ASGI) variants of the chat and history endpoints.
+
+These use pymongo's native async driver and the Gemini SDK's async calls, so
+under an ASGI server (e.g. `uvicorn backend.asgi:application`) one worker can
+hold many in-flight chats while the LLM is thinking. They are plain Django
+async views because DRF's APIView is synchronous; responses are encoded with
+the same serializer as the DRF renderer. Under WSGI they still work, but each
+request runs its own event loop and gains nothing.
+"""
+from datetime import datetime
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from pymongo import DESCENDING
+
+from backend.mongo import AsyncMongoDB
+from .authentication import claims_from_header, resolve_username
+from .bson_json import RAW_CODEC_OPTIONS, dumps
+from .chat_context import aload_recent_exchanges, get_conversation_cache
+from .chatbot import agenerate_reply, history_to_messages, rule_based_reply
+from .pagination import InvalidCursor, apaginate, parse_order, parse_page_size
+from .projection import InvalidFields, projection_from_params
+from .tokens import InvalidToken
+
+logger = logging.getLogger(__name__)
+
+
+def json_response(data, status=200):
+    return HttpResponse(dumps(data), status=status, content_type='application/json')
+
+
+def _request_json(request):
+    try:
+        return json.loads(request.body.decode('utf-8') or '{}')
+    except (ValueError, UnicodeDecodeError):
+        return {}
+
+
+async def _acting_username(request, supplied, optional=False):
+    """Username the request acts on, from its bearer token if it has one; returns (username, error response or None)"""
+    try:
+        claims = claims_from_header(request.headers.get('Authorization'))
+    except InvalidToken as e:
+        return None, json_response({'error': str(e)}, status=401)
+    if claims:
+        # Finding the token's user may read `users` with the blocking client, so it runs off the loop
+        username, denied = await sync_to_async(resolve_username)(claims, supplied, optional)
+    else:
+        username, denied = resolve_username(claims, supplied, optional)
+    if denied:
+        return None, json_response({'error': denied[0]}, status=denied[1])
+    return username, None
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncChatbotView(View):
+    http_method_names = ['post']
+
+    async def post(self, request):
+        try:
+            data = _request_json(request)
+            user_message = (data.get('message') or '').strip()
+            mood = (data.get('mood') or 'calm').strip().lower()
+            username, denied = await _acting_username(request, data.get('username'), optional=True)
+            if denied:
+                return denied
+
+            if not user_message:
+                return json_response({'error': 'message is required'}, status=400)
+
+            chats = AsyncMongoDB.get_db()['chat_messages'] if username else None
+            prior_messages = []
+            if username:
+                try:
+                    history = await aload_recent_exchanges(chats, username)
+                    prior_messages = history_to_messages(history)
+                except Exception as he:
+                    logger.warning(f"Failed to load prior messages: {he}")
+
+            try:
+                reply, provider = await agenerate_reply(user_message, mood, prior_messages)
+            except Exception as ge:
+                logger.warning(f"LLM generation failed: {ge}")
+                reply = None
+            if not reply:
+                reply = rule_based_reply(mood, user_message, username)
+                provider = 'rule-fallback'
+
+            if username:
+                try:
+                    doc = {
+                        'username': username,
+                        'mood': mood,
+                        'user_message': user_message,
+                        'bot_reply': reply,
+                        'provider': provider,
+                        'created_at': datetime.utcnow(),
+                    }
+                    await chats.insert_one(doc)
+                    get_conversation_cache().append(username, doc)
+                except Exception as se:
+                    logger.warning(f"Failed to save chat message ({provider}): {se}")
+            return json_response({'reply': reply, 'mood': mood, 'provider': provider})
+        except Exception as e:
+            logger.error(f"Async chatbot error: {e}")
+            return json_response({'error': 'Internal server error'}, status=500)
+
+
+class AsyncHistoryListView(View):
+    """Keyset-paginated listing of one per-user collection (see api/pagination.py)"""
+    http_method_names = ['get']
+    collection_name = None
+    response_key = None
+    default_order = DESCENDING
+    default_limit = None
+    # Without an explicit `order`, show the (newest-first) page oldest first, as a conversation reads
+    chronological = False
+
+    async def get(self, request):
+        try:
+            params = request.GET
+            username, denied = await _acting_username(request, params.get('username'))
+            if denied:
+                return denied
+            if not username:
+                return json_response({'error': 'username is required'}, status=400)
+            collection = AsyncMongoDB.get_db()[self.collection_name]
+            docs, next_cursor, prev_cursor = await apaginate(
+                collection, {'username': username},
+                cursor=params.get('cursor'),
+                page_size=parse_page_size(params.get('limit'), default=self.default_limit),
+                order=parse_order(params.get('order'), self.default_order),
+                codec_options=RAW_CODEC_OPTIONS,
+                projection=projection_from_params(self.collection_name, params),
+            )
+            if self.chronological and not params.get('order'):
+                docs = docs[::-1]
+            return json_response({
+                self.response_key: docs, 'count': len(docs), 'username': username,
+                'next': next_cursor, 'prev': prev_cursor,
+            })
+        except (InvalidCursor, InvalidFields) as e:
+            return json_response({'error': str(e)}, status=400)
+        except Exception as e:
+            logger.error(f"Error fetching {self.collection_name}: {e}")
+            return json_response({'error': 'Internal server error'}, status=500)
+
+
+class AsyncChatHistoryView(AsyncHistoryListView):
+    collection_name = 'chat_messages'
+    response_key = 'messages'
+    chronological = True
+
+
+class AsyncMoodEntryView(AsyncHistoryListView):
+    collection_name = 'mood_entries'
+    response_key = 'mood_entries'
+
+
+class AsyncJournalEntryView(AsyncHistoryListView):
+    collection_name = 'journal_entries'
+    response_key = 'journal_entries'
+    default_limit = 100
+
+
+class AsyncActivityUsageView(AsyncHistoryListView):
+    collection_name = 'activity_usages'
+    response_key = 'activity_usages'
+    default_limit = 100
@@ -0,0 +1,114 @@
+"""DRF authentication from signed session tokens (see api/tokens.py).
+
+Requests send ``Authorization: Bearer <token>``. Checking the token reads
+nothing from MongoDB. Views call `resolve_username` to decide whose data a
+request acts on:
+
+- With a token, the request acts as the token's user: the user whose `_id`
+  is the `sub` claim. The `usr` claim is only a hint to find that user in the
+  user cache. It goes stale when the user is renamed, so on a miss the user is
+  read by `_id`. A `username` in the query or body that names someone else
+  is refused with 403.
+- Without a token, the supplied `username` is still trusted unless
+  SESSION_TOKENS_REQUIRED is on. It is off by default so existing clients
+  keep working while they move to tokens.
+"""
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+
+from .models import User, get_model
+from .tokens import InvalidToken, verify_token
+from .user_cache import get_user_cache
+
+
+def _setting(name, default):
+    try:
+        from django.conf import settings
+        return getattr(settings, name, default)
+    except Exception:
+        return default
+
+
+class TokenUser:
+    """The authenticated user as described by a token; not backed by a database row"""
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, claims):
+        self.id = claims.get('sub')
+        self.username = claims.get('usr')
+
+    def __str__(self):
+        return self.username or ''
+
+
+def bearer_token(header):
+    """The token from an Authorization header value (str or bytes), or None"""
+    if isinstance(header, bytes):
+        header = header.decode('latin-1')
+    parts = (header or '').split()
+    if len(parts) == 2 and parts[0].lower() == 'bearer':
+        return parts[1]
+    return None
+
+
+def claims_from_header(header):
+    """Claims of the bearer token in `header`, None without one; raises InvalidToken"""
+    token = bearer_token(header)
+    return verify_token(token) if token else None
+
+
+class SessionTokenAuthentication(BaseAuthentication):
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        try:
+            claims = claims_from_header(get_authorization_header(request))
+        except InvalidToken as e:
+            raise AuthenticationFailed(str(e))
+        if claims is None:
+            return None
+        return TokenUser(claims), claims
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+class OptionalSessionTokenAuthentication(SessionTokenAuthentication):
+    """For endpoints that need no session (login, signup, refresh): a bad or expired token is ignored, not refused"""
+
+    def authenticate(self, request):
+        try:
+            return super().authenticate(request)
+        except AuthenticationFailed:
+            return None
+
+
+def tokens_required():
+    return bool(_setting('SESSION_TOKENS_REQUIRED', False))
+
+
+def token_user(claims):
+    """The users record of the token's `sub`, or None if the user is gone"""
+    user = get_user_cache().get(claims.get('usr'))
+    if user is not None and str(user.get('_id')) == claims.get('sub'):
+        return user
+    return get_model(User).find_by_id(claims.get('sub'))
+
+
+def resolve_username(claims, supplied, optional=False):
+    """Username a request acts as: (username, None), or (None, (error message, HTTP status)).
+
+    `optional` marks endpoints that also serve anonymous callers (chat without a
+    username); they stay open when tokens are required and no username is given.
+    """
+    if claims:
+        user = token_user(claims)
+        if user is None:
+            return None, ('Session user no longer exists', 401)
+        if supplied and supplied != user.get('username'):
+            return None, ('username does not match the session token', 403)
+        return user.get('username'), None
+    if tokens_required() and (supplied or not optional):
+        return None, ('Authentication required', 401)
+    return supplied, None
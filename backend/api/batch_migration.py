@@ -0,0 +1,233 @@
+"""Resumable batch migrations for management commands.
+
+A migration streams the documents of one collection that match its `query`,
+in `_id` order, over a single cursor. Each chunk of MIGRATION_CHUNK_SIZE
+documents is turned into write requests (`BatchMigration.operations`). Those
+are sent in one unordered `bulk_write`. A migration that needs data from
+elsewhere, such as the user of each entry, loads it once up front in
+`prepare` (see `load_user_map`). It does not look it up per document.
+
+After every chunk the runner records the last `_id` it handled in
+`migration_checkpoints`. If a run stops, the next run with the same name
+continues after that `_id`. Documents that fail in a chunk are logged and
+counted, and the run moves on. Any other error stops the run and leaves the
+checkpoint at the last chunk that was written.
+
+Resuming by `_id` assumes the `_id`s of a collection are all of one type,
+such as all ObjectIds or all sequential ints.
+"""
+from datetime import datetime
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError
+
+from backend.mongo import MongoDB
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_COLLECTION = 'migration_checkpoints'
+
+
+def _setting(name, default):
+    try:
+        from django.conf import settings
+        return getattr(settings, name, default)
+    except Exception:
+        return default
+
+
+def load_user_map(db, key='_id', fields=('username',)):
+    """Every user as {str(user[key]): user}, streamed once with a narrow projection"""
+    projection = dict.fromkeys((key,) + tuple(fields), 1)
+    users = {}
+    for user in db['users'].find({key: {'$exists': True}}, projection).batch_size(5000):
+        users[str(user[key])] = user
+    return users
+
+
+class BatchMigration:
+    """One migration: subclasses set `name`, `collection` and `query` and build the writes"""
+    name = None  # checkpoint key
+    collection = None
+    target = None  # collection the writes go to; defaults to `collection`
+    query = {}
+    projection = None
+
+    def prepare(self, db):
+        """Load whatever the chunks need (e.g. a user map) before the scan starts"""
+
+    def operations(self, chunk):
+        """Write requests (UpdateOne, InsertOne, ...) for one chunk of scanned documents"""
+        raise NotImplementedError
+
+
+class Progress:
+    def __init__(self, checkpoint=None):
+        checkpoint = checkpoint or {}
+        self.last_id = checkpoint.get('last_id')
+        self.scanned = checkpoint.get('scanned', 0)
+        self.written = checkpoint.get('written', 0)
+        self.skipped = checkpoint.get('skipped', 0)
+        self.failed = checkpoint.get('failed', 0)
+        self.resumed = bool(checkpoint)
+        self.run_scanned = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        """Documents scanned per second in this run"""
+        return self.run_scanned / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            'last_id': self.last_id, 'scanned': self.scanned, 'written': self.written,
+            'skipped': self.skipped, 'failed': self.failed,
+        }
+
+
+class MigrationRunner:
+    """Runs a BatchMigration chunk by chunk with checkpoints, an optional rate limit and progress reports"""
+
+    def __init__(self, db, migration, chunk_size=None, max_rate=None, dry_run=False, restart=False,
+                 report=None, report_every=None):
+        self.db = db
+        self.migration = migration
+        self.chunk_size = max(1, int(chunk_size or _setting('MIGRATION_CHUNK_SIZE', 1000)))
+        self.max_rate = float(max_rate if max_rate is not None else _setting('MIGRATION_MAX_RATE', 0))
+        self.dry_run = dry_run
+        self.restart = restart
+        self.report = report
+        self.report_every = float(report_every if report_every is not None else _setting('MIGRATION_REPORT_SECONDS', 5))
+        self.checkpoints = db[CHECKPOINT_COLLECTION]
+
+    def _load_checkpoint(self):
+        if self.restart:
+            if not self.dry_run:
+                self.checkpoints.delete_one({'_id': self.migration.name})
+            return None
+        checkpoint = self.checkpoints.find_one({'_id': self.migration.name})
+        if not checkpoint or checkpoint.get('status') == 'done':
+            return None
+        return checkpoint
+
+    def _save_checkpoint(self, progress, status='running', **extra):
+        if self.dry_run:
+            return
+        now = datetime.utcnow()
+        fields = dict(progress.as_dict(), status=status, updated_at=now, **extra)
+        if status == 'done':
+            fields['finished_at'] = now
+        self.checkpoints.update_one(
+            {'_id': self.migration.name},
+            {'$set': fields, '$setOnInsert': {'started_at': now}},
+            upsert=True,
+        )
+
+    def _write(self, requests, progress):
+        if not requests:
+            return
+        if self.dry_run:
+            progress.written += len(requests)
+            return
+        target = self.db[self.migration.target or self.migration.collection]
+        try:
+            result = target.bulk_write(requests, ordered=False)
+            progress.written += result.modified_count + result.inserted_count + result.upserted_count
+        except BulkWriteError as e:
+            details = e.details or {}
+            errors = details.get('writeErrors', [])
+            progress.written += details.get('nModified', 0) + details.get('nInserted', 0) + details.get('nUpserted', 0)
+            progress.failed += len(errors)
+            if errors:
+                logger.error(f'{self.migration.name}: {len(errors)} writes failed in chunk, first: {errors[0].get("errmsg")}')
+
+    def _flush(self, chunk, progress):
+        requests = self.migration.operations(chunk)
+        self._write(requests, progress)
+        progress.skipped += len(chunk) - len(requests)
+        progress.scanned += len(chunk)
+        progress.run_scanned += len(chunk)
+        progress.last_id = chunk[-1]['_id']
+        self._save_checkpoint(progress)
+        if self.max_rate > 0:
+            ahead = progress.run_scanned / self.max_rate - progress.elapsed
+            if ahead > 0:
+                time.sleep(ahead)
+
+    def run(self):
+        """Run (or resume) the migration; returns its Progress"""
+        progress = Progress(self._load_checkpoint())
+        self.migration.prepare(self.db)
+        query = dict(self.migration.query)
+        if progress.last_id is not None:
+            query['_id'] = {'$gt': progress.last_id}
+        cursor = self.db[self.migration.collection].find(query, self.migration.projection) \
+            .sort('_id', ASCENDING).batch_size(self.chunk_size)
+
+        last_report = time.perf_counter()
+        chunk = []
+        try:
+            for doc in cursor:
+                chunk.append(doc)
+                if len(chunk) < self.chunk_size:
+                    continue
+                self._flush(chunk, progress)
+                chunk = []
+                if self.report and time.perf_counter() - last_report >= self.report_every:
+                    self.report(progress)
+                    last_report = time.perf_counter()
+            if chunk:
+                self._flush(chunk, progress)
+        except Exception as e:
+            self._save_checkpoint(progress, status='failed', error=str(e))
+            raise
+        self._save_checkpoint(progress, status='done')
+        return progress
+
+
+def describe_progress(progress):
+    return (
+        f'{progress.scanned} scanned, {progress.written} written, {progress.skipped} skipped, '
+        f'{progress.failed} failed ({progress.rate:,.0f} docs/s, last _id {progress.last_id})'
+    )
+
+
+class MigrationCommand(BaseCommand):
+    """Base for management commands that run one BatchMigration"""
+    migration_class = None
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, help='Documents per bulk_write (default MIGRATION_CHUNK_SIZE)')
+        parser.add_argument('--max-rate', type=float, help='Documents per second to stay under (default MIGRATION_MAX_RATE, 0 = no limit)')
+        parser.add_argument('--dry-run', action='store_true', help='Count what would be written without writing')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint of an earlier run and start from the beginning')
+
+    def handle(self, *args, **options):
+        migration = self.migration_class()
+        runner = MigrationRunner(
+            MongoDB.get_db(), migration,
+            chunk_size=options['chunk_size'], max_rate=options['max_rate'],
+            dry_run=options['dry_run'], restart=options['restart'],
+            report=lambda progress: self.stdout.write(describe_progress(progress)),
+        )
+        try:
+            progress = runner.run()
+        except Exception as e:
+            logger.error(f'Error during {migration.name}: {e}')
+            raise CommandError(f'{migration.name} failed: {e} (run it again to resume from the last checkpoint)')
+
+        if progress.resumed:
+            self.stdout.write(f'Resumed {migration.name} from an earlier checkpoint')
+        verb = 'would write' if options['dry_run'] else 'wrote'
+        self.stdout.write(self.style.SUCCESS(
+            f'{migration.name}: scanned {progress.run_scanned} documents in {progress.elapsed:.2f}s '
+            f'({progress.rate:,.0f} docs/s); {progress.scanned} in total, {verb} {progress.written}, '
+            f'skipped {progress.skipped}, failed {progress.failed}'
+        ))
@@ -0,0 +1,67 @@
+"""BSON document to JSON bytes encoding shared by every API response.
+
+Views hand pymongo documents (ideally `RawBSONDocument`s) straight to the
+response; encoding happens once, here, instead of each view patching `_id`
+and `created_at` and DRF's encoder walking the result again. orjson is used
+when installed; otherwise the stdlib encoder with the same conversions.
+
+Conversions: ObjectId -> str, datetime -> ISO 8601, top-level document `_id`
+-> str (the API has always returned string ids).
+"""
+import json
+from datetime import date, datetime
+
+from bson import ObjectId, decode
+from bson.codec_options import CodecOptions
+from bson.decimal128 import Decimal128
+from bson.raw_bson import RawBSONDocument
+
+try:
+    import orjson  # type: ignore
+    ORJSON_AVAILABLE = True
+except Exception:
+    orjson = None  # type: ignore
+    ORJSON_AVAILABLE = False
+
+# Pass as `codec_options` to collection.with_options() to skip building dicts in pymongo
+RAW_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+
+def document_to_dict(doc):
+    """Decode a RawBSONDocument (or copy a dict) with a string `_id`"""
+    if isinstance(doc, RawBSONDocument):
+        doc = decode(doc.raw)  # a fresh dict, safe to modify
+    elif '_id' in doc and not isinstance(doc['_id'], str):
+        doc = dict(doc)
+    if '_id' in doc and not isinstance(doc['_id'], str):
+        doc['_id'] = str(doc['_id'])
+    return doc
+
+
+def _default(value):
+    if isinstance(value, RawBSONDocument):
+        return document_to_dict(value)
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal128):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _orjson_default(value):
+    if isinstance(value, RawBSONDocument):
+        return document_to_dict(value)
+    if isinstance(value, (ObjectId, Decimal128)):
+        return str(value)
+    raise TypeError
+
+
+def dumps(data, use_orjson=None):
+    """Serialize API data containing BSON documents to UTF-8 JSON bytes"""
+    if use_orjson is None:
+        use_orjson = ORJSON_AVAILABLE
+    if use_orjson:
+        return orjson.dumps(data, default=_orjson_default)
+    return json.dumps(data, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
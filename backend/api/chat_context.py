@@ -0,0 +1,125 @@
+"""Per-user cache of the recent conversation window used to prompt the chatbot.
+
+The first chat message from a user loads their last `HISTORY_WINDOW`
+exchanges from `chat_messages`; after that the window is kept up to date
+write-through as exchanges are saved, so the steady-state chat path does no
+history reads. Clearing history or renaming a user invalidates the entry.
+
+The cache is in-process by default. Set CHAT_CONTEXT_CACHE_BACKEND='django'
+to use Django's configured cache (e.g. Redis) and share windows across
+workers. Per-process windows can be stale by up to CHAT_CONTEXT_CACHE_TTL
+when one user's requests land on several workers.
+"""
+import logging
+import threading
+
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+HISTORY_WINDOW = 12  # exchanges (one chat_messages document each)
+
+
+def _setting(name, default):
+    try:
+        from django.conf import settings
+        return getattr(settings, name, default)
+    except Exception:
+        return default
+
+
+def _exchange(doc):
+    return {'user_message': doc.get('user_message') or '', 'bot_reply': doc.get('bot_reply') or ''}
+
+
+class ConversationCache:
+    def __init__(self, backend='local', maxsize=10000, ttl=900, window=HISTORY_WINDOW):
+        self.backend = backend
+        self.ttl = ttl
+        self.window = window
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def _key(self, username):
+        return f'chatctx:{username}'
+
+    def get(self, username):
+        """Return the cached chronological window for a user, or None on a miss"""
+        if self.backend == 'django':
+            from django.core.cache import cache
+            return cache.get(self._key(username))
+        return self._local.get(username)
+
+    def set(self, username, history_docs):
+        window = [_exchange(d) for d in history_docs][-self.window:]
+        if self.backend == 'django':
+            from django.core.cache import cache
+            cache.set(self._key(username), window, self.ttl)
+        else:
+            self._local.set(username, window)
+        return window
+
+    def append(self, username, doc):
+        """Write-through a newly saved exchange into a cached window (no-op on a miss)"""
+        if self.backend == 'django':
+            from django.core.cache import cache
+            window = cache.get(self._key(username))
+            if window is not None:
+                cache.set(self._key(username), (window + [_exchange(doc)])[-self.window:], self.ttl)
+            return
+        self._local.update(username, lambda window: (window + [_exchange(doc)])[-self.window:])
+
+    def invalidate(self, *usernames):
+        for username in usernames:
+            if not username:
+                continue
+            if self.backend == 'django':
+                from django.core.cache import cache
+                cache.delete(self._key(username))
+            else:
+                self._local.delete(username)
+
+    def stats(self):
+        if self.backend == 'django':
+            return {'backend': 'django'}
+        return dict(self._local.stats(), backend='local')
+
+
+_conversations = None
+_conversations_lock = threading.Lock()
+
+
+def get_conversation_cache():
+    global _conversations
+    if _conversations is None:
+        with _conversations_lock:
+            if _conversations is None:
+                _conversations = ConversationCache(
+                    backend=_setting('CHAT_CONTEXT_CACHE_BACKEND', 'local'),
+                    maxsize=int(_setting('CHAT_CONTEXT_CACHE_SIZE', 10000)),
+                    ttl=float(_setting('CHAT_CONTEXT_CACHE_TTL', 900)),
+                )
+    return _conversations
+
+
+def load_recent_exchanges(collection, username):
+    """Return the user's recent exchanges, reading `chat_messages` only on a cache miss"""
+    conversations = get_conversation_cache()
+    window = conversations.get(username)
+    if window is None:
+        cursor = collection.find(
+            {'username': username}, {'user_message': 1, 'bot_reply': 1}
+        ).sort([('created_at', -1), ('_id', -1)]).limit(conversations.window)
+        window = conversations.set(username, list(cursor)[::-1])  # chronological
+    return window
+
+
+async def aload_recent_exchanges(collection, username):
+    """`load_recent_exchanges` for an AsyncCollection"""
+    conversations = get_conversation_cache()
+    window = conversations.get(username)
+    if window is None:
+        cursor = collection.find(
+            {'username': username}, {'user_message': 1, 'bot_reply': 1}
+        ).sort([('created_at', -1), ('_id', -1)]).limit(conversations.window)
+        window = conversations.set(username, (await cursor.to_list())[::-1])
+    return window
@@ -9,6 +9,10 @@ except Exception:
 from typing import List, Dict, Any
 import os
 import logging
+import threading
+
+from .providers import LLMProvider, get_provider, get_router, reset_providers
+from .response_cache import get_response_cache
 
 MOODS = {"happy", "sad", "angry", "anxious", "calm"}
 
@@ -34,49 +38,193 @@ def _gemini_system_prompt(mood: str) -> str:
     return f"Tone: {style}\nGuidelines: {rules}"
 
 
-def generate_gemini_response(user_message: str, mood: str, history: List[Dict[str, Any]]) -> str | None:
-    """Use Google Gemini with mood-aware system prompt and short history."""
-    logger = logging.getLogger(__name__)
-    api_key = os.getenv('GEMINI_API_KEY') or os.getenv('GOOGLE_API_KEY')
-    if not GEMINI_AVAILABLE:
-        logger.info("Gemini SDK not available; ensure google-generativeai is installed")
-        return None
-    if not api_key:
-        logger.info("Gemini API key missing (GEMINI_API_KEY/GOOGLE_API_KEY)")
-        return None
-    try:
-        genai.configure(api_key=api_key)
-        model_name = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')
+def _to_gemini_history(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    chat_history = []
+    for turn in (history or [])[-8:]:
+        role = (turn.get('role') or '').lower()
+        content = (turn.get('content') or '').strip()
+        if not content:
+            continue
+        if role in {'assistant', 'bot', 'model'}:
+            chat_history.append({"role": "model", "parts": [{"text": content}]})
+        else:
+            chat_history.append({"role": "user", "parts": [{"text": content}]})
+    return chat_history
+
+
+class GeminiProvider(LLMProvider):
+    """Process-wide Gemini client, registered as the `gemini` provider.
+
+    The SDK is configured once and one GenerativeModel is kept per
+    (model name, system prompt); moods outside MOODS share the neutral prompt,
+    so the cache stays at a handful of entries. Models are reused across
+    threads; each request still gets its own chat session, which is a local
+    object holding that request's history.
+
+    Calls go through the circuit breaker and latency budget of LLMProvider.
+    """
+
+    name = 'gemini'
+
+    def __init__(self, api_key: str | None = None, model_name: str | None = None):
+        super().__init__()
+        self.api_key = api_key or os.getenv('GEMINI_API_KEY') or os.getenv('GOOGLE_API_KEY')
+        self.model_name = model_name or os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')
+        self._lock = threading.Lock()
+        self._configured = False
+        self._models: Dict[tuple, Any] = {}
+        self._generation_config = None
+
+    @property
+    def available(self) -> bool:
+        return GEMINI_AVAILABLE and bool(self.api_key)
+
+    def _configure(self):
+        if not self._configured:
+            genai.configure(api_key=self.api_key)
+            self._generation_config = genai.types.GenerationConfig(
+                max_output_tokens=350,
+                temperature=0.7,
+                top_p=0.9,
+            )
+            self._configured = True
+
+    def get_model(self, mood: str):
         system_instruction = _gemini_system_prompt(mood)
-        model = genai.GenerativeModel(model_name, system_instruction=system_instruction)
-
-        # Build chat history
-        chat_history = []
-        for turn in (history or [])[-8:]:
-            role = (turn.get('role') or '').lower()
-            content = (turn.get('content') or '').strip()
-            if not content:
-                continue
-            if role in {'assistant', 'bot', 'model'}:
-                chat_history.append({"role": "model", "parts": [{"text": content}]})
-            else:
-                chat_history.append({"role": "user", "parts": [{"text": content}]})
-
-        chat = model.start_chat(history=chat_history)
-        cfg = genai.types.GenerationConfig(
-            max_output_tokens=350,
-            temperature=0.7,
-            top_p=0.9,
-        )
-        resp = chat.send_message(user_message or '', generation_config=cfg)
+        key = (self.model_name, system_instruction)
+        model = self._models.get(key)
+        if model is None:
+            with self._lock:
+                self._configure()
+                model = self._models.get(key)
+                if model is None:
+                    model = genai.GenerativeModel(self.model_name, system_instruction=system_instruction)
+                    self._models[key] = model
+        return model
+
+    def _start_chat(self, mood: str, history: List[Dict[str, Any]]):
+        logger = logging.getLogger(__name__)
+        if not GEMINI_AVAILABLE:
+            logger.info("Gemini SDK not available; ensure google-generativeai is installed")
+            return None
+        if not self.api_key:
+            logger.info("Gemini API key missing (GEMINI_API_KEY/GOOGLE_API_KEY)")
+            return None
+        model = self.get_model(mood)
+        return model.start_chat(history=_to_gemini_history(history))
+
+    def _reply_text(self, resp) -> str | None:
+        logger = logging.getLogger(__name__)
         text = (resp.text or '').strip()
         if text:
-            logger.info(f"Gemini generation ok (model={model_name}, chars={len(text)})")
+            logger.info(f"Gemini generation ok (model={self.model_name}, chars={len(text)})")
             return text
-        else:
-            logger.warning("Gemini returned empty text; will fall back")
-            return None
-    except Exception as e:
-        logger.warning(f"Gemini generation error: {e}")
+        logger.warning("Gemini returned empty text; will fall back")
         return None
 
+    def _send(self, user_message: str, mood: str, history: List[Dict[str, Any]]) -> str | None:
+        chat = self._start_chat(mood, history)
+        if chat is None:
+            return None
+        resp = chat.send_message(
+            user_message or '', generation_config=self._generation_config,
+            request_options={'timeout': self.timeout},
+        )
+        return self._reply_text(resp)
+
+    async def _asend(self, user_message: str, mood: str, history: List[Dict[str, Any]]) -> str | None:
+        chat = self._start_chat(mood, history)
+        if chat is None:
+            return None
+        resp = await chat.send_message_async(
+            user_message or '', generation_config=self._generation_config,
+            request_options={'timeout': self.timeout},
+        )
+        return self._reply_text(resp)
+
+    def _stream(self, user_message: str, mood: str, history: List[Dict[str, Any]]):
+        chat = self._start_chat(mood, history)
+        if chat is None:
+            raise RuntimeError('Gemini is not available')
+        resp = chat.send_message(
+            user_message or '', generation_config=self._generation_config, stream=True,
+            request_options={'timeout': self.timeout},
+        )
+        for chunk in resp:
+            text = getattr(chunk, 'text', '') or ''
+            if text:
+                yield text
+
+
+def get_gemini_provider() -> GeminiProvider:
+    """Return the process-wide GeminiProvider, creating it on first use."""
+    return get_provider('gemini')
+
+
+def reset_gemini_provider():
+    """Drop cached providers so the next call re-reads env (tests, key rotation)."""
+    reset_providers()
+
+
+def generate_reply(user_message: str, mood: str, history: List[Dict[str, Any]]):
+    """Return (reply, provider) from the provider router, or (None, None).
+
+    When CHAT_RESPONSE_CACHE_ENABLED is set, repeated short prompts in the same
+    recent context are answered from api.response_cache, with provider 'cache'.
+    """
+    responses = get_response_cache()
+    key = responses.key(user_message, mood, history) if responses else None
+    cached = responses.get(key) if key is not None else None
+    if cached:
+        return cached, 'cache'
+    reply, provider = get_router().generate(user_message, mood, history)
+    if key is not None:
+        responses.set(key, reply)
+    return reply, provider
+
+
+def stream_reply(user_message: str, mood: str, history: List[Dict[str, Any]]):
+    """Return (provider, chunk iterator) for token streaming; the iterator raises if the provider fails."""
+    return get_router().stream(user_message, mood, history)
+
+
+async def agenerate_reply(user_message: str, mood: str, history: List[Dict[str, Any]]):
+    """Async variant of generate_reply for ASGI views."""
+    responses = get_response_cache()
+    key = responses.key(user_message, mood, history) if responses else None
+    cached = responses.get(key) if key is not None else None
+    if cached:
+        return cached, 'cache'
+    reply, provider = await get_router().agenerate(user_message, mood, history)
+    if key is not None:
+        responses.set(key, reply)
+    return reply, provider
+
+
+def history_to_messages(history_docs) -> List[Dict[str, Any]]:
+    """Turn chronological chat_messages documents into role/content turns."""
+    messages = []
+    for h in history_docs:
+        um = (h.get('user_message') or '').strip()
+        br = (h.get('bot_reply') or '').strip()
+        if um:
+            messages.append({"role": "user", "content": um})
+        if br:
+            messages.append({"role": "assistant", "content": br})
+    return messages
+
+
+def rule_based_reply(mood: str, message: str, username=None) -> str:
+    """Canned mood-specific reply used when no provider answers."""
+    name = (username or 'friend')
+    if mood in ['sad']:
+        return f"Hey {name}, I’m really sorry you’re going through this. It’s okay to feel heavy—try a small kindness for yourself, like a short walk or writing down one supportive thought. I’m here to listen."
+    if mood in ['angry']:
+        return f"I hear how strongly you feel, {name}. Your feelings matter. Would it help to take 3 slow breaths with a 4-6 count, or jot the main trigger down to revisit when calmer? I’m with you."
+    if mood in ['anxious']:
+        return f"Thanks for sharing, {name}. Let’s ground together: name 5 things you see, 4 you can touch, 3 you hear, 2 you smell, 1 you taste. Small steps are okay—you’re not alone."
+    if mood in ['happy']:
+        return f"Love the energy, {name}! What helped you feel this way today? Maybe bookmark it as a ‘go-to boost’ for tougher days. Keep shining!"
+    if mood in ['calm']:
+        return f"That sounds peaceful, {name}. You might anchor this with a short reflection or a few deep breaths to savor the calm. What would you like to explore next?"
+    return f"I’m here with you, {name}. Tell me more about what’s on your mind, and we’ll take it one step at a time."
@@ -0,0 +1,163 @@
+"""Bulk ingest of mood, journal and activity events.
+
+Offline-capable clients queue events and send them as one mixed array. Each
+event is validated and turned into the same document its single-item endpoint
+would write. IDs for each collection are reserved in one step, and every
+collection gets one unordered `insert_many`, so one bad document does not
+stop the rest. Results are returned per item, in request order.
+"""
+from datetime import datetime, timedelta, timezone
+import logging
+
+from pymongo.errors import BulkWriteError
+
+from backend.counter import Counter
+from .mood_stats import record_entries as record_mood_entries
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_EVENTS = 500
+CLOCK_SKEW = timedelta(minutes=5)
+
+
+class InvalidEvent(ValueError):
+    pass
+
+
+def _setting(name, default):
+    try:
+        from django.conf import settings
+        return getattr(settings, name, default)
+    except Exception:
+        return default
+
+
+def max_events():
+    return int(_setting('EVENTS_BATCH_MAX', DEFAULT_MAX_EVENTS))
+
+
+def _metadata(event):
+    metadata = event.get('metadata') or {}
+    if not isinstance(metadata, dict):
+        raise InvalidEvent('metadata must be an object')
+    return metadata
+
+
+def _mood(event):
+    mood = event.get('mood')
+    if not mood:
+        raise InvalidEvent('mood is required')
+    return {'mood': mood, 'mood_description': event.get('mood_description', mood)}
+
+
+def _journal(event):
+    content = (event.get('content') or '').strip()
+    if not content:
+        raise InvalidEvent('content is required')
+    return {'content': content, 'metadata': _metadata(event)}
+
+
+def _activity(event):
+    activity_key = (event.get('activity_key') or '').strip()
+    if not activity_key:
+        raise InvalidEvent('activity_key is required')
+    return {'activity_key': activity_key, 'metadata': _metadata(event)}
+
+
+# event type -> (collection, builder of the type-specific fields)
+EVENT_TYPES = {
+    'mood': ('mood_entries', _mood),
+    'journal': ('journal_entries', _journal),
+    'activity': ('activity_usages', _activity),
+}
+
+# collection -> callback(db, inserted docs), e.g. to keep rollups in step
+AFTER_INSERT = {
+    'mood_entries': record_mood_entries,
+}
+
+
+def _created_at(event, now):
+    """Client-side timestamp of a queued event, or now; never in the future"""
+    raw = event.get('created_at')
+    if not raw:
+        return now
+    try:
+        created_at = datetime.fromisoformat(str(raw).replace('Z', '+00:00'))
+    except ValueError:
+        raise InvalidEvent('created_at must be an ISO 8601 timestamp')
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    if created_at > now + CLOCK_SKEW:
+        raise InvalidEvent('created_at is in the future')
+    return min(created_at, now)
+
+
+def build_document(event, now=None):
+    """Validate one event; return (collection name, document without _id)"""
+    if not isinstance(event, dict):
+        raise InvalidEvent('event must be an object')
+    kind = event.get('type')
+    if kind not in EVENT_TYPES:
+        raise InvalidEvent(f"type must be one of {', '.join(EVENT_TYPES)}")
+    username = event.get('username')
+    if not username or not isinstance(username, str):
+        raise InvalidEvent('username is required')
+    collection_name, build = EVENT_TYPES[kind]
+    doc = {'username': username}
+    doc.update(build(event))
+    doc['created_at'] = _created_at(event, now or datetime.utcnow())
+    return collection_name, doc
+
+
+def ingest_events(db, events):
+    """Write a batch of events; return one result dict per event, in order.
+
+    Each result has `index` and `status` ('created', 'invalid' or 'failed'),
+    plus the new `id` or an `error` message.
+    """
+    now = datetime.utcnow()
+    results = [None] * len(events)
+    pending = {}  # collection -> [(index, doc)]
+    for index, event in enumerate(events):
+        try:
+            collection_name, doc = build_document(event, now)
+        except InvalidEvent as e:
+            results[index] = {'index': index, 'status': 'invalid', 'error': str(e)}
+            continue
+        pending.setdefault(collection_name, []).append((index, doc))
+
+    for collection_name, items in pending.items():
+        try:
+            ids = Counter.get_next_ids(collection_name, len(items))
+        except Exception as e:
+            logger.error(f"Bulk ingest could not allocate ids for {collection_name}: {e}")
+            for index, _ in items:
+                results[index] = {'index': index, 'status': 'failed', 'error': 'could not allocate id'}
+            continue
+        docs = []
+        for (index, doc), _id in zip(items, ids):
+            doc['_id'] = _id
+            docs.append(doc)
+            results[index] = {'index': index, 'status': 'created', 'id': str(_id)}
+
+        try:
+            db[collection_name].insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                index = items[error['index']][0]
+                results[index] = {'index': index, 'status': 'failed', 'error': error.get('errmsg', 'write failed')}
+            logger.warning(f"Bulk ingest into {collection_name}: {len(e.details.get('writeErrors', []))} of {len(docs)} failed")
+        except Exception as e:
+            logger.error(f"Bulk ingest into {collection_name} failed: {e}")
+            for index, _ in items:
+                results[index] = {'index': index, 'status': 'failed', 'error': 'write failed'}
+
+        after_insert = AFTER_INSERT.get(collection_name)
+        if after_insert:
+            written = [doc for (index, _), doc in zip(items, docs) if results[index]['status'] == 'created']
+            try:
+                after_insert(db, written)
+            except Exception as e:
+                logger.warning(f"Bulk ingest post-processing for {collection_name} failed: {e}")
+    return results
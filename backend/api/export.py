@@ -0,0 +1,82 @@
+"""Streaming export of a user's full history.
+
+Documents are pulled from pymongo cursors in `EXPORT_BATCH_SIZE` batches and
+encoded one at a time into buffered chunks, so memory use stays flat no matter
+how many entries the user has.
+"""
+import json
+
+from pymongo import ASCENDING
+
+from .bson_json import RAW_CODEC_OPTIONS, document_to_dict, dumps
+
+EXPORT_COLLECTIONS = ('mood_entries', 'journal_entries', 'activity_usages', 'chat_messages')
+DEFAULT_BATCH_SIZE = 500
+CHUNK_SIZE = 64 * 1024
+
+
+def encode_document(doc):
+    return dumps(doc).decode('utf-8')
+
+
+def _batch_size():
+    try:
+        from django.conf import settings
+        return int(getattr(settings, 'EXPORT_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+    except Exception:
+        return DEFAULT_BATCH_SIZE
+
+
+def iter_user_documents(db, collection_name, username, batch_size=None):
+    """Yield a user's documents oldest first, served by the per-user index"""
+    cursor = (
+        db[collection_name]
+        .with_options(codec_options=RAW_CODEC_OPTIONS)
+        .find({'username': username})
+        .sort([('created_at', ASCENDING), ('_id', ASCENDING)])
+        .batch_size(batch_size or _batch_size())
+    )
+    try:
+        yield from cursor
+    finally:
+        cursor.close()
+
+
+def _buffered(pieces):
+    """Join small string pieces into ~CHUNK_SIZE byte chunks"""
+    buffer, size = [], 0
+    for piece in pieces:
+        data = piece.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= CHUNK_SIZE:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _json_pieces(db, username, collections, batch_size):
+    yield '{"username":' + json.dumps(username)
+    for name in collections:
+        yield ',' + json.dumps(name) + ':['
+        first = True
+        for doc in iter_user_documents(db, name, username, batch_size):
+            yield encode_document(doc) if first else ',' + encode_document(doc)
+            first = False
+        yield ']'
+    yield '}'
+
+
+def _ndjson_pieces(db, username, collections, batch_size):
+    for name in collections:
+        for doc in iter_user_documents(db, name, username, batch_size):
+            doc = document_to_dict(doc)
+            doc['collection'] = name
+            yield encode_document(doc) + '\n'
+
+
+def stream_export(db, username, collections=EXPORT_COLLECTIONS, fmt='json', batch_size=None):
+    """Return an iterator of byte chunks for a JSON object or NDJSON export"""
+    pieces = _ndjson_pieces if fmt == 'ndjson' else _json_pieces
+    return _buffered(pieces(db, username, collections, batch_size))
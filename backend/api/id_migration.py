@@ -0,0 +1,384 @@
+"""Online migration of legacy ObjectId `_id`s to sequential ids.
+
+A document's `_id` cannot change in place. Each collection is therefore
+rebuilt in a shadow collection and swapped in while the app keeps serving:
+
+1. copy: a change stream on the collection is opened first and its resume
+   token is saved. The documents are then copied with the batch migration
+   framework (api/batch_migration.py). Sequential (numeric) ids are kept.
+   Every other id gets a new one: each chunk reserves its ids with one
+   counter `$inc` (`Counter.get_next_ids`), records old→new in `id_map` and
+   is written with one `bulk_write`. The counter is the live one, so new ids
+   never collide with documents the app inserts meanwhile.
+2. catch up: the indexes in INDEX_PLAN are built on the shadow. The writes
+   made since the stream was opened are then replayed from the saved token
+   onto it, in passes of at most CATCH_UP_PASS_CHUNKS chunks. Catching up
+   stops once a pass replays no more than ID_MIGRATION_CUTOVER_LAG writes,
+   or after ID_MIGRATION_CATCH_UP_PASSES passes if the app writes faster
+   than they are replayed.
+3. cut over: inserts and updates to the collection are blocked with a
+   validator that rejects every document, so the app gets a validation
+   error for them meanwhile. The remaining writes are replayed, then the
+   shadow replaces the collection with one `renameCollection` (dropTarget),
+   which is atomic and takes the block with the old collection. Deletes
+   are not blocked; those that reached the old collection before the rename
+   are read from the stream and applied to the new one.
+
+The phase and resume token are kept in `id_migrations`, so an interrupted
+run continues where it stopped. Afterwards, documents that point at a
+migrated collection are rewritten in bulk from `id_map` (`REFERENCES`).
+
+Change streams need a replica set. On a standalone server, use offline mode
+with the app stopped. Offline mode copies and swaps without catching up.
+"""
+from datetime import datetime
+import logging
+
+from pymongo import DeleteOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from backend.counter import Counter
+from .batch_migration import CHECKPOINT_COLLECTION, BatchMigration, MigrationRunner
+from .indexes import INDEX_PLAN, ensure_collection_indexes
+from .rename_jobs import JOBS_COLLECTION, RENAMED_COLLECTIONS
+
+logger = logging.getLogger(__name__)
+
+MAP_COLLECTION = 'id_map'
+STATE_COLLECTION = 'id_migrations'
+# BSON types of `_id` handled by the copy, each in its own pass (resume is per type)
+ID_TYPES = (('number', False), ('objectId', True), ('string', True))
+# Fields that hold another collection's `_id`: {referenced collection: [(collection, field)]}
+REFERENCES = {
+    'users': [(name, 'user_id') for name in RENAMED_COLLECTIONS + ('chat_sessions', JOBS_COLLECTION)],
+}
+END_EVENTS = ('drop', 'rename', 'dropDatabase', 'invalidate')
+# A catch-up pass ends after this many chunks even if the stream is still busy
+CATCH_UP_PASS_CHUNKS = 10
+# collMod options that make up a collection's validation; saved and restored around the write block
+VALIDATION_OPTIONS = ('validator', 'validationLevel', 'validationAction')
+
+
+def _setting(name, default):
+    try:
+        from django.conf import settings
+        return getattr(settings, name, default)
+    except Exception:
+        return default
+
+
+def shadow_name(name):
+    return f'{name}__sequential'
+
+
+def is_sequential(_id):
+    return isinstance(_id, (int, float)) and not isinstance(_id, bool)
+
+
+def legacy_count(db, name):
+    """Documents of a collection whose `_id` is not sequential yet"""
+    return db[name].count_documents({'_id': {'$not': {'$type': 'number'}}})
+
+
+def map_ids(db, name, old_ids):
+    """{old id: new id} for `old_ids`; ids mapped before are reused, the rest reserved in one step"""
+    old_ids = [i for i in old_ids if not is_sequential(i)]
+    if not old_ids:
+        return {}
+    known = {
+        m['old_id']: m['new_id']
+        for m in db[MAP_COLLECTION].find({'collection': name, 'old_id': {'$in': old_ids}}, {'old_id': 1, 'new_id': 1})
+    }
+    missing = list(dict.fromkeys(i for i in old_ids if i not in known))
+    if missing:
+        reserved = Counter.get_next_ids(name, len(missing))
+        db[MAP_COLLECTION].insert_many(
+            [{'collection': name, 'old_id': old, 'new_id': new} for old, new in zip(missing, reserved)], ordered=False,
+        )
+        known.update(zip(missing, reserved))
+    return known
+
+
+class CopyToShadow(BatchMigration):
+    """Copy the documents with one BSON type of `_id` into the shadow collection"""
+
+    def __init__(self, collection, id_type, renumber):
+        self.name = f'id_migration:{collection}:{id_type}'
+        self.collection = collection
+        self.target = shadow_name(collection)
+        self.query = {'_id': {'$type': id_type}}
+        self.renumber = renumber
+
+    def prepare(self, db):
+        self.db = db
+
+    def operations(self, chunk):
+        new_ids = map_ids(self.db, self.collection, [doc['_id'] for doc in chunk]) if self.renumber else {}
+        requests = []
+        for doc in chunk:
+            new_id = new_ids.get(doc['_id'], doc['_id'])
+            # Upserts keep a resumed chunk from failing on documents it already wrote
+            requests.append(ReplaceOne({'_id': new_id}, dict(doc, _id=new_id), upsert=True))
+        return requests
+
+
+class RewriteReferences(BatchMigration):
+    """Point `collection.field` at the new ids, one UpdateMany per mapped id"""
+    projection = {'old_id': 1, 'new_id': 1}
+
+    def __init__(self, referenced, collection, field):
+        self.name = f'id_references:{referenced}:{collection}.{field}'
+        self.collection = MAP_COLLECTION
+        self.target = collection
+        self.query = {'collection': referenced}
+        self.field = field
+
+    def operations(self, chunk):
+        # Older documents store the id as a string
+        return [
+            UpdateMany({self.field: {'$in': [m['old_id'], str(m['old_id'])]}}, {'$set': {self.field: m['new_id']}})
+            for m in chunk
+        ]
+
+
+def event_requests(db, name, events):
+    """Write requests that replay change events (with old ids) onto the migrated collection"""
+    keyed = [e for e in events if e.get('operationType') in ('insert', 'replace', 'update', 'delete')]
+    new_ids = map_ids(db, name, [e['documentKey']['_id'] for e in keyed])
+    requests = []
+    for event in keyed:
+        old_id = event['documentKey']['_id']
+        new_id = new_ids.get(old_id, old_id)
+        full = event.get('fullDocument')
+        if event['operationType'] == 'delete':
+            requests.append(DeleteOne({'_id': new_id}))
+        elif full is not None:
+            requests.append(ReplaceOne({'_id': new_id}, dict(full, _id=new_id), upsert=True))
+        elif event['operationType'] == 'update':
+            # Without a looked-up document (it was deleted or dropped since), apply the change itself
+            description = event.get('updateDescription') or {}
+            update = {}
+            if description.get('updatedFields'):
+                update['$set'] = description['updatedFields']
+            if description.get('removedFields'):
+                update['$unset'] = dict.fromkeys(description['removedFields'], '')
+            if update:
+                requests.append(UpdateOne({'_id': new_id}, update))
+    return requests
+
+
+def apply_requests(collection, requests):
+    """Apply replayed writes in order; a failing write is logged and skipped. Returns (applied, failed)"""
+    applied = failed = 0
+    while requests:
+        try:
+            collection.bulk_write(requests, ordered=True)
+            return applied + len(requests), failed
+        except BulkWriteError as e:
+            errors = (e.details or {}).get('writeErrors')
+            if not errors:
+                raise
+            index = errors[0]['index']
+            logger.error(f"Replaying a change to {collection.name} failed: {errors[0].get('errmsg', e)}")
+            applied += index
+            failed += 1
+            requests = requests[index + 1:]
+    return applied, failed
+
+
+class IdMigration:
+    """Runs the phases for one collection; every phase can be re-entered after an interruption"""
+
+    def __init__(self, db, name, chunk_size=None, max_rate=None, offline=False, report=None):
+        self.db = db
+        self.name = name
+        self.shadow = shadow_name(name)
+        self.chunk_size = max(1, int(chunk_size or _setting('MIGRATION_CHUNK_SIZE', 1000)))
+        self.cutover_lag = int(_setting('ID_MIGRATION_CUTOVER_LAG', 1000))
+        self.catch_up_passes = max(1, int(_setting('ID_MIGRATION_CATCH_UP_PASSES', 10)))
+        self.max_rate = max_rate
+        self.offline = offline
+        self.report = report
+        self.states = db[STATE_COLLECTION]
+
+    def _say(self, message):
+        logger.info(message)
+        if self.report:
+            self.report(message)
+
+    def _set(self, **fields):
+        fields['updated_at'] = datetime.utcnow()
+        self.states.update_one({'_id': self.name}, {'$set': fields}, upsert=True)
+
+    def _start(self, restart=False):
+        if restart:
+            # Throw away a half-built shadow and the copy checkpoints that belong to it
+            self.db[self.shadow].drop()
+            self.db[CHECKPOINT_COLLECTION].delete_many(
+                {'_id': {'$in': [CopyToShadow(self.name, t, r).name for t, r in ID_TYPES]}})
+        unsupported = self.db[self.name].count_documents(
+            {'$nor': [{'_id': {'$type': id_type}} for id_type, _ in ID_TYPES]})
+        if unsupported:
+            # The copy would leave them behind and the cutover would drop them
+            raise ValueError(f'{self.name} has {unsupported} documents with an _id that is not a number, ObjectId or string')
+        ensure_collection_indexes(self.db[MAP_COLLECTION])
+        token = None
+        if not self.offline:
+            # Opened before the copy so no write made during it is missed
+            with self.db[self.name].watch(full_document='updateLookup') as stream:
+                stream.try_next()
+                token = stream.resume_token
+        state = {
+            '_id': self.name, 'phase': 'copy', 'offline': self.offline, 'resume_token': token,
+            'copied': 0, 'replayed': 0, 'failed': 0, 'started_at': datetime.utcnow(), 'updated_at': datetime.utcnow(),
+        }
+        self.states.replace_one({'_id': self.name}, state, upsert=True)
+        return state
+
+    def _copy(self, state):
+        copied = failed = 0
+        for id_type, renumber in ID_TYPES:
+            migration = CopyToShadow(self.name, id_type, renumber)
+            progress = MigrationRunner(
+                self.db, migration, chunk_size=self.chunk_size, max_rate=self.max_rate,
+                report=lambda p, t=id_type: self._say(f'{self.name} ({t} ids): {p.scanned} copied ({p.rate:,.0f} docs/s)'),
+            ).run()
+            copied += progress.written
+            failed += progress.failed
+        if INDEX_PLAN.get(self.name):
+            self.db[self.shadow].create_indexes(INDEX_PLAN[self.name])
+        self._set(phase='catch_up', copied=copied, failed=state.get('failed', 0) + failed)
+        self._say(f'{self.name}: copied {copied} documents into {self.shadow}')
+
+    def _drain(self, target, token, limit=None):
+        """Replay the events after `token` onto `target` until the stream is idle or ends, or
+        `limit` events have been replayed.
+
+        Returns (resume token, replayed, failed, ended).
+        """
+        replayed = failed = 0
+        ended = False
+        with self.db[self.name].watch(full_document='updateLookup', resume_after=token) as stream:
+            while limit is None or replayed + failed < limit:
+                events, ended = [], False
+                while len(events) < self.chunk_size:
+                    event = stream.try_next()
+                    if event is None:
+                        break
+                    if event['operationType'] in END_EVENTS:
+                        ended = True
+                        break
+                    events.append(event)
+                if events:
+                    applied, errors = apply_requests(self.db[target], event_requests(self.db, self.name, events))
+                    replayed += applied
+                    failed += errors
+                token = stream.resume_token
+                self._set(resume_token=token)
+                if ended or len(events) < self.chunk_size:
+                    break
+        return token, replayed, failed, ended
+
+    def _catch_up(self, state):
+        token = state['resume_token']
+        replayed = failed = 0
+        for _ in range(self.catch_up_passes):
+            token, applied, errors, _ = self._drain(self.shadow, token, limit=CATCH_UP_PASS_CHUNKS * self.chunk_size)
+            replayed += applied
+            failed += errors
+            self._say(f'{self.name}: replayed {replayed} writes made during the migration')
+            if applied + errors <= self.cutover_lag:
+                break
+        else:
+            self._say(f'{self.name}: still behind after {self.catch_up_passes} passes; '
+                      f'the rest is replayed while writes are blocked')
+        self._set(phase='cutover', replayed=state.get('replayed', 0) + replayed, failed=state.get('failed', 0) + failed)
+
+    def _validation_options(self):
+        options = self.db[self.name].options()
+        return {key: options[key] for key in VALIDATION_OPTIONS if key in options}
+
+    def _block_writes(self):
+        """Make the collection reject inserts and updates; returns the validation options to restore"""
+        state = self.states.find_one({'_id': self.name})
+        if 'write_block' in state:
+            return state['write_block']  # blocked by an interrupted run
+        saved = self._validation_options()
+        self._set(write_block=saved)
+        self.db.command('collMod', self.name, validator={'$expr': False},
+                        validationLevel='strict', validationAction='error')
+        return saved
+
+    def _unblock_writes(self, saved):
+        self.db.command('collMod', self.name, **dict({'validator': {}}, **saved))
+        self.states.update_one({'_id': self.name}, {'$unset': {'write_block': ''}})
+
+    def _restore_validation(self, saved):
+        """Give the renamed collection the original's validation rules; the shadow was created without them"""
+        if saved:
+            self.db.command('collMod', self.name, **saved)
+
+    def _cutover(self, state):
+        if self.shadow in self.db.list_collection_names():
+            if self.offline:
+                saved = self._validation_options()
+                self.db[self.shadow].rename(self.name, dropTarget=True)
+                self._restore_validation(saved)
+            else:
+                saved = self._block_writes()
+                try:
+                    _, applied, errors, _ = self._drain(self.shadow, self.states.find_one({'_id': self.name})['resume_token'])
+                    state['replayed'] = state.get('replayed', 0) + applied
+                    state['failed'] = state.get('failed', 0) + errors
+                    self.db[self.shadow].rename(self.name, dropTarget=True)
+                except Exception:
+                    self._unblock_writes(saved)
+                    raise
+                # The block went away with the old collection
+                self._restore_validation(saved)
+                self.states.update_one({'_id': self.name}, {'$unset': {'write_block': ''}})
+            self._say(f'{self.name}: switched to sequential ids')
+        elif 'write_block' in self.states.find_one({'_id': self.name}):
+            # Interrupted between the rename and restoring the original's rules
+            self._restore_validation(self.states.find_one({'_id': self.name})['write_block'])
+            self.states.update_one({'_id': self.name}, {'$unset': {'write_block': ''}})
+        if not self.offline:
+            # Writes that reached the old collection after the last replay; it takes no new ones
+            _, applied, errors, _ = self._drain(self.name, self.states.find_one({'_id': self.name})['resume_token'])
+            state['replayed'] = state.get('replayed', 0) + applied
+            state['failed'] = state.get('failed', 0) + errors
+        self._set(phase='done', replayed=state.get('replayed', 0), failed=state.get('failed', 0),
+                  finished_at=datetime.utcnow())
+
+    def run(self, restart=False):
+        """Migrate the collection (or finish an interrupted migration); returns the final state"""
+        state = None if restart else self.states.find_one({'_id': self.name})
+        if state is None or state['phase'] == 'done':
+            state = self._start(restart=restart)
+        if state.get('offline', False) != self.offline:
+            raise ValueError(f"{self.name} was started {'offline' if state.get('offline') else 'online'}; "
+                             f"resume it the same way or restart it")
+        if state['phase'] == 'copy':
+            self._copy(state)
+            state = self.states.find_one({'_id': self.name})
+        if state['phase'] == 'catch_up':
+            if not self.offline:
+                self._catch_up(state)
+            else:
+                self._set(phase='cutover')
+            state = self.states.find_one({'_id': self.name})
+        if state['phase'] == 'cutover':
+            self._cutover(state)
+        return self.states.find_one({'_id': self.name})
+
+
+def rewrite_references(db, referenced, chunk_size=None, max_rate=None, report=None):
+    """Rewrite every field in REFERENCES that points at `referenced`; returns {(collection, field): written}"""
+    written = {}
+    for collection, field in REFERENCES.get(referenced, []):
+        progress = MigrationRunner(
+            db, RewriteReferences(referenced, collection, field), chunk_size=chunk_size, max_rate=max_rate,
+            report=report,
+        ).run()
+        written[(collection, field)] = progress.written
+    return written
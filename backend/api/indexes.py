@@ -0,0 +1,172 @@
+"""Declarative index plan for every MongoDB collection the API touches.
+
+`INDEX_PLAN` is the single source of truth: models apply it lazily, and the
+`initdb` management command applies it, diffs it against the live indexes and
+verifies (via explain) that every view query is served by an index.
+"""
+import logging
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+logger = logging.getLogger(__name__)
+
+
+def _by_user_recent(collection_name):
+    # _id breaks created_at ties for keyset pagination (see api/pagination.py)
+    return IndexModel([('username', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)],
+                      name=f'{collection_name}_username_created_at')
+
+
+def _by_user_id(collection_name):
+    # Lets migrate_to_sequential_ids rewrite user_id references without a collection scan per user
+    return IndexModel([('user_id', ASCENDING)], name=f'{collection_name}_user_id',
+                      partialFilterExpression={'user_id': {'$exists': True}})
+
+
+INDEX_PLAN = {
+    'users': [
+        IndexModel([('username', ASCENDING)], name='users_username_unique', unique=True),
+        # Only string emails participate, so legacy users without an email don't collide
+        IndexModel([('email', ASCENDING)], name='users_email_unique', unique=True,
+                   partialFilterExpression={'email': {'$type': 'string'}}),
+    ],
+    'mood_entries': [
+        _by_user_recent('mood_entries'),
+        # Supports migrate_mood_entries (legacy documents keyed by user_id, without username)
+        IndexModel([('user_id', ASCENDING)], name='mood_entries_legacy_user_id',
+                   partialFilterExpression={'user_id': {'$exists': True}}),
+    ],
+    'mood_daily_rollups': [
+        # Upsert key of the incremental $inc, and the stats range scan
+        IndexModel([('username', ASCENDING), ('day', ASCENDING)], name='mood_daily_rollups_username_day', unique=True),
+        _by_user_id('mood_daily_rollups'),
+    ],
+    'journal_entries': [_by_user_recent('journal_entries'), _by_user_id('journal_entries')],
+    'activity_usages': [
+        _by_user_recent('activity_usages'),
+        _by_user_id('activity_usages'),
+        # Incremental refresh of activity_daily_stats scans recent entries of all users
+        IndexModel([('created_at', ASCENDING)], name='activity_usages_created_at'),
+    ],
+    'activity_daily_stats': [
+        # $merge target key of the materialized view (must be unique)
+        IndexModel([('username', ASCENDING), ('activity_key', ASCENDING), ('day', ASCENDING)],
+                   name='activity_daily_stats_key', unique=True),
+        IndexModel([('day', ASCENDING)], name='activity_daily_stats_day'),
+        _by_user_id('activity_daily_stats'),
+    ],
+    'chat_messages': [_by_user_recent('chat_messages'), _by_user_id('chat_messages')],
+    'username_renames': [
+        # Per-user ordering of rename jobs, and the resume scan over unfinished ones
+        IndexModel([('user_id', ASCENDING), ('status', ASCENDING), ('created_at', ASCENDING)],
+                   name='username_renames_user_status'),
+        IndexModel([('status', ASCENDING), ('created_at', ASCENDING)], name='username_renames_status'),
+        # Usernames held back while a rename moves their documents (signup and profile checks)
+        IndexModel([('old_username', ASCENDING), ('status', ASCENDING)], name='username_renames_old_username'),
+    ],
+    'chat_sessions': [
+        IndexModel([('user_id', ASCENDING), ('updated_at', DESCENDING)], name='chat_sessions_user_id_updated_at'),
+    ],
+    'id_map': [
+        # Old -> new _id of documents renumbered by migrate_to_sequential_ids (see api/id_migration.py)
+        IndexModel([('collection', ASCENDING), ('old_id', ASCENDING)], name='id_map_collection_old_id', unique=True),
+    ],
+}
+
+# Index options that change index behaviour and therefore take part in the diff
+_COMPARED_OPTIONS = ('unique', 'sparse', 'partialFilterExpression', 'expireAfterSeconds')
+
+# Representative shape of every query the views issue: (collection, filter, sort)
+VIEW_QUERIES = [
+    ('users', {'username': '__probe__'}, None),
+    ('users', {'email': '__probe__'}, None),
+    # User.find_by_identifier and find_conflicts: each branch needs its own index or the $or scans
+    ('users', {'$or': [{'username': '__probe__'}, {'email': '__probe__'}]}, None),
+    ('mood_entries', {'username': '__probe__'}, [('created_at', DESCENDING), ('_id', DESCENDING)]),
+    ('mood_daily_rollups', {'username': '__probe__'}, [('day', ASCENDING)]),
+    ('journal_entries', {'username': '__probe__'}, [('created_at', DESCENDING), ('_id', DESCENDING)]),
+    ('activity_usages', {'username': '__probe__'}, [('created_at', DESCENDING), ('_id', DESCENDING)]),
+    ('chat_messages', {'username': '__probe__'}, [('created_at', DESCENDING), ('_id', DESCENDING)]),
+    ('chat_messages', {'username': '__probe__'}, [('created_at', ASCENDING), ('_id', ASCENDING)]),
+]
+
+
+def _spec(index_model):
+    doc = index_model.document
+    options = {k: doc[k] for k in _COMPARED_OPTIONS if k in doc}
+    return list(doc['key'].items()), options
+
+
+def ensure_collection_indexes(collection):
+    """Create the planned indexes for one collection (idempotent, one round-trip)"""
+    plan = INDEX_PLAN.get(collection.name)
+    if not plan:
+        return True
+    try:
+        collection.create_indexes(plan)
+        return True
+    except Exception as e:
+        logger.error(f"Error creating indexes for {collection.name}: {e}")
+        return False
+
+
+def diff_indexes(collection):
+    """Compare the planned indexes for a collection against the live ones.
+
+    Returns a dict with `missing` and `changed` plan entries (IndexModels) and
+    the names of `extra` live indexes the plan does not mention.
+    """
+    plan = INDEX_PLAN.get(collection.name, [])
+    live = collection.index_information()
+    missing, changed = [], []
+    for index_model in plan:
+        name = index_model.document['name']
+        if name not in live:
+            missing.append(index_model)
+            continue
+        keys, options = _spec(index_model)
+        info = live[name]
+        live_options = {k: info[k] for k in _COMPARED_OPTIONS if k in info}
+        if [tuple(k) for k in info['key']] != [tuple(k) for k in keys] or live_options != options:
+            changed.append(index_model)
+    planned = {m.document['name'] for m in plan}
+    extra = [name for name in live if name != '_id_' and name not in planned]
+    return {'missing': missing, 'changed': changed, 'extra': extra}
+
+
+def apply_diff(collection, diff, drop_extra=False):
+    """Bring a collection's indexes in line with the plan using a computed diff"""
+    for index_model in diff['changed']:
+        collection.drop_index(index_model.document['name'])
+    to_create = diff['missing'] + diff['changed']
+    if to_create:
+        collection.create_indexes(to_create)
+    if drop_extra:
+        for name in diff['extra']:
+            collection.drop_index(name)
+
+
+def _stages(plan):
+    """Yield every stage name in an explain() plan tree"""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _stages(item)
+
+
+def find_collscans(db):
+    """Explain every view query and return the ones that scan a whole collection"""
+    offenders = []
+    for collection_name, query, sort in VIEW_QUERIES:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = cursor.explain()
+        winning = explain.get('queryPlanner', {}).get('winningPlan', {})
+        if 'COLLSCAN' in set(_stages(winning)):
+            offenders.append((collection_name, query, sort))
+    return offenders
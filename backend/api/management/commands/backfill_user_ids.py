@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand, CommandError
+from pymongo import UpdateMany
+from backend.mongo import MongoDB
+from api.rename_jobs import RENAMED_COLLECTIONS
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Set a stable user_id (the users _id) on every per-user document that only has a username'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Users per bulk_write')
+        parser.add_argument('--collections', help='Comma-separated subset of: ' + ', '.join(RENAMED_COLLECTIONS))
+        parser.add_argument('--dry-run', action='store_true', help='Count documents that would be updated without writing')
+
+    def _flush(self, db, names, users, dry_run):
+        # One UpdateMany per user and collection; documents that already have user_id are skipped,
+        # so an interrupted run simply picks up where it stopped when started again
+        touched = 0
+        for name in names:
+            if dry_run:
+                touched += db[name].count_documents(
+                    {'username': {'$in': [u for u, _ in users]}, 'user_id': {'$exists': False}})
+                continue
+            result = db[name].bulk_write([
+                UpdateMany({'username': username, 'user_id': {'$exists': False}}, {'$set': {'user_id': user_id}})
+                for username, user_id in users
+            ], ordered=False)
+            touched += result.modified_count
+        return touched
+
+    def handle(self, *args, **options):
+        names = RENAMED_COLLECTIONS
+        if options['collections']:
+            names = [n.strip() for n in options['collections'].split(',') if n.strip()]
+            unknown = [n for n in names if n not in RENAMED_COLLECTIONS]
+            if unknown:
+                raise CommandError(f"Unknown collections: {', '.join(unknown)}")
+        dry_run = options['dry_run']
+        batch_size = options['batch_size']
+        try:
+            db = MongoDB.get_db()
+            start = time.perf_counter()
+            seen = touched = 0
+            batch = []
+            cursor = db['users'].find({'username': {'$type': 'string'}}, {'username': 1}).batch_size(batch_size)
+            for user in cursor:
+                batch.append((user['username'], user['_id']))
+                if len(batch) >= batch_size:
+                    touched += self._flush(db, names, batch, dry_run)
+                    seen += len(batch)
+                    batch = []
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(f'{seen} users, {touched} documents ({touched / elapsed:,.0f} docs/s)')
+            if batch:
+                touched += self._flush(db, names, batch, dry_run)
+                seen += len(batch)
+            elapsed = time.perf_counter() - start
+            orphaned = {name: db[name].count_documents({'user_id': {'$exists': False}}) for name in names} if not dry_run else {}
+        except Exception as e:
+            logger.error(f'Error backfilling user ids: {e}')
+            raise CommandError(f'Backfill failed: {e}')
+
+        verb = 'would update' if dry_run else 'updated'
+        self.stdout.write(self.style.SUCCESS(f'{seen} users in {elapsed:.2f}s; {verb} {touched} documents'))
+        for name, count in orphaned.items():
+            if count:
+                self.stdout.write(self.style.WARNING(f'{name}: {count} documents left without user_id (no matching user)'))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from rest_framework.request import Request
+from backend.mongo import MongoDB
+from api.authentication import SessionTokenAuthentication
+from api.tokens import issue_token, verify_token
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request cost of session token authentication (and, optionally, a users lookup for comparison)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000, help='Operations per measurement')
+        parser.add_argument('--compare-db', action='store_true', help='Also time a users find_one per request')
+
+    def _measure(self, label, fn, iterations):
+        fn()  # warm up
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        per_op = (time.perf_counter() - start) / iterations
+        self.stdout.write(f'{label:>24}: {per_op * 1e6:9.2f} µs/op  ({1 / per_op:,.0f} ops/s)')
+        return per_op
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        token, _ = issue_token(1, 'bench-user')
+        request = RequestFactory().get('/api/mood/stats/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        auth = SessionTokenAuthentication()
+
+        self.stdout.write(f'token: {len(token)} bytes')
+        self._measure('issue_token', lambda: issue_token(1, 'bench-user'), iterations)
+        self._measure('verify_token', lambda: verify_token(token), iterations)
+        per_request = self._measure('DRF authenticate', lambda: auth.authenticate(Request(request)), iterations)
+
+        if options['compare_db']:
+            try:
+                users = MongoDB.get_db()['users']
+                lookups = max(1, iterations // 20)
+                per_lookup = self._measure('users find_one', lambda: users.find_one({'username': 'bench-user'}), lookups)
+                self.stdout.write(f'token auth is {per_lookup / per_request:,.0f}x cheaper than one users lookup')
+            except Exception as e:
+                logger.error(f'users lookup benchmark failed: {e}')
+                self.stdout.write(self.style.ERROR(f'users lookup benchmark failed: {e}'))
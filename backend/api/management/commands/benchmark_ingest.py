@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from backend.mongo import MongoDB
+from api.views import ActivityUsageView, EventBatchView, JournalEntryView, MoodEntryView
+import json
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Compare events/sec through the single-item endpoints vs POST /api/events/batch/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=3000, help='Total events per run')
+        parser.add_argument('--batch-size', type=int, default=100, help='Events per batch request')
+
+    def _events(self, username, count):
+        kinds = [
+            {'type': 'mood', 'mood': 'calm'},
+            {'type': 'journal', 'content': 'Benchmark journal entry'},
+            {'type': 'activity', 'activity_key': 'breathing_exercise', 'metadata': {'duration_sec': 60}},
+        ]
+        return [dict(kinds[i % len(kinds)], username=username) for i in range(count)]
+
+    def _post(self, view, path, body):
+        request = self.factory.post(path, json.dumps(body), content_type='application/json')
+        return view(request)
+
+    def _cleanup(self, username):
+        db = MongoDB.get_db()
+        for name in ('mood_entries', 'journal_entries', 'activity_usages'):
+            db[name].delete_many({'username': username})
+
+    def handle(self, *args, **options):
+        self.factory = RequestFactory()
+        count = options['events']
+        batch_size = options['batch_size']
+        username = f'bench-ingest-{os.getpid()}'
+        singles = {
+            'mood': ('/api/mood/', MoodEntryView.as_view()),
+            'journal': ('/api/journal/', JournalEntryView.as_view()),
+            'activity': ('/api/activity-usage/', ActivityUsageView.as_view()),
+        }
+        batch_view = EventBatchView.as_view()
+        events = self._events(username, count)
+        try:
+            self._cleanup(username)
+
+            start = time.perf_counter()
+            for event in events:
+                path, view = singles[event['type']]
+                self._post(view, path, event)
+            single_elapsed = time.perf_counter() - start
+            self._cleanup(username)
+
+            start = time.perf_counter()
+            created = 0
+            for i in range(0, count, batch_size):
+                response = self._post(batch_view, '/api/events/batch/', {'events': events[i:i + batch_size]})
+                created += response.data.get('created', 0)
+            batch_elapsed = time.perf_counter() - start
+
+            if created != count:
+                self.stdout.write(self.style.WARNING(f'batch: expected {count} created, got {created}'))
+            self.stdout.write(f'{"single-item":>22}: {count} events in {single_elapsed:.2f}s, {count / single_elapsed:,.0f} events/s')
+            self.stdout.write(
+                f'{f"batch of {batch_size}":>22}: {count} events in {batch_elapsed:.2f}s, '
+                f'{count / batch_elapsed:,.0f} events/s ({single_elapsed / batch_elapsed:.1f}x)'
+            )
+        except Exception as e:
+            logger.error(f'Error during ingest benchmark: {e}')
+            self.stdout.write(self.style.ERROR(f'Benchmark failed: {e}'))
+        finally:
+            self._cleanup(username)
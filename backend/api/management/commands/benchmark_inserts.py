@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from backend.mongo import MongoDB
+from backend.counter import IdSequencer
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Compare insert throughput with per-insert counter round-trips vs block-reserved IDs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent writer threads')
+        parser.add_argument('--inserts', type=int, default=5000, help='Total inserts per run')
+        parser.add_argument('--block-size', type=int, default=1000, help='IDs reserved per round-trip in the block run')
+
+    def _run(self, sequencer, collection_name, workers, inserts):
+        db = MongoDB.get_db()
+        collection = db[collection_name]
+        collection.drop()
+        db['counters'].delete_one({'_id': collection_name})
+
+        def insert_one(i):
+            collection.insert_one({
+                '_id': sequencer.next_id(collection_name),
+                'username': f'bench-{i % 50}',
+                'created_at': datetime.utcnow(),
+            })
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(insert_one, range(inserts)))
+        elapsed = time.perf_counter() - start
+
+        count = collection.count_documents({})
+        collection.drop()
+        db['counters'].delete_one({'_id': collection_name})
+        return elapsed, count
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        inserts = options['inserts']
+        runs = [
+            ('per-insert counter', IdSequencer(block_size=1)),
+            (f'block of {options["block_size"]}', IdSequencer(block_size=options['block_size'])),
+        ]
+        try:
+            for label, sequencer in runs:
+                elapsed, count = self._run(sequencer, '_bench_inserts', workers, inserts)
+                if count != inserts:
+                    self.stdout.write(self.style.WARNING(f'{label}: expected {inserts} docs, found {count}'))
+                self.stdout.write(
+                    f'{label:>20}: {inserts} inserts, {workers} workers, '
+                    f'{elapsed:.2f}s, {inserts / elapsed:,.0f} inserts/s'
+                )
+        except Exception as e:
+            logger.error(f'Error during insert benchmark: {e}')
+            self.stdout.write(self.style.ERROR(f'Benchmark failed: {e}'))
@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from backend.mongo import MongoDB
+from api import utils
+from api.models import User, get_model
+from api.user_cache import get_user_cache
+from api.views import LoginView
+import hashlib
+import json
+import os
+import statistics
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+SCHEMES = {
+    'legacy': None,
+    'pbkdf2-sha256': {'PASSWORD_HASH_SCHEME': 'pbkdf2-sha256'},
+    'scrypt': {'PASSWORD_HASH_SCHEME': 'scrypt'},
+}
+
+
+def legacy_hash(password):
+    """The pre-versioning format: 64 hex chars of salt + hex PBKDF2-SHA512 (100k)"""
+    salt = os.urandom(32).hex().encode('ascii')
+    digest = hashlib.pbkdf2_hmac('sha512', password.encode('utf-8'), salt, utils.LEGACY_ITERATIONS)
+    return (salt + digest.hex().encode('ascii')).decode('ascii')
+
+
+class Command(BaseCommand):
+    help = 'Measure login throughput and latency per password hash scheme under concurrent load'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=200, help='Logins per scheme')
+        parser.add_argument('--concurrency', type=int, default=32, help='Concurrent login requests')
+        parser.add_argument('--schemes', default=','.join(SCHEMES), help='Comma-separated subset of: ' + ', '.join(SCHEMES))
+
+    def _login(self, username, password):
+        request = self.factory.post(
+            '/api/login/', json.dumps({'username': username, 'password': password}), content_type='application/json',
+        )
+        start = time.perf_counter()
+        response = self.view(request)
+        return response.status_code, time.perf_counter() - start
+
+    def _probe(self, stop, gaps):
+        # A cheap in-process task that should keep running while logins are hashing
+        while not stop.is_set():
+            start = time.perf_counter()
+            time.sleep(0.005)
+            gaps.append(time.perf_counter() - start - 0.005)
+
+    def _run(self, scheme, username, password, count, concurrency):
+        db = MongoDB.get_db()
+        stored = legacy_hash(password) if scheme == 'legacy' else utils.hash_password(password)
+        db['users'].update_one({'username': username}, {'$set': {'password_hash': stored}})
+        # LoginView reads through the user cache, which still holds the previous scheme's hash
+        get_user_cache().invalidate(username)
+
+        verified = set()
+
+        def verify(stored_password, provided_password):
+            verified.add(stored_password)
+            return utils.verify_password(stored_password, provided_password)
+
+        stop, gaps = threading.Event(), []
+        probe = threading.Thread(target=self._probe, args=(stop, gaps), daemon=True)
+        probe.start()
+        start = time.perf_counter()
+        with mock.patch('api.views.verify_password', verify), ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda _: self._login(username, password), range(count)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        probe.join()
+        if verified != {stored}:
+            raise RuntimeError(f'{scheme}: logins verified {len(verified)} other hash(es), not the one under test')
+
+        latencies = sorted(seconds for _, seconds in results)
+        codes = {}
+        for code, _ in results:
+            codes[code] = codes.get(code, 0) + 1
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+        self.stdout.write(
+            f'{scheme:>14}: {count / elapsed:8.1f} logins/s  '
+            f'p50 {statistics.median(latencies) * 1000:7.1f}ms  p95 {p95 * 1000:7.1f}ms  '
+            f'probe max stall {max(gaps, default=0) * 1000:6.1f}ms  status {codes}'
+        )
+
+    def handle(self, *args, **options):
+        self.factory = RequestFactory()
+        self.view = LoginView.as_view()
+        schemes = [name.strip() for name in options['schemes'].split(',') if name.strip()]
+        unknown = [name for name in schemes if name not in SCHEMES]
+        if unknown:
+            self.stdout.write(self.style.ERROR(f"Unknown schemes: {', '.join(unknown)}"))
+            return
+        username = f'bench-login-{os.getpid()}'
+        password = 'benchmark-password'
+        db = MongoDB.get_db()
+        try:
+            get_model(User).create_user(username, f'{username}@example.com', legacy_hash(password))
+            pool = utils.hasher_stats()
+            self.stdout.write(
+                f"hash pool: {pool['workers']} workers, {pool['capacity']} slots; {options['concurrency']} concurrent logins"
+            )
+            # Measure verification only: a rehash would move the user off the scheme under test
+            with mock.patch('api.views.needs_rehash', return_value=False):
+                for scheme in schemes:
+                    with override_settings(**(SCHEMES[scheme] or {})):
+                        self._run(scheme, username, password, options['logins'], options['concurrency'])
+        except Exception as e:
+            logger.error(f'Error during login benchmark: {e}')
+            self.stdout.write(self.style.ERROR(f'Benchmark failed: {e}'))
+        finally:
+            db['users'].delete_many({'username': username})
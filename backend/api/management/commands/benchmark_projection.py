@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand, CommandError
+from backend.mongo import MongoDB
+from api.projection import build_projection
+from bson import decode
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from datetime import datetime, timedelta
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Report bytes-on-wire and decode time for full vs projected list queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='Measure an existing user instead of generating a synthetic journal')
+        parser.add_argument('--collection', default='journal_entries', help='Collection to measure')
+        parser.add_argument('--entries', type=int, default=2000, help='Synthetic entries to generate')
+        parser.add_argument('--content-size', type=int, default=8000, help='Characters per synthetic journal entry')
+        parser.add_argument('--limit', type=int, default=100, help='Page size to fetch')
+
+    def _measure(self, collection, username, projection, limit):
+        raw_collection = collection.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+        start = time.perf_counter()
+        docs = list(raw_collection.find({'username': username}, projection).sort('created_at', -1).limit(limit))
+        fetch = time.perf_counter() - start
+        size = sum(len(doc.raw) for doc in docs)
+        start = time.perf_counter()
+        for doc in docs:
+            decode(doc.raw)
+        decode_time = time.perf_counter() - start
+        return len(docs), size, fetch, decode_time
+
+    def handle(self, *args, **options):
+        db = MongoDB.get_db()
+        username = options['username']
+        collection_name = options['collection']
+        collection = db[collection_name]
+        if not username:
+            collection_name = '_bench_projection'
+            collection = db[collection_name]
+            username = 'bench-user'
+            collection.drop()
+            now = datetime.utcnow()
+            body = ('Today I noticed how my breathing changed when I slowed down. ' * 200)[:options['content_size']]
+            collection.insert_many([
+                {'_id': i, 'username': username, 'content': body,
+                 'metadata': {'tags': ['reflection'] * 20, 'prompt': body[:500]},
+                 'created_at': now - timedelta(minutes=i)}
+                for i in range(options['entries'])
+            ])
+            collection.create_index([('username', 1), ('created_at', -1), ('_id', -1)])
+            plan_name = 'journal_entries'
+        else:
+            plan_name = collection_name
+
+        runs = [
+            ('full documents', None),
+            ('summary', build_projection(plan_name, summary=True)),
+            ('fields=_id,created_at', build_projection(plan_name, fields='_id,created_at')),
+        ]
+        try:
+            baseline = None
+            for label, projection in runs:
+                count, size, fetch, decode_time = self._measure(collection, username, projection, options['limit'])
+                if count == 0:
+                    raise CommandError(f'No documents for {username} in {collection_name}')
+                baseline = baseline or size
+                self.stdout.write(
+                    f'{label:>22}: {count} docs, {size / 1024:,.1f} KiB '
+                    f'({size / baseline:.0%} of full), fetch {fetch * 1000:.1f} ms, decode {decode_time * 1000:.2f} ms'
+                )
+        finally:
+            if collection_name == '_bench_projection':
+                collection.drop()
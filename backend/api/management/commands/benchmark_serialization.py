@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from api.bson_json import ORJSON_AVAILABLE, dumps
+from bson import ObjectId, decode, encode
+from bson.raw_bson import RawBSONDocument
+from datetime import datetime, timedelta
+import time
+
+class Command(BaseCommand):
+    help = 'Compare per-document mutation + DRF JSONRenderer with the shared BSON-to-JSON serializer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--documents', type=int, default=10000, help='Documents per response')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per path (best is reported)')
+
+    def _documents(self, count):
+        now = datetime.utcnow()
+        return [
+            {'_id': ObjectId() if i % 2 else i, 'username': 'bench-user', 'mood': 'calm',
+             'user_message': 'I feel a little better after the walk today.',
+             'bot_reply': 'That is wonderful to hear. What part of the walk helped the most?',
+             'metadata': {'duration_seconds': 120, 'source': 'web'},
+             'created_at': now - timedelta(seconds=i)}
+            for i in range(count)
+        ]
+
+    def handle(self, *args, **options):
+        count = options['documents']
+        docs = self._documents(count)
+        raw_docs = [RawBSONDocument(encode(doc)) for doc in docs]
+        renderer = JSONRenderer()
+
+        def mutation_path():
+            # Both paths start from raw BSON: pymongo decodes to dicts while iterating a cursor
+            items = []
+            for raw in raw_docs:
+                doc = decode(raw.raw)
+                doc['_id'] = str(doc['_id'])
+                if isinstance(doc.get('created_at'), datetime):
+                    doc['created_at'] = doc['created_at'].isoformat()
+                items.append(doc)
+            return renderer.render({'messages': items, 'count': len(items)})
+
+        runs = [
+            ('mutation + JSONRenderer', mutation_path),
+            ('bson_json (stdlib json)', lambda: dumps({'messages': raw_docs, 'count': count}, use_orjson=False)),
+        ]
+        if ORJSON_AVAILABLE:
+            runs.append(('bson_json (orjson)', lambda: dumps({'messages': raw_docs, 'count': count}, use_orjson=True)))
+
+        baseline = None
+        for label, fn in runs:
+            best = None
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                size = len(fn())
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            baseline = baseline or best
+            self.stdout.write(
+                f'{label:>26}: {count} docs, {best * 1000:.1f} ms, {size / 1024:,.0f} KiB, {baseline / best:.1f}x'
+            )
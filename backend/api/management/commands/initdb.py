@@ -1,17 +1,49 @@
-from django.core.management.base import BaseCommand
-from api.models.user import User
+from django.core.management.base import BaseCommand, CommandError
+from backend.mongo import MongoDB
+from api.indexes import INDEX_PLAN, apply_diff, diff_indexes, find_collscans
 
 class Command(BaseCommand):
-    help = 'Initialize the database with required indexes'
+    help = 'Initialize the database with the indexes declared in api/indexes.py'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only report differences from the index plan; exit non-zero on drift')
+        parser.add_argument('--drop-extra', action='store_true', help='Drop live indexes that are not in the plan')
+        parser.add_argument('--verify', action='store_true', help='Explain every view query and fail if any does a COLLSCAN')
 
     def handle(self, *args, **options):
+        db = MongoDB.get_db()
+        drift = False
         try:
-            # Create indexes for User model
-            User.create_indexes()
-            self.stdout.write(
-                self.style.SUCCESS('Successfully created MongoDB indexes')
-            )
+            for collection_name in INDEX_PLAN:
+                collection = db[collection_name]
+                diff = diff_indexes(collection)
+                for index_model in diff['missing']:
+                    self.stdout.write(f'{collection_name}: + {index_model.document["name"]}')
+                for index_model in diff['changed']:
+                    self.stdout.write(f'{collection_name}: ~ {index_model.document["name"]}')
+                for name in diff['extra']:
+                    marker = '-' if options['drop_extra'] else '?'
+                    self.stdout.write(f'{collection_name}: {marker} {name} (not in plan)')
+                if diff['missing'] or diff['changed'] or (options['drop_extra'] and diff['extra']):
+                    drift = True
+                    if not options['check']:
+                        apply_diff(collection, diff, drop_extra=options['drop_extra'])
         except Exception as e:
-            self.stderr.write(
-                self.style.ERROR(f'Error creating indexes: {str(e)}')
+            raise CommandError(f'Error creating indexes: {e}')
+
+        if options['check']:
+            if drift:
+                raise CommandError('Indexes differ from the plan; run initdb to apply it')
+            self.stdout.write(self.style.SUCCESS('Indexes match the plan'))
+        else:
+            self.stdout.write(
+                self.style.SUCCESS('Successfully created MongoDB indexes' if drift else 'Indexes already match the plan')
             )
+
+        if options['verify']:
+            offenders = find_collscans(db)
+            for collection_name, query, sort in offenders:
+                self.stderr.write(self.style.ERROR(f'COLLSCAN: {collection_name}.find({query}).sort({sort})'))
+            if offenders:
+                raise CommandError(f'{len(offenders)} view queries are not served by an index')
+            self.stdout.write(self.style.SUCCESS('All view queries use an index'))
@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand
+from django.test import AsyncRequestFactory, RequestFactory
+from api.async_views import AsyncChatbotView
+from api.views import ChatbotView
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import asyncio
+import time
+
+class Command(BaseCommand):
+    help = 'Load-test the sync and async chat endpoints against a fake LLM with artificial latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Concurrent chat requests to send')
+        parser.add_argument('--latency', type=float, default=1.0, help='Fake LLM latency in seconds')
+        parser.add_argument('--threads', type=int, default=8, help='Threads available to the sync worker')
+
+    def _report(self, label, latencies, elapsed):
+        latencies = sorted(latencies)
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(
+            f'{label:>28}: {len(latencies)} chats in {elapsed:.2f}s, '
+            f'{len(latencies) / elapsed:,.1f} chats/s, p50 {p50:.2f}s, p95 {p95:.2f}s'
+        )
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        latency = options['latency']
+        body = {'message': 'I feel a bit anxious today', 'mood': 'anxious'}
+
+        def fake_llm(user_message, mood, history):
+            time.sleep(latency)
+            return 'fake reply', 'fake'
+
+        async def afake_llm(user_message, mood, history):
+            await asyncio.sleep(latency)
+            return 'fake reply', 'fake'
+
+        # Sync: each in-flight chat holds one worker thread for the whole LLM call
+        sync_view = ChatbotView.as_view()
+        factory = RequestFactory()
+
+        def sync_call(_):
+            start = time.perf_counter()
+            sync_view(factory.post('/api/chat/', body, content_type='application/json'))
+            return time.perf_counter() - start
+
+        with mock.patch('api.views.generate_reply', fake_llm):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+                latencies = list(pool.map(sync_call, range(count)))
+            self._report(f'sync ({options["threads"]} threads)', latencies, time.perf_counter() - start)
+
+        # Async: one event loop, every chat awaits the LLM concurrently
+        async_view = AsyncChatbotView.as_view()
+        async_factory = AsyncRequestFactory()
+
+        async def async_call():
+            start = time.perf_counter()
+            await async_view(async_factory.post('/api/async/chat/', body, content_type='application/json'))
+            return time.perf_counter() - start
+
+        async def run_async():
+            return await asyncio.gather(*(async_call() for _ in range(count)))
+
+        with mock.patch('api.async_views.agenerate_reply', afake_llm):
+            start = time.perf_counter()
+            latencies = asyncio.run(run_async())
+            self._report('async (1 event loop)', latencies, time.perf_counter() - start)
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.providers import EchoProvider, ProviderRouter
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+import time
+
+class Command(BaseCommand):
+    help = 'Load-test provider routing offline against fake providers with configurable latency and error rate'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--provider', action='append', dest='providers', metavar='NAME:LATENCY[:ERROR_RATE[:JITTER]]',
+            help='Fake provider, e.g. fast:0.05 or flaky:0.02:0.3 (repeatable)',
+        )
+        parser.add_argument('--requests', type=int, default=1000, help='Chats to route')
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent callers')
+        parser.add_argument('--degrade-after', type=int, default=0,
+                            help='After this many chats, make the first provider 10x slower')
+
+    def _parse(self, spec, seed):
+        try:
+            parts = spec.split(':')
+            name, latency = parts[0], float(parts[1])
+            error_rate = float(parts[2]) if len(parts) > 2 else 0.0
+            jitter = float(parts[3]) if len(parts) > 3 else latency * 0.2
+        except (IndexError, ValueError):
+            raise CommandError(f'Bad --provider spec {spec!r}; expected NAME:LATENCY[:ERROR_RATE[:JITTER]]')
+        return EchoProvider(name, latency=latency, jitter=jitter, error_rate=error_rate, seed=seed)
+
+    def handle(self, *args, **options):
+        specs = options['providers'] or ['primary:0.20:0.02', 'secondary:0.05:0.01', 'flaky:0.02:0.4']
+        fakes = [self._parse(spec, seed) for seed, spec in enumerate(specs)]
+        router = ProviderRouter(fakes)
+        served = Counter()
+        latencies = []
+
+        def chat(i):
+            if options['degrade_after'] and i == options['degrade_after']:
+                fakes[0].latency *= 10
+                self.stdout.write(f'-- {fakes[0].name} degraded to {fakes[0].latency:.2f}s')
+            start = time.perf_counter()
+            reply, provider = router.generate('I feel a bit anxious today', 'anxious', [])
+            return time.perf_counter() - start, provider or 'rule-fallback'
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            for latency, provider in pool.map(chat, range(options['requests'])):
+                latencies.append(latency)
+                served[provider] += 1
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(
+            f'{len(latencies)} chats in {elapsed:.2f}s, {len(latencies) / elapsed:,.1f} chats/s, '
+            f'end-to-end p50 {p50 * 1000:.0f}ms, p95 {p95 * 1000:.0f}ms'
+        )
+        for name, stats in router.stats().items():
+            p50_ms = f"{stats['p50_ms']:.0f}ms" if stats['p50_ms'] is not None else '-'
+            p95_ms = f"{stats['p95_ms']:.0f}ms" if stats['p95_ms'] is not None else '-'
+            self.stdout.write(
+                f'{name:>12}: served {served[name]:>5}, window p50 {p50_ms}, p95 {p95_ms}, '
+                f"errors {stats['error_rate']:.0%}, circuit {stats['circuit']['state']} "
+                f"(trips {stats['circuit']['trips']})"
+            )
+        if served['rule-fallback']:
+            self.stdout.write(f"{'fallback':>12}: served {served['rule-fallback']:>5}")
@@ -1,84 +1,37 @@
-from django.core.management.base import BaseCommand
-from backend.mongo import MongoDB
-from api.models import User
+from pymongo import UpdateOne
+from api.batch_migration import BatchMigration, MigrationCommand, load_user_map
 import logging
 
 logger = logging.getLogger(__name__)
 
-class Command(BaseCommand):
-    help = 'Migrate mood entries from user_id to username and remove notes field'
 
-    def handle(self, *args, **options):
-        try:
-            db = MongoDB.get_db()
-            mood_collection = db['mood_entries']
-            users_collection = db['users']
-            
-            # Get all mood entries that still have user_id
-            mood_entries = list(mood_collection.find({"user_id": {"$exists": True}}))
-            
-            if not mood_entries:
-                self.stdout.write(
-                    self.style.SUCCESS('No mood entries to migrate.')
-                )
-                return
-            
-            self.stdout.write(f'Found {len(mood_entries)} mood entries to migrate.')
-            
-            migrated_count = 0
-            failed_count = 0
-            
-            for entry in mood_entries:
-                try:
-                    user_id = entry.get('user_id')
-                    if not user_id:
-                        continue
-                    
-                    # Find the user by ID to get username
-                    from bson import ObjectId
-                    user = users_collection.find_one({"_id": ObjectId(user_id)})
-                    
-                    if not user:
-                        self.stdout.write(
-                            self.style.WARNING(f'User not found for mood entry {entry["_id"]}')
-                        )
-                        failed_count += 1
-                        continue
-                    
-                    # Update the mood entry
-                    update_data = {
-                        "$set": {
-                            "username": user['username']
-                        },
-                        "$unset": {
-                            "user_id": "",
-                            "notes": ""  # Remove notes field if it exists
-                        }
-                    }
-                    
-                    result = mood_collection.update_one(
-                        {"_id": entry["_id"]},
-                        update_data
-                    )
-                    
-                    if result.modified_count > 0:
-                        migrated_count += 1
-                        self.stdout.write(f'Migrated mood entry {entry["_id"]}')
-                    else:
-                        failed_count += 1
-                        
-                except Exception as e:
-                    logger.error(f'Error migrating mood entry {entry.get("_id", "unknown")}: {e}')
-                    failed_count += 1
-            
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f'Migration completed. {migrated_count} entries migrated, {failed_count} failed.'
-                )
-            )
-            
-        except Exception as e:
-            logger.error(f'Error during mood entries migration: {e}')
-            self.stdout.write(
-                self.style.ERROR(f'Migration failed: {e}')
-            )
+class LegacyMoodEntries(BatchMigration):
+    name = 'migrate_mood_entries'
+    collection = 'mood_entries'
+    # Legacy entries are keyed by user_id and have no username
+    # (backfill_user_ids adds user_id next to username on current documents)
+    query = {'user_id': {'$exists': True}, 'username': {'$exists': False}}
+    projection = {'user_id': 1}
+
+    def prepare(self, db):
+        # Keyed by str(_id), so ObjectId strings and sequential ids both resolve
+        self.users = load_user_map(db)
+
+    def operations(self, chunk):
+        requests = []
+        for entry in chunk:
+            user = self.users.get(str(entry.get('user_id')))
+            if not user or not user.get('username'):
+                logger.warning(f'User not found for mood entry {entry["_id"]}')
+                continue
+            requests.append(UpdateOne(
+                {'_id': entry['_id'], 'username': {'$exists': False}},
+                # user_id stays as the stable users _id, the same as backfill_user_ids sets
+                {'$set': {'username': user['username'], 'user_id': user['_id']}, '$unset': {'notes': ''}},
+            ))
+        return requests
+
+
+class Command(MigrationCommand):
+    help = 'Migrate mood entries from user_id to username and remove notes field'
+    migration_class = LegacyMoodEntries
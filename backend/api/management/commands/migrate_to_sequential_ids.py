@@ -1,87 +1,67 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from backend.mongo import MongoDB
-from backend.counter import Counter
+from api.batch_migration import describe_progress
+from api.id_migration import REFERENCES, STATE_COLLECTION, IdMigration, legacy_count, rewrite_references
+import time
 import logging
 
 logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
-    help = 'Migrate existing ObjectId records to sequential IDs starting from 1'
+    help = 'Give documents with ObjectId (or string) _ids sequential ids while the app keeps serving'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collections', default='users,mood_entries,chat_sessions', help='Comma-separated collections to migrate')
+        parser.add_argument('--chunk-size', type=int, help='Documents per bulk_write (default MIGRATION_CHUNK_SIZE)')
+        parser.add_argument('--max-rate', type=float, help='Documents per second to stay under while copying (0 = no limit)')
+        parser.add_argument('--offline', action='store_true', help='Copy and swap without a change stream (standalone servers; stop the app first)')
+        parser.add_argument('--restart', action='store_true', help='Discard an interrupted migration and start it over')
+        parser.add_argument('--references-only', action='store_true', help='Only rewrite stored references from id_map')
+        parser.add_argument('--dry-run', action='store_true', help='Count documents that would get new ids')
 
     def handle(self, *args, **options):
+        names = [n.strip() for n in options['collections'].split(',') if n.strip()]
         try:
             db = MongoDB.get_db()
-            
-            # Collections to migrate
-            collections_to_migrate = ['users', 'mood_entries', 'chat_sessions']
-            
-            for collection_name in collections_to_migrate:
-                self.stdout.write(f'Migrating {collection_name}...')
-                collection = db[collection_name]
-                
-                # Get all existing records
-                existing_records = list(collection.find({}))
-                
-                if not existing_records:
-                    self.stdout.write(f'No records found in {collection_name}')
+            if options['dry_run']:
+                for name in names:
+                    self.stdout.write(f'{name}: {legacy_count(db, name)} documents would get sequential ids')
+                return
+
+            migrated = []
+            for name in names:
+                if options['references_only']:
+                    migrated.append(name)
+                    continue
+                state = db[STATE_COLLECTION].find_one({'_id': name})
+                unfinished = state is not None and state['phase'] != 'done'
+                if not unfinished and not options['restart'] and not legacy_count(db, name):
+                    self.stdout.write(f'{name}: already sequential')
                     continue
-                
-                # Reset counter to 0 to start from 1
-                Counter.reset_counter(collection_name, 0)
-                
-                # Create new collection with sequential IDs
-                temp_collection_name = f"{collection_name}_temp"
-                temp_collection = db[temp_collection_name]
-                
-                migrated_count = 0
-                failed_count = 0
-                
-                for record in existing_records:
-                    try:
-                        # Get next sequential ID
-                        new_id = Counter.get_next_id(collection_name)
-                        
-                        # Create new record with sequential ID
-                        new_record = record.copy()
-                        old_id = new_record.pop('_id')  # Remove old ObjectId
-                        new_record['_id'] = new_id
-                        
-                        # Insert into temp collection
-                        temp_collection.insert_one(new_record)
-                        migrated_count += 1
-                        
-                        self.stdout.write(f'Migrated {collection_name} record: {old_id} -> {new_id}')
-                        
-                    except Exception as e:
-                        logger.error(f'Error migrating record in {collection_name}: {e}')
-                        failed_count += 1
-                
-                # Replace original collection with migrated data
-                if migrated_count > 0:
-                    # Drop original collection
-                    collection.drop()
-                    
-                    # Rename temp collection to original name
-                    temp_collection.rename(collection_name)
-                    
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f'Successfully migrated {collection_name}: {migrated_count} records, {failed_count} failed'
-                        )
-                    )
-                else:
-                    # Clean up temp collection if no records were migrated
-                    temp_collection.drop()
-                    self.stdout.write(
-                        self.style.WARNING(f'No records migrated for {collection_name}')
-                    )
-            
-            self.stdout.write(
-                self.style.SUCCESS('Migration to sequential IDs completed!')
-            )
-            
+                start = time.perf_counter()
+                state = IdMigration(
+                    db, name, chunk_size=options['chunk_size'], max_rate=options['max_rate'], offline=options['offline'],
+                    report=self.stdout.write,
+                ).run(restart=options['restart'])
+                migrated.append(name)
+                self.stdout.write(self.style.SUCCESS(
+                    f"{name}: {state['copied']} copied, {state['replayed']} concurrent writes replayed, "
+                    f"{state['failed']} failed in {time.perf_counter() - start:.2f}s"
+                ))
+
+            for name in migrated:
+                for (collection, field), written in rewrite_references(
+                    db, name, chunk_size=options['chunk_size'], max_rate=options['max_rate'],
+                    report=lambda progress: self.stdout.write(describe_progress(progress)),
+                ).items():
+                    self.stdout.write(f'{collection}.{field}: {written} references to {name} rewritten')
         except Exception as e:
             logger.error(f'Error during migration: {e}')
-            self.stdout.write(
-                self.style.ERROR(f'Migration failed: {e}')
-            )
+            raise CommandError(f'Migration failed: {e} (run it again to resume)')
+
+        if any(name in REFERENCES for name in migrated):
+            self.stdout.write(self.style.WARNING(
+                'Processes may still hold old ids in their user cache for USER_CACHE_TTL seconds; '
+                'run again with --references-only after that. Session tokens issued for old user ids are now rejected '
+                'with 401, so those users have to log in again.'
+            ))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from backend.mongo import MongoDB
+from api.indexes import ensure_collection_indexes
+from api.mood_stats import ROLLUP_COLLECTION, rebuild_rollups
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Rebuild mood_daily_rollups from mood_entries (all users, or one with --username)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='Only rebuild this user\'s rollups')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Cursor batch and bulk write size')
+        parser.add_argument('--dry-run', action='store_true', help='Count entries and rollups without writing')
+
+    def handle(self, *args, **options):
+        try:
+            db = MongoDB.get_db()
+            if not options['dry_run']:
+                ensure_collection_indexes(db[ROLLUP_COLLECTION])
+            start = time.perf_counter()
+            scanned, written, removed = rebuild_rollups(
+                db, username=options['username'], batch_size=options['batch_size'], dry_run=options['dry_run'],
+            )
+            elapsed = time.perf_counter() - start
+        except Exception as e:
+            logger.error(f'Error rebuilding mood rollups: {e}')
+            raise CommandError(f'Rebuild failed: {e}')
+
+        verb = 'would write' if options['dry_run'] else 'wrote'
+        self.stdout.write(self.style.SUCCESS(
+            f'Scanned {scanned} mood entries in {elapsed:.2f}s; {verb} {written} daily rollups'
+            + ('' if options['dry_run'] else f', removed {removed} stale')
+        ))
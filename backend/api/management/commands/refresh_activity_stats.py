@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from backend.mongo import MongoDB
+from api.activity_analytics import DAILY_STATS_COLLECTION, refresh_daily_stats
+from api.indexes import ensure_collection_indexes
+from datetime import datetime, timedelta
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Refresh the activity_daily_stats materialized view from activity_usages with $merge'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2,
+                            help='Recompute this many most recent UTC days (default 2, enough for an hourly cron)')
+        parser.add_argument('--full', action='store_true', help='Recompute every day in history')
+
+    def handle(self, *args, **options):
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        since = None if options['full'] else today - timedelta(days=max(1, options['days']) - 1)
+        try:
+            db = MongoDB.get_db()
+            # $merge needs the unique index on its `on` fields to exist
+            ensure_collection_indexes(db[DAILY_STATS_COLLECTION])
+            start = time.perf_counter()
+            refresh_daily_stats(db, since=since)
+            elapsed = time.perf_counter() - start
+            rows = db[DAILY_STATS_COLLECTION].count_documents({'day': {'$gte': since}} if since else {})
+        except Exception as e:
+            logger.error(f'Error refreshing activity stats: {e}')
+            raise CommandError(f'Refresh failed: {e}')
+        scope = 'all days' if since is None else f'days since {since:%Y-%m-%d}'
+        self.stdout.write(self.style.SUCCESS(f'Refreshed {rows} daily stats rows ({scope}) in {elapsed:.2f}s'))
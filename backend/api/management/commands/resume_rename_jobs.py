@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from backend.mongo import MongoDB
+from api.indexes import ensure_collection_indexes
+from api.rename_jobs import JOBS_COLLECTION, describe, resume_jobs
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Resume unfinished background username renames (failed, or stalled past their lease)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Documents moved per update_many (default RENAME_JOB_BATCH_SIZE)')
+        parser.add_argument('--concurrency', type=int, help='Collections moved in parallel (default RENAME_JOB_CONCURRENCY)')
+
+    def handle(self, *args, **options):
+        try:
+            db = MongoDB.get_db()
+            ensure_collection_indexes(db[JOBS_COLLECTION])
+            start = time.perf_counter()
+            jobs = resume_jobs(db, batch_size=options['batch_size'], concurrency=options['concurrency'])
+            elapsed = time.perf_counter() - start
+        except Exception as e:
+            logger.error(f'Error resuming rename jobs: {e}')
+            raise CommandError(f'Resume failed: {e}')
+
+        for job in jobs:
+            info = describe(job)
+            moved = sum(info['progress'].values())
+            line = f"{info['id']}: {info['old_username']} -> {info['new_username']} {info['status']} ({moved} documents moved)"
+            self.stdout.write(self.style.SUCCESS(line) if info['status'] == 'done' else self.style.WARNING(line))
+        self.stdout.write(f'Ran {len(jobs)} rename jobs in {elapsed:.2f}s')
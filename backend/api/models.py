@@ -1,8 +1,14 @@
 from datetime import datetime
 from bson import ObjectId
 import logging
+import os
+import threading
 from backend.mongo import MongoDB
 from backend.counter import Counter
+from .indexes import INDEX_PLAN, ensure_collection_indexes
+from .mood_stats import record_entry as record_mood_entry
+from .user_cache import get_user_cache
+from .write_behind import get_activity_buffer
 
 logger = logging.getLogger(__name__)
 
@@ -14,23 +20,16 @@ class MongoModel:
         self.collection = MongoDB.get_db()[collection_name]
     
     def create_indexes(self):
-        """Create indexes for the collection"""
+        """Create the planned indexes for the collection (see api/indexes.py)"""
         if self.collection is None:
             return False
-        try:
-            # Create indexes as needed
-            self.collection.create_index("created_at")
-            return True
-        except Exception as e:
-            logger.error(f"Error creating indexes: {e}")
-            return False
+        return ensure_collection_indexes(self.collection)
 
 class User(MongoModel):
     """User model for MongoDB"""
     
     def __init__(self):
         super().__init__("users")
-        self.create_indexes()
     
     def create_user(self, username, email, password_hash, phone=None, address=None):
         """Create a new user"""
@@ -81,16 +80,79 @@ class User(MongoModel):
         except Exception as e:
             logger.error(f"Error finding user: {e}")
             return None
+    
+    def find_by_identifier(self, identifier, cached=True):
+        """Find user by username or email in one query; a username match wins.
+
+        With `cached`, reads through the process-wide user cache (see
+        api/user_cache.py). Write paths pass cached=False to get a fresh record.
+        """
+        if self.collection is None or not identifier:
+            return None
+        
+        cache = get_user_cache()
+        if cached:
+            user = cache.get(identifier)
+            if user is not None:
+                return user
+        try:
+            matches = list(self.collection.find(
+                {"$or": [{"username": identifier}, {"email": identifier}]}
+            ).limit(2))
+        except Exception as e:
+            logger.error(f"Error finding user: {e}")
+            return None
+        user = next((m for m in matches if m.get("username") == identifier), None) or next(iter(matches), None)
+        if user is not None:
+            cache.set(user)
+        return user
+    
+    def find_by_id(self, user_id):
+        """Find user by `_id`, given as stored or in its string form (as in session tokens)"""
+        if self.collection is None or user_id is None:
+            return None
+        candidates = [user_id]
+        if isinstance(user_id, str):
+            if user_id.isdigit():
+                candidates.append(int(user_id))
+            if ObjectId.is_valid(user_id):
+                candidates.append(ObjectId(user_id))
+        try:
+            user = self.collection.find_one({"_id": {"$in": candidates}})
+        except Exception as e:
+            logger.error(f"Error finding user: {e}")
+            return None
+        if user is not None:
+            get_user_cache().set(user)
+        return user
+    
+    def find_conflicts(self, username=None, email=None, exclude_id=None):
+        """Return (username taken, email taken) by another user, in one query"""
+        clauses = []
+        if username:
+            clauses.append({"username": username})
+        if email:
+            clauses.append({"email": email})
+        if self.collection is None or not clauses:
+            return False, False
+        
+        query = {"$or": clauses}
+        if exclude_id is not None:
+            query["_id"] = {"$ne": exclude_id}
+        matches = list(self.collection.find(query, {"username": 1, "email": 1}).limit(2))
+        return (
+            any(m.get("username") == username for m in matches) if username else False,
+            any(m.get("email") == email for m in matches) if email else False,
+        )
 
 class MoodEntry(MongoModel):
     """Mood tracking entry model"""
     
     def __init__(self):
         super().__init__("mood_entries")
-        self.create_indexes()
     
-    def create_entry(self, username, mood_description):
-        """Create a new mood entry"""
+    def create_entry(self, username, mood_description, mood=None):
+        """Create a new mood entry and count it in the user's daily rollup"""
         if self.collection is None:
             return None
         
@@ -100,16 +162,22 @@ class MoodEntry(MongoModel):
         entry_data = {
             "_id": entry_id,
             "username": username,
+            "mood": mood or mood_description,
             "mood_description": mood_description,
             "created_at": datetime.utcnow()
         }
         
         try:
             result = self.collection.insert_one(entry_data)
-            return entry_data
         except Exception as e:
             logger.error(f"Error creating mood entry: {e}")
             return None
+        try:
+            record_mood_entry(MongoDB.get_db(), entry_data)
+        except Exception as e:
+            # The entry is saved; rebuild_mood_rollups repairs the missed increment
+            logger.warning(f"Failed to update mood rollup for entry {entry_id}: {e}")
+        return entry_data
     
     def get_user_entries(self, username, limit=50):
         """Get mood entries for a specific user"""
@@ -128,7 +196,6 @@ class ChatSession(MongoModel):
     
     def __init__(self):
         super().__init__("chat_sessions")
-        self.create_indexes()
     
     def create_session(self, user_id, initial_message):
         """Create a new chat session"""
@@ -176,12 +243,13 @@ class ActivityUsage(MongoModel):
     
     def __init__(self):
         super().__init__("activity_usages")
-        self.create_indexes()
     
     def create_entry(self, username: str, activity_key: str, metadata: dict | None = None):
         """Create a usage entry for a given activity.
         activity_key: a stable identifier for the activity (e.g., 'breathing_exercise', 'journal', 'gratitude').
         metadata: optional extra info like duration, outcome, etc.
+        With ACTIVITY_WRITE_BEHIND on, the insert is queued (see api/write_behind.py)
+        and falls back to a synchronous insert only when the queue is full.
         """
         if self.collection is None:
             return None
@@ -194,7 +262,9 @@ class ActivityUsage(MongoModel):
                 "metadata": metadata or {},
                 "created_at": datetime.utcnow(),
             }
-            self.collection.insert_one(doc)
+            buffer = get_activity_buffer()
+            if buffer is None or not buffer.submit(doc):
+                self.collection.insert_one(doc)
             return doc
         except Exception as e:
             logger.error(f"Error creating activity usage: {e}")
@@ -215,7 +285,6 @@ class JournalEntry(MongoModel):
     """Journaling entries written by users"""
     def __init__(self):
         super().__init__("journal_entries")
-        self.create_indexes()
 
     def create_entry(self, username: str, content: str, metadata: dict | None = None):
         if self.collection is None:
@@ -244,3 +313,58 @@ class JournalEntry(MongoModel):
         except Exception as e:
             logger.error(f"Error getting journal entries: {e}")
             return []
+
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+_indexes_ensured_pid = None
+
+
+def _ensure_indexes_on_first_use():
+    try:
+        from django.conf import settings
+        return bool(getattr(settings, 'MONGO_ENSURE_INDEXES_ON_STARTUP', True))
+    except Exception:
+        return True
+
+
+def get_model(model_class):
+    """Return the process-wide instance of a model, building it on first use.
+
+    Instances are rebuilt after a fork so they never hold a collection bound to
+    the parent's client. The first model built in a process also applies the
+    whole index plan once (unless MONGO_ENSURE_INDEXES_ON_STARTUP is off, in
+    which case `initdb` owns index builds).
+    """
+    global _indexes_ensured_pid
+    pid = os.getpid()
+    entry = _registry.get(model_class)
+    if entry is not None and entry[0] == pid:
+        return entry[1]
+    with _registry_lock:
+        entry = _registry.get(model_class)
+        if entry is None or entry[0] != pid:
+            if _indexes_ensured_pid is None and _ensure_indexes_on_first_use():
+                ensure_indexes()
+                _indexes_ensured_pid = pid
+            entry = (pid, model_class())
+            _registry[model_class] = entry
+        return entry[1]
+
+
+def ensure_indexes(collection_names=None):
+    """Apply the index plan to the given collections (all planned ones by default)"""
+    db = MongoDB.get_db()
+    return {
+        name: ensure_collection_indexes(db[name])
+        for name in (collection_names or INDEX_PLAN)
+    }
+
+
+def reset_registry():
+    """Drop cached model instances (used by tests and after reconnecting)"""
+    global _indexes_ensured_pid
+    with _registry_lock:
+        _registry.clear()
+        _indexes_ensured_pid = None
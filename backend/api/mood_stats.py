@@ -0,0 +1,199 @@
+"""Pre-aggregated mood statistics.
+
+Each mood entry also bumps a `mood_daily_rollups` document, with one document
+per (username, UTC day):
+
+    {username, day, total, moods: {<mood>: count}}
+
+The stats endpoint reads at most one rollup per day of the requested window,
+plus the `day` keys of the user's rollups for streaks. Its cost therefore
+grows with the number of days, not the number of entries. The
+`rebuild_mood_rollups` command recomputes rollups from `mood_entries` when
+they drift, e.g. after a failed increment or a manual data fix.
+"""
+from collections import Counter as Tally
+from datetime import datetime, timedelta
+import logging
+import re
+
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_COLLECTION = 'mood_daily_rollups'
+PERIODS = ('day', 'week', 'month')
+DEFAULT_DAYS = 30
+MAX_DAYS = 730
+
+
+class InvalidStatsQuery(ValueError):
+    pass
+
+
+def mood_key(mood):
+    """Normalize a mood label into a safe field name under `moods`"""
+    key = re.sub(r'[.$\s]+', '_', str(mood or '').strip().lower())[:64].strip('_')
+    return key or 'unknown'
+
+
+def entry_mood(doc):
+    return doc.get('mood') or doc.get('mood_description')
+
+
+def day_of(moment):
+    return datetime(moment.year, moment.month, moment.day)
+
+
+def rollup_update(username, day, counts):
+    """Upsert that adds `counts` ({mood key: n}) to one user's rollup for a day"""
+    inc = {f'moods.{key}': n for key, n in counts.items()}
+    inc['total'] = sum(counts.values())
+    return UpdateOne({'username': username, 'day': day}, {'$inc': inc}, upsert=True)
+
+
+def record_entry(db, doc):
+    """Count one newly inserted mood entry in its daily rollup"""
+    db[ROLLUP_COLLECTION].update_one(
+        {'username': doc['username'], 'day': day_of(doc['created_at'])},
+        {'$inc': {'total': 1, f'moods.{mood_key(entry_mood(doc))}': 1}},
+        upsert=True,
+    )
+
+
+def record_entries(db, docs):
+    """Count a batch of newly inserted mood entries with one bulk write"""
+    groups = {}
+    for doc in docs:
+        key = (doc['username'], day_of(doc['created_at']))
+        groups.setdefault(key, Tally())[mood_key(entry_mood(doc))] += 1
+    if groups:
+        db[ROLLUP_COLLECTION].bulk_write(
+            [rollup_update(username, day, counts) for (username, day), counts in groups.items()],
+            ordered=False,
+        )
+
+
+def _period_key(day, period):
+    if period == 'week':
+        year, week, _ = day.isocalendar()
+        return f'{year}-W{week:02d}'
+    if period == 'month':
+        return day.strftime('%Y-%m')
+    return day.strftime('%Y-%m-%d')
+
+
+def _streaks(days, today):
+    """Current and longest runs of consecutive days with at least one entry"""
+    longest = run = 0
+    previous = None
+    for day in days:
+        run = run + 1 if previous is not None and day - previous == timedelta(days=1) else 1
+        longest = max(longest, run)
+        previous = day
+    # A streak is still current if the last entry was today or yesterday
+    current = run if previous is not None and today - previous <= timedelta(days=1) else 0
+    return {
+        'current': current,
+        'longest': longest,
+        'last_entry_day': previous.strftime('%Y-%m-%d') if previous else None,
+    }
+
+
+def parse_stats_params(params):
+    period = (params.get('period') or 'day').lower()
+    if period not in PERIODS:
+        raise InvalidStatsQuery(f"period must be one of {', '.join(PERIODS)}")
+    try:
+        days = int(params.get('days') or DEFAULT_DAYS)
+    except (TypeError, ValueError):
+        raise InvalidStatsQuery('days must be an integer')
+    if not 1 <= days <= MAX_DAYS:
+        raise InvalidStatsQuery(f'days must be between 1 and {MAX_DAYS}')
+    return period, days
+
+
+def mood_stats(db, username, days=DEFAULT_DAYS, period='day', now=None):
+    """Mood counts per day/week/month over the last `days` UTC days, plus streaks"""
+    today = day_of(now or datetime.utcnow())
+    start = today - timedelta(days=days - 1)
+    rollups = db[ROLLUP_COLLECTION]
+
+    series = {}
+    day = start
+    while day <= today:
+        series.setdefault(_period_key(day, period), {'total': 0, 'moods': Tally()})
+        day += timedelta(days=1)
+
+    totals = Tally()
+    for doc in rollups.find(
+        {'username': username, 'day': {'$gte': start, '$lte': today}},
+        {'_id': 0, 'day': 1, 'total': 1, 'moods': 1},
+    ).sort('day', ASCENDING):
+        bucket = series[_period_key(doc['day'], period)]
+        bucket['total'] += doc.get('total', 0)
+        bucket['moods'].update(doc.get('moods') or {})
+        totals.update(doc.get('moods') or {})
+
+    active_days = [doc['day'] for doc in rollups.find(
+        {'username': username}, {'_id': 0, 'day': 1},
+    ).sort('day', ASCENDING)]
+
+    return {
+        'username': username,
+        'period': period,
+        'from': start.strftime('%Y-%m-%d'),
+        'to': today.strftime('%Y-%m-%d'),
+        'total': sum(totals.values()),
+        'moods': dict(totals),
+        'series': [
+            {'period': key, 'total': bucket['total'], 'moods': dict(bucket['moods'])}
+            for key, bucket in series.items()
+        ],
+        'streaks': _streaks(active_days, today),
+    }
+
+
+def rebuild_rollups(db, username=None, batch_size=1000, dry_run=False):
+    """Recompute rollups from `mood_entries` (all users, or one).
+
+    Streams the entries once, tallies them in memory by (username, day),
+    then replaces the rollups with chunked bulk writes. Rollups with no
+    remaining entries are deleted. Entries created while a rebuild runs can
+    be counted twice or missed, so run it while traffic is low. Returns
+    (entries scanned, rollups written, stale rollups removed).
+    """
+    query = {'username': username} if username else {'username': {'$type': 'string'}}
+    groups = {}
+    scanned = 0
+    cursor = db['mood_entries'].find(
+        query, {'_id': 0, 'username': 1, 'created_at': 1, 'mood': 1, 'mood_description': 1},
+    ).batch_size(batch_size)
+    for doc in cursor:
+        if not isinstance(doc.get('created_at'), datetime):
+            continue
+        scanned += 1
+        key = (doc['username'], day_of(doc['created_at']))
+        groups.setdefault(key, Tally())[mood_key(entry_mood(doc))] += 1
+
+    if dry_run:
+        return scanned, len(groups), 0
+
+    rollups = db[ROLLUP_COLLECTION]
+    requests = [
+        ReplaceOne(
+            {'username': u, 'day': day},
+            {'username': u, 'day': day, 'total': sum(counts.values()), 'moods': dict(counts)},
+            upsert=True,
+        )
+        for (u, day), counts in groups.items()
+    ]
+    for i in range(0, len(requests), batch_size):
+        rollups.bulk_write(requests[i:i + batch_size], ordered=False)
+
+    stale = [
+        doc['_id'] for doc in rollups.find(query, {'username': 1, 'day': 1})
+        if (doc['username'], doc['day']) not in groups
+    ]
+    for i in range(0, len(stale), batch_size):
+        rollups.delete_many({'_id': {'$in': stale[i:i + batch_size]}})
+    return scanned, len(requests), len(stale)
@@ -0,0 +1,162 @@
+"""Keyset pagination over (created_at, _id) for per-user history collections.
+
+Pages are fetched with a range query on the compound
+(username, created_at, _id) index instead of skip/limit, so the cost of a page
+does not depend on how deep into a user's history it is. Cursors are opaque
+base64 tokens that encode the boundary document and the paging direction.
+
+Legacy documents written before created_at was stored have no timestamp.
+MongoDB sorts them below every date, so they form the oldest end of each
+history and are paged among themselves by _id alone.
+"""
+import base64
+import json
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _page_size_settings():
+    try:
+        from django.conf import settings
+        return (int(getattr(settings, 'API_DEFAULT_PAGE_SIZE', DEFAULT_PAGE_SIZE)),
+                int(getattr(settings, 'API_MAX_PAGE_SIZE', MAX_PAGE_SIZE)))
+    except Exception:
+        return DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+
+
+def parse_page_size(raw, default=None):
+    """Clamp a client-supplied page size to [1, API_MAX_PAGE_SIZE]"""
+    default_size, max_size = _page_size_settings()
+    try:
+        size = int(raw) if raw not in (None, '') else (default or default_size)
+    except (TypeError, ValueError):
+        size = default or default_size
+    return max(1, min(size, max_size))
+
+
+def _encode_id(value):
+    if isinstance(value, ObjectId):
+        return ['oid', str(value)]
+    if isinstance(value, int):
+        return ['int', value]
+    return ['str', str(value)]
+
+
+def _decode_id(kind, value):
+    if kind == 'oid':
+        return ObjectId(value)
+    if kind == 'int':
+        return int(value)
+    return str(value)
+
+
+def encode_cursor(doc, direction):
+    created_at = doc.get('created_at')
+    payload = {
+        'd': direction,
+        't': created_at.isoformat() if created_at is not None else None,
+        'i': _encode_id(doc['_id']),
+    }
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Return (direction, created_at, _id) from a cursor token"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        direction = payload['d']
+        if direction not in ('next', 'prev'):
+            raise ValueError(direction)
+        created_at = datetime.fromisoformat(payload['t']) if payload['t'] is not None else None
+        kind, value = payload['i']
+        return direction, created_at, _decode_id(kind, value)
+    except (KeyError, TypeError, ValueError, InvalidId, UnicodeError) as e:
+        raise InvalidCursor(f'invalid cursor: {e}')
+
+
+def _after(created_at, _id, op):
+    # {'created_at': None} matches documents without the field
+    if created_at is None:
+        untimed = {'created_at': None, '_id': {op: _id}}
+        return untimed if op == '$lt' else {'$or': [{'created_at': {'$ne': None}}, untimed]}
+    clauses = [
+        {'created_at': {op: created_at}},
+        {'created_at': created_at, '_id': {op: _id}},
+    ]
+    if op == '$lt':
+        clauses.append({'created_at': None})
+    return {'$or': clauses}
+
+
+def _page_query(query, cursor, order):
+    """Return (filters, sort, direction) for the page a cursor points at"""
+    direction = 'next'
+    filters = dict(query)
+    if cursor:
+        direction, created_at, _id = decode_cursor(cursor)
+        forward = (direction == 'next')
+        op = '$lt' if (order == DESCENDING) == forward else '$gt'
+        filters = {'$and': [query, _after(created_at, _id, op)]}
+    # Walking backwards is a forward scan in the opposite order, reversed afterwards
+    scan_order = order if direction == 'next' else -order
+    return filters, [('created_at', scan_order), ('_id', scan_order)], direction
+
+
+def _page_result(docs, cursor, direction, page_size):
+    has_more = len(docs) > page_size
+    docs = docs[:page_size]
+    if direction == 'prev':
+        docs.reverse()
+
+    if not docs:
+        return docs, None, None
+    if direction == 'next':
+        next_cursor = encode_cursor(docs[-1], 'next') if has_more else None
+        prev_cursor = encode_cursor(docs[0], 'prev') if cursor else None
+    else:
+        next_cursor = encode_cursor(docs[-1], 'next')
+        prev_cursor = encode_cursor(docs[0], 'prev') if has_more else None
+    return docs, next_cursor, prev_cursor
+
+
+def paginate(collection, query, cursor=None, page_size=DEFAULT_PAGE_SIZE, order=DESCENDING, projection=None, codec_options=None):
+    """Fetch one page of `query` ordered by (created_at, _id).
+
+    Returns (docs, next_cursor, prev_cursor). `next` continues in `order`,
+    `prev` walks back towards the first page; either is None at the edge.
+    Pass `codec_options` (e.g. RAW_CODEC_OPTIONS) to change the document class.
+    """
+    if codec_options is not None:
+        collection = collection.with_options(codec_options=codec_options)
+    filters, sort, direction = _page_query(query, cursor, order)
+    docs = list(collection.find(filters, projection).sort(sort).limit(page_size + 1))
+    return _page_result(docs, cursor, direction, page_size)
+
+
+async def apaginate(collection, query, cursor=None, page_size=DEFAULT_PAGE_SIZE, order=DESCENDING, projection=None, codec_options=None):
+    """`paginate` for an AsyncCollection"""
+    if codec_options is not None:
+        collection = collection.with_options(codec_options=codec_options)
+    filters, sort, direction = _page_query(query, cursor, order)
+    docs = await collection.find(filters, projection).sort(sort).limit(page_size + 1).to_list()
+    return _page_result(docs, cursor, direction, page_size)
+
+
+def parse_order(raw, default=DESCENDING):
+    if raw in ('asc', 'ascending', '1'):
+        return ASCENDING
+    if raw in ('desc', 'descending', '-1'):
+        return DESCENDING
+    return default
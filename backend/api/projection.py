@@ -0,0 +1,78 @@
+"""Map `fields=` / `summary=` query parameters onto MongoDB find() projections.
+
+List endpoints only ship the fields the client asks for. Summary mode also
+truncates long text server-side with `$substrCP`, so full journal bodies never
+leave the database for list views.
+"""
+
+DEFAULT_SUMMARY_LENGTH = 200
+MAX_SUMMARY_LENGTH = 2000
+
+# Client-selectable fields per collection; _id and created_at are always returned
+# because pagination cursors are built from them.
+LIST_FIELDS = {
+    'mood_entries': ('username', 'mood', 'mood_description'),
+    'journal_entries': ('username', 'content', 'metadata'),
+    'activity_usages': ('username', 'activity_key', 'metadata'),
+    'chat_messages': ('username', 'mood', 'user_message', 'bot_reply', 'provider'),
+}
+ALWAYS_INCLUDED = ('_id', 'created_at')
+
+# Long text fields truncated in summary mode, and fields summaries leave out
+SUMMARY_TRUNCATE = {
+    'journal_entries': ('content',),
+    'chat_messages': ('user_message', 'bot_reply'),
+}
+SUMMARY_EXCLUDE = ('metadata',)
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+def _is_true(raw):
+    return str(raw or '').lower() in ('1', 'true', 'yes')
+
+
+def build_projection(collection_name, fields=None, summary=False, summary_length=None):
+    """Return a find() projection, or None to fetch whole documents.
+
+    `fields` is a comma separated list of names from LIST_FIELDS. In summary
+    mode, text fields are cut to `summary_length` code points and each gets a
+    `<field>_length` companion with the full length.
+    """
+    allowed = LIST_FIELDS.get(collection_name, ())
+    if fields:
+        requested = [f.strip() for f in fields.split(',') if f.strip()]
+        unknown = [f for f in requested if f not in allowed and f not in ALWAYS_INCLUDED]
+        if unknown:
+            raise InvalidFields(f"Unknown fields: {', '.join(unknown)}")
+    elif summary:
+        requested = [f for f in allowed if f not in SUMMARY_EXCLUDE]
+    else:
+        return None
+
+    projection = {name: 1 for name in ALWAYS_INCLUDED}
+    truncate = SUMMARY_TRUNCATE.get(collection_name, ()) if summary else ()
+    try:
+        length = int(summary_length) if summary_length not in (None, '') else DEFAULT_SUMMARY_LENGTH
+    except (TypeError, ValueError):
+        raise InvalidFields('summary_length must be an integer')
+    length = max(1, min(length, MAX_SUMMARY_LENGTH))
+    for name in requested:
+        if name in truncate:
+            projection[name] = {'$substrCP': [{'$ifNull': [f'${name}', '']}, 0, length]}
+            projection[f'{name}_length'] = {'$strLenCP': {'$ifNull': [f'${name}', '']}}
+        else:
+            projection[name] = 1
+    return projection
+
+
+def projection_from_params(collection_name, params):
+    """Build a projection from request query params (fields, summary, summary_length)"""
+    return build_projection(
+        collection_name,
+        fields=params.get('fields'),
+        summary=_is_true(params.get('summary')),
+        summary_length=params.get('summary_length'),
+    )
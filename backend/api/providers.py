@@ -0,0 +1,386 @@
+"""Chat LLM providers: the provider interface, a registry and a latency-aware router.
+
+Providers are looked up by name. LLM_PROVIDERS lists the ones enabled for
+this process in priority order, and LLM_PROVIDER_CLASSES can map extra names
+to provider classes by dotted path. The router sends each chat to the
+enabled provider with the best recent latency and error rate. If that
+provider fails, the router tries the next one. The name of the provider
+that answered is what gets stored in `chat_messages.provider`.
+"""
+from collections import deque
+import asyncio
+import itertools
+import logging
+import random
+import threading
+import time
+
+from django.utils.module_loading import import_string
+
+from .resilience import OPEN, CircuitBreaker, CircuitOpenError, acall_with_budget, call_with_budget, latency_budget
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_CLASSES = {
+    'gemini': 'api.chatbot.GeminiProvider',
+    'echo': 'api.providers.EchoProvider',
+}
+
+
+def _setting(name, default):
+    try:
+        from django.conf import settings
+        return getattr(settings, name, default)
+    except Exception:
+        return default
+
+
+class LLMProvider:
+    """Base class for chat backends.
+
+    Subclasses set `name` and implement `_send`. They can also override
+    `_asend` and `_stream` when the backend has native async or streaming
+    calls. The public methods add the circuit breaker and latency budget from
+    api/resilience.py. `call`/`acall` raise on any failure, and raise
+    CircuitOpenError without touching the backend while the breaker is open.
+    `generate`/`agenerate` return None instead of raising.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.timeout = latency_budget()
+        self.breaker = CircuitBreaker.from_settings(self.name)
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    def _send(self, user_message, mood, history):
+        raise NotImplementedError
+
+    async def _asend(self, user_message, mood, history):
+        return await asyncio.to_thread(self._send, user_message, mood, history)
+
+    def _stream(self, user_message, mood, history):
+        reply = self._send(user_message, mood, history)
+        if reply:
+            yield reply
+
+    def call(self, user_message, mood, history):
+        if not self.breaker.allow():
+            raise CircuitOpenError(f'{self.name} circuit is open')
+        try:
+            reply = call_with_budget(self._send, self.timeout, user_message, mood, history)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return reply
+
+    async def acall(self, user_message, mood, history):
+        if not self.breaker.allow():
+            raise CircuitOpenError(f'{self.name} circuit is open')
+        try:
+            reply = await acall_with_budget(self._asend(user_message, mood, history), self.timeout)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return reply
+
+    def generate(self, user_message, mood, history):
+        if not self.available:
+            return None
+        try:
+            return self.call(user_message, mood, history)
+        except CircuitOpenError:
+            logger.info(f"{self.name} circuit open; using fallback")
+        except Exception as e:
+            logger.warning(f"{self.name} generation error: {e}")
+        return None
+
+    async def agenerate(self, user_message, mood, history):
+        if not self.available:
+            return None
+        try:
+            return await self.acall(user_message, mood, history)
+        except CircuitOpenError:
+            logger.info(f"{self.name} circuit open; using fallback")
+        except Exception as e:
+            logger.warning(f"{self.name} generation error: {e}")
+        return None
+
+    def stream(self, user_message, mood, history):
+        """Yield reply text chunks; raises on any failure.
+
+        Waiting for the first chunk (the request and time to first token) runs under the
+        latency budget like `call`, so a hung backend fails over to the fallback reply.
+        Later chunks arrive at the backend's pace.
+        """
+        if not self.available:
+            raise RuntimeError(f'{self.name} is not available')
+        if not self.breaker.allow():
+            raise CircuitOpenError(f'{self.name} circuit is open')
+        try:
+            chunks = self._stream(user_message, mood, history)
+            # On timeout the generator is left to its pool thread and never touched again
+            first = call_with_budget(next, self.timeout, chunks, None)
+            if first is not None:
+                yield first
+                yield from chunks
+        except GeneratorExit:
+            # Client went away mid-reply; the backend itself was answering
+            self.breaker.record_success()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+
+
+class EchoProvider(LLMProvider):
+    """Local provider that needs no network or API key.
+
+    It reflects the message back, so chat works offline and in tests. With
+    `latency`, `jitter` and `error_rate` it also serves as a fake backend for
+    router load tests (see the loadtest_router command).
+    """
+
+    name = 'echo'
+
+    def __init__(self, name=None, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        if name:
+            self.name = name
+        super().__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+
+    def _delay(self):
+        if self._random.random() < self.error_rate:
+            raise RuntimeError(f'{self.name} injected failure')
+        return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def _reply(self, user_message):
+        return f"I hear you: {(user_message or '').strip()}"
+
+    def _send(self, user_message, mood, history):
+        delay = self._delay()
+        if delay:
+            time.sleep(delay)
+        return self._reply(user_message)
+
+    async def _asend(self, user_message, mood, history):
+        delay = self._delay()
+        if delay:
+            await asyncio.sleep(delay)
+        return self._reply(user_message)
+
+
+class LatencyWindow:
+    """Rolling record of the last `size` calls to one provider"""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)  # (seconds, ok)
+        self._lock = threading.Lock()
+        self.last_used = 0.0
+
+    def record(self, seconds, ok):
+        with self._lock:
+            self._samples.append((seconds, ok))
+            self.last_used = time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            samples = list(self._samples)
+        latencies = sorted(seconds for seconds, ok in samples if ok)
+        failures = sum(1 for _, ok in samples if not ok)
+
+        def percentile(q):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+
+        return {
+            'calls': len(samples),
+            'p50': percentile(0.5),
+            'p95': percentile(0.95),
+            'error_rate': failures / len(samples) if samples else 0.0,
+        }
+
+
+class ProviderRouter:
+    """Order providers by measured latency and error rate, and fail over down that order.
+
+    A provider's score is the mean of its p50 and p95 latency, divided by its
+    success rate. This is roughly the expected time to get a usable reply.
+    Providers with fewer than `min_samples` calls come first, in configured
+    order, so new or recovered backends get measured. Providers whose breaker
+    is open go last. Every `explore_every` calls, the provider that has gone
+    longest without traffic is tried first, so its numbers don't go stale.
+    """
+
+    def __init__(self, providers, window=200, min_samples=10, explore_every=50):
+        self.providers = list(providers)
+        self.min_samples = min_samples
+        self.explore_every = explore_every
+        self.windows = {p.name: LatencyWindow(window) for p in self.providers}
+        self._calls = itertools.count(1)
+
+    def score(self, snapshot):
+        if snapshot['p50'] is None:
+            return float('inf')
+        return (snapshot['p50'] + snapshot['p95']) / 2 / max(0.05, 1 - snapshot['error_rate'])
+
+    def ranked(self):
+        candidates = [p for p in self.providers if p.available]
+
+        def key(item):
+            index, provider = item
+            snapshot = self.windows[provider.name].snapshot()
+            is_open = provider.breaker.state == OPEN
+            if snapshot['calls'] < self.min_samples:
+                return (is_open, 0, index)
+            return (is_open, 1, self.score(snapshot))
+
+        ranked = [p for _, p in sorted(enumerate(candidates), key=key)]
+        if self.explore_every and len(ranked) > 1 and next(self._calls) % self.explore_every == 0:
+            stalest = min(ranked, key=lambda p: self.windows[p.name].last_used)
+            ranked.remove(stalest)
+            ranked.insert(0, stalest)
+        return ranked
+
+    def _record(self, provider, start, ok):
+        self.windows[provider.name].record(time.perf_counter() - start, ok)
+
+    def generate(self, user_message, mood, history):
+        """Return (reply, provider name), or (None, None) if no provider answered"""
+        ranked = self.ranked()
+        if not ranked:
+            logger.info("No LLM provider available (check LLM_PROVIDERS and API keys)")
+        for provider in ranked:
+            start = time.perf_counter()
+            try:
+                reply = provider.call(user_message, mood, history)
+            except CircuitOpenError:
+                continue
+            except Exception as e:
+                self._record(provider, start, False)
+                logger.warning(f"{provider.name} generation error: {e}")
+                continue
+            self._record(provider, start, bool(reply))
+            if reply:
+                return reply, provider.name
+        return None, None
+
+    async def agenerate(self, user_message, mood, history):
+        ranked = self.ranked()
+        if not ranked:
+            logger.info("No LLM provider available (check LLM_PROVIDERS and API keys)")
+        for provider in ranked:
+            start = time.perf_counter()
+            try:
+                reply = await provider.acall(user_message, mood, history)
+            except CircuitOpenError:
+                continue
+            except Exception as e:
+                self._record(provider, start, False)
+                logger.warning(f"{provider.name} generation error: {e}")
+                continue
+            self._record(provider, start, bool(reply))
+            if reply:
+                return reply, provider.name
+        return None, None
+
+    def stream(self, user_message, mood, history):
+        """Return (provider name, chunk iterator) for the best provider.
+
+        A stream can't fail over once tokens have been sent, so only the
+        first provider with a closed breaker is used. The iterator raises on
+        failure.
+        """
+        ranked = [p for p in self.ranked() if p.breaker.state != OPEN]
+        if not ranked:
+            raise RuntimeError('No LLM provider available')
+        provider = ranked[0]
+        return provider.name, self._measured(provider, provider.stream(user_message, mood, history))
+
+    def _measured(self, provider, chunks):
+        start = time.perf_counter()
+        try:
+            yield from chunks
+        except GeneratorExit:
+            raise  # client went away; a partial stream says nothing about latency
+        except Exception:
+            self._record(provider, start, False)
+            raise
+        self._record(provider, start, True)
+
+    def stats(self):
+        stats = {}
+        for provider in self.providers:
+            snapshot = self.windows[provider.name].snapshot()
+            stats[provider.name] = {
+                'available': provider.available,
+                'calls': snapshot['calls'],
+                'p50_ms': round(snapshot['p50'] * 1000, 1) if snapshot['p50'] is not None else None,
+                'p95_ms': round(snapshot['p95'] * 1000, 1) if snapshot['p95'] is not None else None,
+                'error_rate': round(snapshot['error_rate'], 3),
+                'circuit': provider.breaker.stats(),
+            }
+        return stats
+
+
+_providers = {}
+_router = None
+_registry_lock = threading.RLock()
+
+
+def register_provider(name, provider_class):
+    """Make a provider class available under `name` for LLM_PROVIDERS"""
+    with _registry_lock:
+        PROVIDER_CLASSES[name] = provider_class
+        _providers.pop(name, None)
+
+
+def get_provider(name):
+    """Return the process-wide instance of a registered provider"""
+    provider = _providers.get(name)
+    if provider is None:
+        with _registry_lock:
+            provider = _providers.get(name)
+            if provider is None:
+                classes = dict(PROVIDER_CLASSES, **_setting('LLM_PROVIDER_CLASSES', {}))
+                if name not in classes:
+                    raise KeyError(f'Unknown LLM provider: {name}')
+                provider_class = classes[name]
+                if isinstance(provider_class, str):
+                    provider_class = import_string(provider_class)
+                provider = provider_class()
+                _providers[name] = provider
+    return provider
+
+
+def get_router():
+    global _router
+    if _router is None:
+        with _registry_lock:
+            if _router is None:
+                names = _setting('LLM_PROVIDERS', ['gemini'])
+                _router = ProviderRouter(
+                    [get_provider(name) for name in names],
+                    window=int(_setting('LLM_ROUTER_WINDOW', 200)),
+                    min_samples=int(_setting('LLM_ROUTER_MIN_SAMPLES', 10)),
+                    explore_every=int(_setting('LLM_ROUTER_EXPLORE_EVERY', 50)),
+                )
+    return _router
+
+
+def reset_providers():
+    """Drop provider instances and the router so the next call re-reads settings (tests, key rotation)."""
+    global _router
+    with _registry_lock:
+        _providers.clear()
+        _router = None
@@ -0,0 +1,295 @@
+"""Background username renames.
+
+Per-user documents are keyed by `username`. A rename therefore has to rewrite
+every document the user owns. UpdateProfileView renames the user, records a
+job in `username_renames` and returns at once. The job then moves the
+documents off the request path:
+
+- Each collection in MOVED_COLLECTIONS is handled by its own thread.
+- A thread repeatedly picks a batch of `_id`s that still carry the old
+  username and moves them with one `update_many`. The batch also gets the
+  stable `user_id`.
+- Only documents that belong to the renamed user are moved: those with its
+  `user_id`, or without a `user_id` and created before the job. A user who
+  later signs up with the freed name keeps their own documents.
+- After each batch the thread adds to the job's per-collection progress and
+  extends its lease.
+
+Rollups are keyed by (username, day), so the new name may already have a row
+for a day. A mood posted mid-job creates one, for example. Rollup rows are
+therefore never renamed. Each old row is first claimed by renaming it to a
+per-job tombstone name. Its counts are then added to the new name's row with
+`$inc` (upsert), and the tombstone is deleted. The merged row records the
+tombstone's `_id` until the delete, so a resumed job does not add it twice.
+The user's `activity_daily_stats` rows are dropped and recomputed from the
+moved activity usages.
+
+While a job is unfinished, no one else can take the old username
+(`is_reserved`).
+
+A job is finished when no collection has a document with the old username
+left. If it fails partway, or its process dies, the job keeps its progress.
+`resume_rename_jobs` (or the next rename of the same user) picks it up again
+once the lease has expired. Every batch filters on the old username, so a
+rerun is safe. Jobs for one user run in order, so renaming A→B→C quickly
+still ends with everything under C.
+
+While a job runs, lists under the new username can be missing some of the
+older documents, usually for a few seconds.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import logging
+import threading
+
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from backend.mongo import MongoDB
+from .activity_analytics import DAILY_STATS_COLLECTION, refresh_daily_stats
+from .chat_context import get_conversation_cache
+from .mood_stats import ROLLUP_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = 'username_renames'
+# Entry collections whose documents are moved to the new username
+MOVED_COLLECTIONS = ('mood_entries', 'chat_messages', 'activity_usages', 'journal_entries')
+# Every per-user collection, including the derived ones that are merged or rebuilt instead
+RENAMED_COLLECTIONS = MOVED_COLLECTIONS + (ROLLUP_COLLECTION, DAILY_STATS_COLLECTION)
+ACTIVE = ('pending', 'running', 'failed')
+DUPLICATE_KEY = 11000
+
+
+def _setting(name, default):
+    try:
+        from django.conf import settings
+        return getattr(settings, name, default)
+    except Exception:
+        return default
+
+
+def _lease():
+    return datetime.utcnow() + timedelta(seconds=float(_setting('RENAME_JOB_LEASE_SECONDS', 60)))
+
+
+def create_job(db, user_id, old_username, new_username):
+    """Record a pending rename job and return it"""
+    now = datetime.utcnow()
+    job = {
+        'user_id': user_id,
+        'old_username': old_username,
+        'new_username': new_username,
+        'status': 'pending',
+        'progress': {name: 0 for name in RENAMED_COLLECTIONS},
+        'attempts': 0,
+        'locked_until': None,
+        'created_at': now,
+        'updated_at': now,
+    }
+    db[JOBS_COLLECTION].insert_one(job)
+    return job
+
+
+def _claim(db, job):
+    """Lease a job for this worker; None if it is finished or leased by another worker"""
+    now = datetime.utcnow()
+    return db[JOBS_COLLECTION].find_one_and_update(
+        {'_id': job['_id'], 'status': {'$in': list(ACTIVE)},
+         '$or': [{'locked_until': None}, {'locked_until': {'$lt': now}}]},
+        {'$set': {'status': 'running', 'locked_until': _lease(), 'updated_at': now}, '$inc': {'attempts': 1}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def is_reserved(db, username, user_id=None):
+    """True while an unfinished rename of another user is still moving documents away from `username`"""
+    if not username:
+        return False
+    query = {'old_username': username, 'status': {'$in': list(ACTIVE)}}
+    if user_id is not None:
+        query['user_id'] = {'$ne': user_id}  # renaming back to one's own previous name is fine
+    return db[JOBS_COLLECTION].find_one(query, {'_id': 1}) is not None
+
+
+def _owned(job):
+    """Filter for the documents under the old username that belong to the renamed user"""
+    return {
+        'username': job['old_username'],
+        '$or': [
+            {'user_id': job['user_id']},
+            {'user_id': {'$exists': False}, 'created_at': {'$lte': job['created_at']}},
+        ],
+    }
+
+
+def _record_progress(db, job, collection_name, count):
+    db[JOBS_COLLECTION].update_one({'_id': job['_id']}, {
+        '$inc': {f'progress.{collection_name}': count},
+        '$set': {'locked_until': _lease(), 'updated_at': datetime.utcnow()},
+    })
+
+
+def _move(db, job, collection_name, batch_size):
+    """Move one collection's documents to the new username, a batch at a time"""
+    collection = db[collection_name]
+    owned = _owned(job)
+    moved = 0
+    while True:
+        ids = [doc['_id'] for doc in collection.find(owned, {'_id': 1}).limit(batch_size)]
+        if not ids:
+            return moved
+        result = collection.update_many(
+            dict(owned, _id={'$in': ids}),
+            {'$set': {'username': job['new_username'], 'user_id': job['user_id']}},
+        )
+        moved += result.modified_count
+        _record_progress(db, job, collection_name, result.modified_count)
+
+
+def _tombstone(job):
+    return f"\x00renaming:{job['_id']}:{job['old_username']}"
+
+
+def _merge_rollups(db, job, batch_size):
+    """Add the old username's daily mood rollups to the new username's, then delete them"""
+    rollups = db[ROLLUP_COLLECTION]
+    tombstone = _tombstone(job)
+    merged = 0
+    while True:
+        # Rows claimed by an earlier pass (or an interrupted run) are merged first
+        claimed = list(rollups.find({'username': tombstone}).limit(batch_size))
+        if claimed:
+            requests = []
+            for row in claimed:
+                inc = {f'moods.{key}': n for key, n in (row.get('moods') or {}).items()}
+                inc['total'] = row.get('total', 0)
+                requests.append(UpdateOne(
+                    {'username': job['new_username'], 'day': row['day'], 'merged_from': {'$ne': row['_id']}},
+                    {'$inc': inc, '$push': {'merged_from': row['_id']}, '$set': {'user_id': job['user_id']}},
+                    upsert=True,
+                ))
+            try:
+                rollups.bulk_write(requests, ordered=False)
+            except BulkWriteError as e:
+                # A duplicate key means the target row already lists the tombstone: it was merged before
+                errors = (e.details or {}).get('writeErrors') or []
+                if not errors or any(err.get('code') != DUPLICATE_KEY for err in errors):
+                    raise
+            ids = [row['_id'] for row in claimed]
+            rollups.delete_many({'_id': {'$in': ids}})
+            rollups.update_many({'username': job['new_username'], 'merged_from': {'$in': ids}},
+                                {'$pull': {'merged_from': {'$in': ids}}})
+            merged += len(claimed)
+            _record_progress(db, job, ROLLUP_COLLECTION, len(claimed))
+            continue
+        ids = [row['_id'] for row in rollups.find({'username': job['old_username']}, {'_id': 1}).limit(batch_size)]
+        if not ids:
+            return merged
+        # Later increments for the old name land in a fresh row, which the next pass claims
+        rollups.update_many({'_id': {'$in': ids}, 'username': job['old_username']}, {'$set': {'username': tombstone}})
+
+
+def _rebuild_activity_stats(db, job):
+    """Drop the old username's activity_daily_stats rows and recompute the new username's"""
+    removed = db[DAILY_STATS_COLLECTION].delete_many({'username': job['old_username']}).deleted_count
+    refresh_daily_stats(db, username=job['new_username'])
+    _record_progress(db, job, DAILY_STATS_COLLECTION, removed)
+    return removed
+
+
+def run_job(db, job_id, batch_size=None, concurrency=None):
+    """Run (or resume) one rename job; returns its final document, or None if it could not be claimed"""
+    jobs = db[JOBS_COLLECTION]
+    job = jobs.find_one({'_id': job_id})
+    if not job or job['status'] not in ACTIVE:
+        return job
+    earlier = jobs.find_one(
+        {'user_id': job['user_id'], 'status': {'$in': list(ACTIVE)}, 'created_at': {'$lt': job['created_at']}},
+        sort=[('created_at', ASCENDING)],
+    )
+    if earlier:
+        # One user's renames apply in order; the earlier job hands over to this one when it is done
+        run_job(db, earlier['_id'], batch_size=batch_size, concurrency=concurrency)
+        return jobs.find_one({'_id': job_id})
+    job = _claim(db, job)
+    if job is None:
+        return None
+    batch_size = batch_size or int(_setting('RENAME_JOB_BATCH_SIZE', 1000))
+    concurrency = concurrency or int(_setting('RENAME_JOB_CONCURRENCY', 4))
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='rename-move') as pool:
+            futures = [pool.submit(_move, db, job, name, batch_size) for name in MOVED_COLLECTIONS]
+            moved = sum(future.result() for future in futures)
+        # Derived data follows once the entries it is computed from have moved
+        moved += _merge_rollups(db, job, batch_size)
+        _rebuild_activity_stats(db, job)
+    except Exception as e:
+        logger.error(f"Rename job {job_id} ({job['old_username']} -> {job['new_username']}) failed: {e}")
+        jobs.update_one({'_id': job_id}, {'$set': {
+            'status': 'failed', 'error': str(e), 'locked_until': None, 'updated_at': datetime.utcnow(),
+        }})
+        return jobs.find_one({'_id': job_id})
+
+    now = datetime.utcnow()
+    jobs.update_one({'_id': job_id}, {
+        '$set': {'status': 'done', 'locked_until': None, 'updated_at': now, 'finished_at': now},
+        '$unset': {'error': ''},
+    })
+    # Windows loaded mid-rename may be partial
+    get_conversation_cache().invalidate(job['old_username'], job['new_username'])
+    logger.info(f"Rename job {job_id} moved {moved} documents ({job['old_username']} -> {job['new_username']})")
+
+    following = jobs.find_one(
+        {'user_id': job['user_id'], 'status': {'$in': list(ACTIVE)}}, sort=[('created_at', ASCENDING)],
+    )
+    if following:
+        submit(following['_id'])
+    return jobs.find_one({'_id': job_id})
+
+
+def resume_jobs(db, batch_size=None, concurrency=None):
+    """Run every unfinished job whose lease has expired, oldest first; returns the jobs run"""
+    jobs = db[JOBS_COLLECTION]
+    results = []
+    for job in list(jobs.find({'status': {'$in': list(ACTIVE)}}, {'_id': 1}).sort('created_at', ASCENDING)):
+        result = run_job(db, job['_id'], batch_size=batch_size, concurrency=concurrency)
+        if result is not None:
+            results.append(result)
+    return results
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(_setting('RENAME_JOB_WORKERS', 2)), thread_name_prefix='rename-job',
+                )
+    return _executor
+
+
+def submit(job_id):
+    """Start a job in the background (or inline with RENAME_JOBS_ASYNC off)"""
+    if not _setting('RENAME_JOBS_ASYNC', True):
+        return run_job(MongoDB.get_db(), job_id)
+    return _get_executor().submit(run_job, MongoDB.get_db(), job_id)
+
+
+def describe(job):
+    return {
+        'id': str(job['_id']),
+        'status': job['status'],
+        'old_username': job['old_username'],
+        'new_username': job['new_username'],
+        'progress': job.get('progress', {}),
+        'attempts': job.get('attempts', 0),
+        'error': job.get('error'),
+        'created_at': job.get('created_at'),
+        'finished_at': job.get('finished_at'),
+    }
@@ -0,0 +1,12 @@
+from rest_framework.renderers import JSONRenderer
+
+from .bson_json import dumps
+
+
+class BSONJSONRenderer(JSONRenderer):
+    """JSON renderer that encodes BSON documents directly (see api/bson_json.py)"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps(data)
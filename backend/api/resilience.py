@@ -0,0 +1,171 @@
+"""Circuit breaker and latency budget for calls to external LLM providers.
+
+While a provider is failing, the breaker is open and calls are rejected
+immediately, so requests go straight to the rule-based fallback instead of
+waiting on timeouts. After `reset_timeout` seconds a limited number of trial
+calls are let through (half-open); one success closes the breaker again.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def _setting(name, default):
+    try:
+        from django.conf import settings
+        return getattr(settings, name, default)
+    except Exception:
+        return default
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker over the last `window` calls"""
+
+    def __init__(self, name, window=20, min_calls=5, failure_rate=0.5,
+                 reset_timeout=30.0, half_open_calls=1, clock=time.monotonic):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)  # True = failure
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trials = 0
+        self.trips = 0
+        self.rejected = 0
+        self.successes = 0
+        self.failures = 0
+
+    @classmethod
+    def from_settings(cls, name):
+        return cls(
+            name,
+            window=int(_setting('LLM_BREAKER_WINDOW', 20)),
+            min_calls=int(_setting('LLM_BREAKER_MIN_CALLS', 5)),
+            failure_rate=float(_setting('LLM_BREAKER_FAILURE_RATE', 0.5)),
+            reset_timeout=float(_setting('LLM_BREAKER_RESET_SECONDS', 30)),
+            half_open_calls=int(_setting('LLM_BREAKER_HALF_OPEN_CALLS', 1)),
+        )
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._trials = 0
+        return self._state
+
+    def allow(self):
+        """Return True if a call may go ahead; rejected calls should fall back at once"""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._trials < self.half_open_calls:
+                self._trials += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def _trip(self):
+        self._state = OPEN
+        self._opened_at = self._clock()
+        self.trips += 1
+        logger.warning(f"Circuit breaker '{self.name}' opened")
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            if self._current_state() == HALF_OPEN:
+                self._state = CLOSED
+                self._outcomes.clear()
+                logger.info(f"Circuit breaker '{self.name}' closed")
+            self._outcomes.append(False)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            state = self._current_state()
+            if state == HALF_OPEN:
+                self._trip()
+                return
+            self._outcomes.append(True)
+            if state == CLOSED and len(self._outcomes) >= self.min_calls:
+                if sum(self._outcomes) / len(self._outcomes) >= self.failure_rate:
+                    self._trip()
+                    self._outcomes.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self._current_state(),
+                'trips': self.trips,
+                'rejected': self.rejected,
+                'successes': self.successes,
+                'failures': self.failures,
+            }
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class BudgetExceeded(TimeoutError):
+    pass
+
+
+def latency_budget():
+    """Hard per-request limit, in seconds, on one provider call"""
+    return float(_setting('LLM_TIMEOUT_SECONDS', 8))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(_setting('LLM_MAX_CONCURRENCY', 32)),
+                    thread_name_prefix='llm',
+                )
+    return _executor
+
+
+def call_with_budget(fn, budget, *args, **kwargs):
+    """Run fn in the LLM pool and give up after `budget` seconds.
+
+    The call keeps running in its pool thread until the SDK's own timeout
+    fires, but the request thread is released at the budget.
+    """
+    future = _get_executor().submit(fn, *args, **kwargs)
+    try:
+        return future.result(timeout=budget)
+    except FutureTimeout:
+        future.cancel()
+        raise BudgetExceeded(f'exceeded {budget:.1f}s latency budget')
+
+
+async def acall_with_budget(coro, budget):
+    try:
+        return await asyncio.wait_for(coro, timeout=budget)
+    except asyncio.TimeoutError:
+        raise BudgetExceeded(f'exceeded {budget:.1f}s latency budget')
@@ -0,0 +1,95 @@
+"""Opt-in cache of chatbot replies for short, repeated prompts.
+
+Keys combine the normalized message, the mood and a hash of the last few
+conversation turns, so a reply is only reused for the same message in the same
+recent context. Long messages are never cached, and anything that looks like
+a crisis or self-harm message always goes to the provider.
+
+Enable with CHAT_RESPONSE_CACHE_ENABLED = True.
+"""
+import hashlib
+import re
+import threading
+import unicodedata
+
+from .cache import TTLCache
+
+CRISIS_PATTERNS = re.compile(
+    r"\b(suicid\w*|kill(ing)? myself|end(ing)? (my|it) (life|all)|self[- ]?harm\w*|hurt(ing)? myself|"
+    r"cut(ting)? myself|want to die|wanna die|overdos\w*|no reason to live|better off dead)\b",
+    re.IGNORECASE,
+)
+
+
+def _setting(name, default):
+    try:
+        from django.conf import settings
+        return getattr(settings, name, default)
+    except Exception:
+        return default
+
+
+def is_crisis_message(message):
+    return bool(CRISIS_PATTERNS.search(message or ''))
+
+
+def normalize_message(message):
+    text = unicodedata.normalize('NFKC', message or '').lower()
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return ' '.join(text.split())
+
+
+class ResponseCache:
+    def __init__(self, maxsize=5000, ttl=3600, history_turns=2, max_message_chars=200):
+        self.history_turns = history_turns
+        self.max_message_chars = max_message_chars
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.bypassed = 0
+
+    def key(self, message, mood, history):
+        """Return the cache key for a prompt, or None when it must not be cached"""
+        if len(message or '') > self.max_message_chars or is_crisis_message(message):
+            self.bypassed += 1
+            return None
+        if any(is_crisis_message(turn.get('content')) for turn in (history or [])[-self.history_turns:]):
+            self.bypassed += 1
+            return None
+        recent = (history or [])[-self.history_turns:] if self.history_turns else []
+        digest = hashlib.sha256()
+        for turn in recent:
+            digest.update(f"{turn.get('role')}\x1f{normalize_message(turn.get('content'))}\x1e".encode('utf-8'))
+        return (normalize_message(message), (mood or '').lower(), digest.hexdigest()[:16])
+
+    def get(self, key):
+        return self._cache.get(key) if key is not None else None
+
+    def set(self, key, reply):
+        if key is not None and reply:
+            self._cache.set(key, reply)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return dict(self._cache.stats(), bypassed=self.bypassed)
+
+
+_responses = None
+_responses_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Return the process-wide ResponseCache, or None when the cache is disabled"""
+    global _responses
+    if not _setting('CHAT_RESPONSE_CACHE_ENABLED', False):
+        return None
+    if _responses is None:
+        with _responses_lock:
+            if _responses is None:
+                _responses = ResponseCache(
+                    maxsize=int(_setting('CHAT_RESPONSE_CACHE_SIZE', 5000)),
+                    ttl=float(_setting('CHAT_RESPONSE_CACHE_TTL', 3600)),
+                    history_turns=int(_setting('CHAT_RESPONSE_CACHE_HISTORY_TURNS', 2)),
+                    max_message_chars=int(_setting('CHAT_RESPONSE_CACHE_MAX_MESSAGE_CHARS', 200)),
+                )
+    return _responses
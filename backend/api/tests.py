@@ -1,3 +1,1529 @@
-from django.test import TestCase
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import hashlib
+import json
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.http import StreamingHttpResponse
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APIRequestFactory
+
+from bson import ObjectId, encode
+from pymongo import DeleteOne, UpdateMany
+from bson.raw_bson import RawBSONDocument
+
+from backend import counter
+from backend.mongo import AsyncMongoDB, MongoDB, PoolStats
+
+from . import activity_analytics, chat_context, chatbot, export, id_migration, models, mood_stats, providers, resilience, rename_jobs, response_cache, tokens, user_cache, utils, write_behind
+from .async_views import AsyncChatHistoryView
+from .batch_migration import CHECKPOINT_COLLECTION, MigrationRunner
+from .bson_json import ORJSON_AVAILABLE, dumps
+from .indexes import INDEX_PLAN, diff_indexes
+from .management.commands.cleanup_mood_entries import MoodEntryCleanup
+from .management.commands.migrate_mood_entries import LegacyMoodEntries
+from .models import ActivityUsage, MoodEntry, User, get_model
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, paginate, parse_page_size
+from .projection import InvalidFields, build_projection
+from .utils import hash_password, needs_rehash, verify_password
+from .views import (
+    ActivityAnalyticsView, ChangePasswordView, ChatbotView, ChatHistoryView, EventBatchView, ExportView, LoginView, MoodStatsView,
+    RenameJobView, SignupView, TokenRefreshView, UpdateProfileView,
+)
+
+
+class FakeCollection:
+    """Minimal in-memory stand-in for a pymongo collection that records every command"""
+
+    def __init__(self, name, commands):
+        self.name = name
+        self.commands = commands
+        self.docs = []
+        self.indexes = {'_id_': {'key': [('_id', 1)]}}
+
+    def _record(self, command):
+        self.commands.append((self.name, command))
+
+    def _matches(self, doc, query):
+        def match(value, condition):
+            if isinstance(condition, dict) and condition and all(k.startswith('$') for k in condition):
+                ops = {'$gte': lambda c: value is not None and value >= c, '$lte': lambda c: value is not None and value <= c,
+                       '$lt': lambda c: value is not None and value < c, '$gt': lambda c: value is not None and value > c,
+                       '$exists': lambda c: (value is not None) == c,
+                       '$in': lambda c: any(v in c for v in value) if isinstance(value, list) else value in c,
+                       '$ne': lambda c: c not in value if isinstance(value, list) else value != c,
+                       '$type': lambda c: isinstance(value, {'string': str, 'objectId': ObjectId, 'number': (int, float)}[c])}
+                return all(ops[op](c) for op, c in condition.items())
+            return value == condition
+        query = dict(query or {})
+        alternatives = query.pop('$or', None)
+        if alternatives is not None and not any(self._matches(doc, q) for q in alternatives):
+            return False
+        return all(match(doc.get(k), v) for k, v in query.items())
+
+    def _apply(self, query, update, upsert):
+        doc = next((d for d in self.docs if self._matches(d, query)), None)
+        if doc is None:
+            if not upsert:
+                return None
+            doc = {k: v for k, v in query.items() if not k.startswith('$') and not isinstance(v, dict)}
+            doc.setdefault('_id', ObjectId())
+            self.docs.append(doc)
+        if not any(k.startswith('$') for k in update):
+            _id = doc.get('_id', ObjectId())
+            doc.clear()
+            doc.update(dict(update, _id=_id))
+            return doc
+        for key, value in update.get('$set', {}).items():
+            doc[key] = value
+        for key in update.get('$unset', {}):
+            doc.pop(key, None)
+        for key, value in update.get('$push', {}).items():
+            doc.setdefault(key, []).append(value)
+        for key, condition in update.get('$pull', {}).items():
+            doc[key] = [v for v in doc.get(key, []) if v not in condition['$in']]
+        for path, amount in update.get('$inc', {}).items():
+            target, *rest = path.split('.')
+            if rest:
+                doc.setdefault(target, {})
+                doc[target][rest[0]] = doc[target].get(rest[0], 0) + amount
+            else:
+                doc[target] = doc.get(target, 0) + amount
+        return doc
+
+    def update_one(self, query, update, upsert=False):
+        self._record('update_one')
+        self._apply(query, update, upsert)
+
+    def update_many(self, query, update):
+        self._record('update_many')
+        matched = [d for d in self.docs if self._matches(d, query)]
+        for doc in matched:
+            self._apply({'_id': doc['_id']}, update, False)
+        return SimpleNamespace(matched_count=len(matched), modified_count=len(matched))
+
+    def bulk_write(self, requests, ordered=True):
+        self._record('bulk_write')
+        modified = 0
+        for request in requests:
+            if isinstance(request, DeleteOne):
+                doc = next((d for d in self.docs if self._matches(d, request._filter)), None)
+                if doc is not None:
+                    self.docs.remove(doc)
+                    modified += 1
+            elif isinstance(request, UpdateMany):
+                for doc in [d for d in self.docs if self._matches(d, request._filter)]:
+                    self._apply({'_id': doc['_id']}, request._doc, False)
+                    modified += 1
+            else:
+                modified += self._apply(request._filter, request._doc, request._upsert) is not None
+        return SimpleNamespace(modified_count=modified, inserted_count=0, upserted_count=0)
+
+    def create_indexes(self, indexes):
+        self._record('create_indexes')
+        for index_model in indexes:
+            doc = index_model.document
+            self.indexes[doc['name']] = dict(doc, key=list(doc['key'].items()))
+
+    def index_information(self):
+        self._record('index_information')
+        return dict(self.indexes)
+
+    def find_one(self, query=None, *args, **kwargs):
+        self._record('find_one')
+        return next((dict(d) for d in self.docs if self._matches(d, query)), None)
+
+    def find(self, query=None, projection=None):
+        self._record('find')
+        return FakeCursor([dict(d) for d in self.docs if self._matches(d, query)])
+
+    def insert_one(self, doc):
+        self._record('insert_one')
+        doc.setdefault('_id', ObjectId())
+        self.docs.append(dict(doc))
+
+    def with_options(self, **kwargs):
+        return self
+
+    def insert_many(self, docs, ordered=True):
+        self._record('insert_many')
+        for doc in docs:
+            doc.setdefault('_id', ObjectId())
+            self.docs.append(dict(doc))
+
+    def find_one_and_update(self, query, update, upsert=False, return_document=None):
+        self._record('find_one_and_update')
+        doc = self._apply(query, update, upsert)
+        return dict(doc) if doc is not None else None
+
+    def delete_one(self, query):
+        self._record('delete_one')
+        doc = next((d for d in self.docs if self._matches(d, query)), None)
+        if doc is not None:
+            self.docs.remove(doc)
+
+    def aggregate(self, pipeline, **kwargs):
+        self._record('aggregate')
+        return iter([])
+
+    def delete_many(self, query):
+        self._record('delete_many')
+        before = len(self.docs)
+        self.docs = [d for d in self.docs if not self._matches(d, query)]
+        return SimpleNamespace(deleted_count=before - len(self.docs))
+
+    def options(self):
+        return {}
+
+    def rename(self, new_name, dropTarget=False):
+        self._record('rename')
+        self.database.collections[new_name] = self
+        del self.database.collections[self.name]
+        self.name = new_name
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, keys, direction=None):
+        if isinstance(keys, str):
+            keys = [(keys, direction)]
+        for key, order in reversed(keys):
+            self.docs.sort(key=lambda d: d.get(key), reverse=order == -1)
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    async def to_list(self, length=None):
+        return self.docs
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        return iter(self.docs)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.commands = []
+        self.collections = {}
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(name, self.commands)
+            self.collections[name].database = self
+        return self.collections[name]
+
+    def list_collection_names(self):
+        return list(self.collections)
+
+    def command(self, command, name, **kwargs):
+        self.commands.append((name, command))
+        return {'ok': 1}
+
+    def count(self, command):
+        return sum(1 for _, c in self.commands if c == command)
+
+
+class FakeMongoTestCase(SimpleTestCase):
+    def setUp(self):
+        self.db = FakeDatabase()
+        patcher = mock.patch('backend.mongo.MongoDB.get_db', return_value=self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        models.reset_registry()
+        self.addCleanup(models.reset_registry)
+        counter.sequencer.discard()  # ID blocks reserved against the fake counters
+        self.addCleanup(counter.sequencer.discard)
+        patcher = mock.patch.object(user_cache, '_users', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class ModelRegistryTests(FakeMongoTestCase):
+    def test_model_is_built_once_per_process(self):
+        self.assertIs(get_model(User), get_model(User))
+
+    def test_indexes_are_created_once(self):
+        for _ in range(5):
+            get_model(User).find_by_username('alice')
+        self.assertEqual(self.db.count('create_indexes'), len(INDEX_PLAN))
+        self.assertEqual(self.db.count('find_one'), 5)
+
+    def test_constructing_a_model_issues_no_commands(self):
+        User()
+        self.assertEqual(self.db.commands, [])
+
+    def test_login_requests_only_read_the_user(self):
+        self.db['users'].docs.append({
+            '_id': 1, 'username': 'alice', 'email': 'alice@example.com',
+            'password_hash': hash_password('secret'),
+        })
+        factory = APIRequestFactory()
+        view = LoginView.as_view()
+        for _ in range(3):
+            request = factory.post('/api/login/', {'username': 'alice', 'password': 'secret'}, format='json')
+            self.assertEqual(view(request).status_code, 200)
+        # One index build for the process, then one lookup per successful login (never from the cache)
+        self.assertEqual(self.db.count('create_indexes'), len(INDEX_PLAN))
+        self.assertEqual(self.db.count('find'), 3)
+        self.assertEqual(self.db.count('find_one'), 0)
+
+
+@override_settings(PASSWORD_HASH_SCHEME='scrypt', PASSWORD_SCRYPT_N=1024)
+class PasswordHashTests(FakeMongoTestCase):
+    # Pre-versioning format: 64 hex chars of salt, then hex PBKDF2-SHA512 (100k iterations)
+    LEGACY = ('a' * 64) + hashlib.pbkdf2_hmac('sha512', b'secret', b'a' * 64, 100000).hex()
+
+    def test_hash_embeds_scheme_and_params(self):
+        stored = hash_password('secret')
+        self.assertTrue(stored.startswith('$scrypt$n=1024,r=8,p=1$'))
+        self.assertTrue(verify_password(stored, 'secret'))
+        self.assertFalse(verify_password(stored, 'wrong'))
+        self.assertFalse(needs_rehash(stored))
+        with override_settings(PASSWORD_SCRYPT_N=2048):
+            self.assertTrue(needs_rehash(stored))
+            self.assertTrue(verify_password(stored, 'secret'))
+        with override_settings(PASSWORD_HASH_SCHEME='pbkdf2-sha256', PASSWORD_PBKDF2_ITERATIONS=1000):
+            self.assertTrue(hash_password('secret').startswith('$pbkdf2-sha256$i=1000$'))
+
+    def test_legacy_hashes_still_verify(self):
+        self.assertTrue(verify_password(self.LEGACY, 'secret'))
+        self.assertFalse(verify_password(self.LEGACY, 'wrong'))
+        self.assertTrue(needs_rehash(self.LEGACY))
+        self.assertFalse(verify_password('not a hash', 'secret'))
+
+    def test_login_upgrades_outdated_hash_once(self):
+        self.db['users'].docs.append({
+            '_id': 1, 'username': 'alice', 'email': 'alice@example.com', 'password_hash': self.LEGACY,
+        })
+        factory = APIRequestFactory()
+        view = LoginView.as_view()
+        for _ in range(2):
+            request = factory.post('/api/login/', {'username': 'alice', 'password': 'secret'}, format='json')
+            self.assertEqual(view(request).status_code, 200)
+        stored = self.db['users'].docs[0]['password_hash']
+        self.assertTrue(stored.startswith('$scrypt$'))
+        self.assertEqual(self.db.count('update_one'), 1)
+
+    def test_stats_add_up_under_concurrent_calls(self):
+        before = utils.hasher_stats()
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            outcomes = list(pool.map(lambda _: self._try_hasher(), range(400)))
+        after = utils.hasher_stats()
+        self.assertEqual(after['in_flight'], 0)
+        self.assertEqual(after['completed'] - before['completed'], outcomes.count('ok'))
+        self.assertEqual(after['rejected'] - before['rejected'], outcomes.count('busy'))
+
+    def _try_hasher(self):
+        try:
+            utils.run_hasher(len, 'secret')
+            return 'ok'
+        except utils.HasherBusy:
+            return 'busy'
+
+    def test_full_pool_rejects_instead_of_queueing(self):
+        with mock.patch.object(utils, '_get_pool', return_value=(None, threading.BoundedSemaphore(1))):
+            _, slots = utils._get_pool()
+            slots.acquire()
+            with self.assertRaises(utils.HasherBusy):
+                utils.run_hasher(hash_password, 'secret')
+            request = APIRequestFactory().post('/api/login/', {'username': 'alice', 'password': 'secret'}, format='json')
+            self.db['users'].docs.append({'_id': 1, 'username': 'alice', 'password_hash': self.LEGACY})
+            self.assertEqual(LoginView.as_view()(request).status_code, 503)
+
+
+@override_settings(PASSWORD_HASH_SCHEME='scrypt', PASSWORD_SCRYPT_N=1024, RENAME_JOBS_ASYNC=False)
+class UserLookupTests(FakeMongoTestCase):
+    def setUp(self):
+        super().setUp()
+        get_model(User)  # index build happens once per process, outside the counts
+        self.db['users'].docs.append({
+            '_id': 1, 'username': 'alice', 'email': 'alice@example.com', 'password_hash': hash_password('secret'),
+        })
+        self.db.commands.clear()
+        self.factory = APIRequestFactory()
+
+    def _post(self, view, path, body):
+        return view.as_view()(self.factory.post(path, body, format='json'))
+
+    def _calls(self):
+        calls = [command for _, command in self.db.commands]
+        self.db.commands.clear()
+        return calls
+
+    def test_round_trips_per_endpoint(self):
+        # Email login used to be find_one by username, then find_one by email
+        response = self._post(LoginView, '/api/login/', {'username': 'alice@example.com', 'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._calls(), ['find'])
+        # A correct password is confirmed against a fresh read; a wrong one is refused from the user cache
+        self._post(LoginView, '/api/login/', {'username': 'alice', 'password': 'secret'})
+        self.assertEqual(self._calls(), ['find'])
+        self._post(LoginView, '/api/login/', {'username': 'alice', 'password': 'wrong'})
+        self.assertEqual(self._calls(), [])
+
+        # Signup used to check username and email with two find_one calls
+        response = self._post(SignupView, '/api/signup/', {'username': 'alice', 'email': 'new@example.com', 'password': 'x'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._calls(), ['find'])
+
+        # Profile update used up to two lookups, two uniqueness checks, update_one and a find_one refresh
+        # (the rename job record and its background moves are counted separately)
+        with mock.patch('api.views.submit_rename_job'):
+            response = self._post(UpdateProfileView, '/api/profile/update/', {
+                'identifier': 'alice@example.com', 'username': 'alice2', 'email': 'alice2@example.com',
+            })
+        self.assertEqual(response.data['user']['username'], 'alice2')
+        # (plus the check that the new name is not reserved by another user's unfinished rename)
+        self.assertEqual(self._calls(), ['find', 'find', 'find_one', 'insert_one', 'find_one_and_update'])
+
+        # Password change used up to two lookups before the update
+        response = self._post(ChangePasswordView, '/api/change-password/', {
+            'identifier': 'alice2', 'current_password': 'secret', 'new_password': 'secret2',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._calls(), ['find', 'update_one'])
+
+    def test_writes_invalidate_cached_records(self):
+        self._post(LoginView, '/api/login/', {'username': 'alice', 'password': 'secret'})
+        self._post(UpdateProfileView, '/api/profile/update/', {'identifier': 'alice', 'username': 'alice2'})
+        self.assertEqual(self._post(LoginView, '/api/login/', {'username': 'alice', 'password': 'secret'}).status_code, 401)
+
+        self._post(LoginView, '/api/login/', {'username': 'alice2', 'password': 'secret'})
+        self._post(ChangePasswordView, '/api/change-password/', {
+            'identifier': 'alice2', 'current_password': 'secret', 'new_password': 'secret2',
+        })
+        self.assertEqual(self._post(LoginView, '/api/login/', {'username': 'alice2', 'password': 'secret'}).status_code, 401)
+        self.assertEqual(self._post(LoginView, '/api/login/', {'username': 'alice2', 'password': 'secret2'}).status_code, 200)
+
+    def test_old_password_fails_after_a_change_on_another_worker(self):
+        self._post(LoginView, '/api/login/', {'username': 'alice', 'password': 'secret'})
+        # Changed elsewhere: this process still caches the old hash
+        self.db['users'].docs[0]['password_hash'] = hash_password('rotated')
+        self.assertEqual(self._post(LoginView, '/api/login/', {'username': 'alice', 'password': 'secret'}).status_code, 401)
+        self.assertEqual(self._post(LoginView, '/api/login/', {'username': 'alice', 'password': 'rotated'}).status_code, 200)
+
+
+@override_settings(SESSION_TOKEN_KEYS=['current-key'], SESSION_TOKEN_TTL=60,
+                   PASSWORD_HASH_SCHEME='scrypt', PASSWORD_SCRYPT_N=1024)
+class SessionTokenTests(FakeMongoTestCase):
+    def setUp(self):
+        super().setUp()
+        get_model(User)
+        self.db['users'].docs.append({
+            '_id': 1, 'username': 'alice', 'email': 'alice@example.com', 'password_hash': hash_password('secret'),
+        })
+        self.factory = APIRequestFactory()
+
+    def _login(self, password='secret'):
+        request = self.factory.post('/api/login/', {'username': 'alice', 'password': password}, format='json')
+        return LoginView.as_view()(request).data['token']
+
+    def _stats(self, token=None, query=''):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+        return MoodStatsView.as_view()(self.factory.get(f'/api/mood/stats/{query}', **headers))
+
+    def test_round_trip_expiry_and_tampering(self):
+        token, expires_at = tokens.issue_token(1, 'alice', now=1000)
+        claims = tokens.verify_token(token, now=1030)
+        self.assertEqual((claims['sub'], claims['usr'], claims['exp']), ('1', 'alice', expires_at))
+        with self.assertRaisesMessage(tokens.InvalidToken, 'expired'):
+            tokens.verify_token(token, now=expires_at)
+        kid, payload, signature = token.split('.')
+        forged = tokens._b64encode(b'{"sub":"2","usr":"bob","exp":9999999999}')
+        for bad in (f'{kid}.{forged}.{signature}', f'{kid}.{payload}.{signature[:-2]}AA', 'junk', f'x.{payload}.{signature}'):
+            with self.assertRaises(tokens.InvalidToken):
+                tokens.verify_token(bad, now=1030)
+
+    def test_key_rotation_keeps_old_tokens_valid(self):
+        old, _ = tokens.issue_token(1, 'alice')
+        with override_settings(SESSION_TOKEN_KEYS=['next-key', 'current-key']):
+            new, _ = tokens.issue_token(1, 'alice')
+            self.assertNotEqual(old.split('.')[0], new.split('.')[0])
+            self.assertEqual(tokens.verify_token(old)['usr'], 'alice')
+        with override_settings(SESSION_TOKEN_KEYS=['next-key']):
+            self.assertEqual(tokens.verify_token(new)['usr'], 'alice')
+            with self.assertRaises(tokens.InvalidToken):
+                tokens.verify_token(old)
+
+    def test_identity_comes_from_the_token_without_reading_users(self):
+        token = self._login()
+        self.db.commands.clear()
+        response = self._stats(token)
+        self.assertEqual((response.status_code, response.data['username']), (200, 'alice'))
+        self.assertNotIn('users', [name for name, _ in self.db.commands])
+        self.assertEqual(self._stats(token, '?username=bob').status_code, 403)
+        self.assertEqual(self._stats(token[:-4] + 'AAAA').status_code, 401)
+        self.assertEqual(self._stats(query='?username=bob').status_code, 200)
+        with override_settings(SESSION_TOKENS_REQUIRED=True):
+            self.assertEqual(self._stats(query='?username=bob').status_code, 401)
+
+    def test_identity_follows_sub_not_the_username_claim(self):
+        # Issued before alice was renamed from bob: `usr` is stale, `sub` still names her
+        stale, _ = tokens.issue_token(1, 'bob')
+        response = self._stats(stale)
+        self.assertEqual((response.status_code, response.data['username']), (200, 'alice'))
+        self.assertEqual(self._stats(stale, '?username=bob').status_code, 403)
+        gone, _ = tokens.issue_token(2, 'alice')
+        self.assertEqual(self._stats(gone).status_code, 401)
+
+    def test_bad_token_does_not_block_login_or_signup(self):
+        headers = {'HTTP_AUTHORIZATION': 'Bearer expired.or.garbage'}
+        request = self.factory.post('/api/login/', {'username': 'alice', 'password': 'secret'}, format='json', **headers)
+        self.assertEqual(LoginView.as_view()(request).status_code, 200)
+        request = self.factory.post('/api/signup/', {'username': 'bob', 'email': 'bob@example.com', 'password': 'pw'},
+                                    format='json', **headers)
+        self.assertEqual(SignupView.as_view()(request).status_code, 201)
+        request = self.factory.post('/api/token/refresh/', **headers)
+        self.assertEqual(TokenRefreshView.as_view()(request).status_code, 401)
+
+    def test_password_change_stops_refresh_of_older_sessions(self):
+        token = self._login()
+        refresh = TokenRefreshView.as_view()
+        request = self.factory.post('/api/token/refresh/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(refresh(request).status_code, 200)
+        with mock.patch('time.time', return_value=time.time() + 5):
+            request = self.factory.post('/api/change-password/', {'current_password': 'secret', 'new_password': 'next'},
+                                        format='json', HTTP_AUTHORIZATION=f'Bearer {token}')
+            response = ChangePasswordView.as_view()(request)
+            self.assertEqual(response.status_code, 200)
+            request = self.factory.post('/api/token/refresh/', HTTP_AUTHORIZATION=f'Bearer {token}')
+            self.assertEqual(refresh(request).status_code, 401)
+            request = self.factory.post('/api/token/refresh/', HTTP_AUTHORIZATION=f"Bearer {response.data['token']}")
+            self.assertEqual(refresh(request).status_code, 200)
+
+
+@override_settings(RENAME_JOBS_ASYNC=False, RENAME_JOB_BATCH_SIZE=2)
+class RenameJobTests(FakeMongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db['users'].docs.append({'_id': 7, 'username': 'alice', 'email': 'alice@example.com'})
+        created_at = datetime(2024, 5, 1)
+        for name in ('mood_entries', 'chat_messages', 'journal_entries'):
+            self.db[name].docs.extend({'_id': i, 'username': 'alice', 'created_at': created_at} for i in range(5))
+        self.db['journal_entries'].docs.append({'_id': 99, 'username': 'bob', 'created_at': created_at})
+        self.factory = APIRequestFactory()
+
+    def _rename(self, identifier, username):
+        request = self.factory.post('/api/profile/update/', {'identifier': identifier, 'username': username}, format='json')
+        return UpdateProfileView.as_view()(request)
+
+    def _owners(self, name):
+        return sorted({doc['username'] for doc in self.db[name].docs})
+
+    def test_profile_update_records_and_runs_a_job(self):
+        response = self._rename('alice', 'alicia')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['user']['username'], 'alicia')
+        for name in ('mood_entries', 'chat_messages'):
+            self.assertEqual(self._owners(name), ['alicia'])
+            self.assertTrue(all(doc['user_id'] == 7 for doc in self.db[name].docs))
+        self.assertEqual(self._owners('journal_entries'), ['alicia', 'bob'])
+
+        status_request = self.factory.get(f"/api/profile/rename-status/?id={response.data['rename_job']['id']}")
+        job = RenameJobView.as_view()(status_request).data
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual((job['progress']['mood_entries'], job['progress']['journal_entries']), (5, 5))
+
+    def test_failed_job_resumes_where_it_stopped(self):
+        chats = self.db['chat_messages']
+        real_update_many = chats.update_many
+        calls = []
+
+        def flaky(query, update):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError('primary stepped down')
+            return real_update_many(query, update)
+
+        with mock.patch.object(chats, 'update_many', side_effect=flaky):
+            job_id = self._rename('alice', 'alicia').data['rename_job']['id']
+        job = self.db['username_renames'].docs[0]
+        self.assertEqual((job['status'], job['progress']['chat_messages']), ('failed', 2))
+        self.assertEqual(self._owners('chat_messages'), ['alice', 'alicia'])
+
+        rename_jobs.resume_jobs(self.db)
+        self.assertEqual(self._owners('chat_messages'), ['alicia'])
+        self.assertEqual((job['status'], job['progress']['chat_messages'], job['attempts']), ('done', 5, 2))
+        self.assertEqual(str(job['_id']), job_id)
+
+    def test_renames_of_one_user_apply_in_order(self):
+        with mock.patch('api.views.submit_rename_job'):
+            self._rename('alice', 'b')
+            self._rename('b', 'c')
+        jobs = self.db['username_renames'].docs
+        self.assertEqual([j['status'] for j in jobs], ['pending', 'pending'])
+        rename_jobs.run_job(self.db, jobs[1]['_id'])  # the later job runs the earlier one first
+        self.assertEqual([j['status'] for j in jobs], ['done', 'done'])
+        for name in ('mood_entries', 'chat_messages', 'journal_entries'):
+            self.assertEqual(self._owners(name), ['bob', 'c'] if name == 'journal_entries' else ['c'])
+
+    def test_status_requires_a_valid_id(self):
+        for query in ('', '?id=', '?id=not-an-id', '?id=123'):
+            response = RenameJobView.as_view()(self.factory.get(f'/api/profile/rename-status/{query}'))
+            self.assertEqual(response.status_code, 400, query)
+        self.assertNotIn(('username_renames', 'find_one'), self.db.commands)
+
+    def test_rollups_merge_into_rows_the_new_name_already_has(self):
+        rollups = self.db['mood_daily_rollups']
+        day = datetime(2024, 5, 1)
+        rollups.docs.extend([
+            {'_id': 1, 'username': 'alice', 'day': day, 'total': 2, 'moods': {'happy': 2}},
+            {'_id': 2, 'username': 'alice', 'day': datetime(2024, 5, 2), 'total': 1, 'moods': {'sad': 1}},
+            # Posted under the new name while the job was pending
+            {'_id': 3, 'username': 'alicia', 'day': day, 'total': 1, 'moods': {'happy': 1}},
+        ])
+        with mock.patch('api.views.submit_rename_job'):
+            job_id = ObjectId(self._rename('alice', 'alicia').data['rename_job']['id'])
+        rename_jobs.run_job(self.db, job_id)
+
+        rows = {row['day']: row for row in rollups.docs}
+        self.assertEqual(len(rollups.docs), 2)
+        self.assertEqual((rows[day]['total'], rows[day]['moods']), (3, {'happy': 3}))
+        self.assertEqual(rows[datetime(2024, 5, 2)]['moods'], {'sad': 1})
+        self.assertTrue(all(row['username'] == 'alicia' and not row['merged_from'] for row in rollups.docs))
+        self.assertIn(('activity_usages', 'aggregate'), self.db.commands)  # activity view recomputed
+
+    def test_freed_name_stays_reserved_and_later_documents_stay_put(self):
+        with mock.patch('api.views.submit_rename_job'):
+            job_id = ObjectId(self._rename('alice', 'alicia').data['rename_job']['id'])
+        request = self.factory.post('/api/signup/', {'username': 'alice', 'email': 'x@example.com', 'password': 'x'}, format='json')
+        self.assertEqual(SignupView.as_view()(request).status_code, 400)
+
+        # A document under the old name written after the job started belongs to someone else
+        self.db['chat_messages'].docs.append({'_id': 50, 'username': 'alice', 'created_at': datetime.utcnow()})
+        rename_jobs.run_job(self.db, job_id)
+        self.assertEqual(self._owners('chat_messages'), ['alice', 'alicia'])
+        self.assertEqual(next(d for d in self.db['chat_messages'].docs if d['_id'] == 50)['username'], 'alice')
+        self.assertFalse(rename_jobs.is_reserved(self.db, 'alice'))
+
+
+class BatchMigrationTests(FakeMongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db['users'].docs.extend([{'_id': 1, 'username': 'alice'}, {'_id': 2, 'username': 'bob'}])
+        self.db['mood_entries'].docs.extend(
+            {'_id': i, 'user_id': str(i % 3), 'mood': 'happy', 'notes': 'x'} for i in range(1, 8)
+        )
+        self.db['mood_entries'].docs.append({'_id': 8, 'username': 'alice', 'mood_score': 3, 'activities': []})
+
+    def _run(self, migration, **kwargs):
+        return MigrationRunner(self.db, migration, chunk_size=3, **kwargs).run()
+
+    def test_migrate_reads_users_once_and_writes_per_chunk(self):
+        progress = self._run(LegacyMoodEntries())
+        self.assertEqual(self.db.commands.count(('users', 'find')), 1)
+        self.assertNotIn(('users', 'find_one'), self.db.commands)
+        self.assertEqual(self.db.count('bulk_write'), 3)  # 7 legacy entries in chunks of 3
+        self.assertEqual((progress.scanned, progress.written, progress.skipped), (7, 5, 2))  # user_id '0' has no user
+        migrated = [d for d in self.db['mood_entries'].docs if d['_id'] < 8 and 'username' in d]
+        self.assertEqual({(d['username'], d['user_id']) for d in migrated}, {('alice', 1), ('bob', 2)})
+        self.assertFalse(any('notes' in d for d in migrated))
+        self.assertEqual(self.db[CHECKPOINT_COLLECTION].docs[0]['status'], 'done')
+
+    def test_cleanup_resumes_from_last_written_chunk(self):
+        entries = self.db['mood_entries']
+        for doc in entries.docs[:7]:
+            doc['mood_score'] = 1
+        real_bulk_write = entries.bulk_write
+        calls = []
+
+        def flaky(requests, ordered=True):
+            calls.append([r._filter['_id'] for r in requests])
+            if len(calls) == 2:
+                raise RuntimeError('connection reset')
+            return real_bulk_write(requests, ordered=ordered)
+
+        with mock.patch.object(entries, 'bulk_write', side_effect=flaky):
+            with self.assertRaises(RuntimeError):
+                self._run(MoodEntryCleanup())
+            self.assertEqual(self.db[CHECKPOINT_COLLECTION].docs[0]['last_id'], 3)
+            progress = self._run(MoodEntryCleanup())
+        self.assertEqual(calls, [[1, 2, 3], [4, 5, 6], [4, 5, 6], [7, 8]])
+        self.assertEqual((progress.scanned, progress.run_scanned, progress.written), (8, 5, 8))
+        self.assertFalse(any('mood_score' in d or 'activities' in d for d in entries.docs))
+
+    def test_dry_run_writes_nothing(self):
+        before = [dict(d) for d in self.db['mood_entries'].docs]
+        progress = self._run(LegacyMoodEntries(), dry_run=True)
+        self.assertEqual((progress.scanned, progress.written), (7, 5))
+        self.assertEqual(self.db['mood_entries'].docs, before)
+        self.assertEqual(self.db.count('bulk_write') + self.db.count('update_one'), 0)
+
+
+class IdMigrationTests(FakeMongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.legacy = [ObjectId(), ObjectId()]
+        self.db['counters'].docs.append({'_id': 'users', 'sequence_value': 1})
+        self.db['users'].docs.extend([
+            {'_id': 1, 'username': 'carol'},
+            {'_id': self.legacy[0], 'username': 'alice'},
+            {'_id': self.legacy[1], 'username': 'bob'},
+        ])
+
+    def _copy(self, **kwargs):
+        for id_type, renumber in id_migration.ID_TYPES:
+            MigrationRunner(self.db, id_migration.CopyToShadow('users', id_type, renumber), chunk_size=2, **kwargs).run()
+        return {doc['username']: doc['_id'] for doc in self.db['users__sequential'].docs}
+
+    def test_copy_reserves_ids_per_chunk_and_records_the_map(self):
+        ids = self._copy()
+        self.assertEqual(ids['carol'], 1)
+        self.assertEqual(sorted((ids['alice'], ids['bob'])), [2, 3])
+        self.assertEqual(self.db.commands.count(('counters', 'find_one_and_update')), 1)
+        self.assertEqual(self.db.commands.count(('id_map', 'insert_many')), 1)
+        self.assertEqual({m['old_id']: m['new_id'] for m in self.db['id_map'].docs},
+                         {self.legacy[0]: ids['alice'], self.legacy[1]: ids['bob']})
+
+        # A restarted copy reuses the recorded ids instead of reserving new ones
+        self.assertEqual(self._copy(restart=True), ids)
+        self.assertEqual(len(self.db['id_map'].docs), 2)
+
+    def test_replayed_changes_follow_the_id_map(self):
+        ids = self._copy()
+        shadow = self.db['users__sequential']
+        events = [
+            {'operationType': 'insert', 'documentKey': {'_id': 4}, 'fullDocument': {'_id': 4, 'username': 'dave'}},
+            {'operationType': 'update', 'documentKey': {'_id': self.legacy[0]},
+             'updateDescription': {'updatedFields': {'email': 'a@example.com'}, 'removedFields': []}},
+            {'operationType': 'delete', 'documentKey': {'_id': self.legacy[1]}},
+        ]
+        applied, failed = id_migration.apply_requests(shadow, id_migration.event_requests(self.db, 'users', events))
+        self.assertEqual((applied, failed), (3, 0))
+        by_id = {doc['_id']: doc for doc in shadow.docs}
+        self.assertEqual(by_id[ids['alice']]['email'], 'a@example.com')
+        self.assertNotIn(ids['bob'], by_id)
+        self.assertEqual(by_id[4]['username'], 'dave')
+
+    def test_references_are_rewritten_in_bulk(self):
+        ids = self._copy()
+        self.db['mood_entries'].docs.extend([
+            {'_id': 1, 'user_id': self.legacy[0]},
+            {'_id': 2, 'user_id': str(self.legacy[0])},
+            {'_id': 3, 'user_id': 1},
+        ])
+        written = id_migration.rewrite_references(self.db, 'users', chunk_size=100)
+        self.assertEqual(written[('mood_entries', 'user_id')], 2)
+        self.assertEqual([d['user_id'] for d in self.db['mood_entries'].docs], [ids['alice'], ids['alice'], 1])
+        self.assertEqual(self.db.commands.count(('mood_entries', 'bulk_write')), 1)
+
+    @override_settings(ID_MIGRATION_CUTOVER_LAG=100, ID_MIGRATION_CATCH_UP_PASSES=3)
+    def test_catch_up_stops_at_the_lag_threshold_or_the_pass_limit(self):
+        self.db['id_migrations'].docs.append({'_id': 'users', 'phase': 'catch_up', 'resume_token': 't0'})
+        migration = id_migration.IdMigration(self.db, 'users', chunk_size=10)
+        with mock.patch.object(migration, '_drain', side_effect=[('t1', 98, 3, False), ('t2', 40, 0, False)]) as drain:
+            migration._catch_up({'resume_token': 't0'})
+        self.assertEqual(drain.call_count, 2)
+        self.assertEqual(drain.call_args.kwargs['limit'], 100)
+        self.assertEqual(self.db['id_migrations'].docs[0]['phase'], 'cutover')
+
+        # Writes that keep outpacing the replay don't hold the cutover back forever
+        with mock.patch.object(migration, '_drain', return_value=('t', 100, 1, False)) as drain:
+            migration._catch_up({'resume_token': 't0'})
+        self.assertEqual(drain.call_count, 3)
+
+    def test_cutover_replays_the_rest_while_writes_are_blocked(self):
+        self._copy()
+        self.db['id_migrations'].docs.append({'_id': 'users', 'phase': 'cutover', 'resume_token': 't0'})
+        migration = id_migration.IdMigration(self.db, 'users')
+
+        def drain(target, token, limit=None):
+            self.assertIn(('users', 'collMod'), self.db.commands)
+            return 't1', 2, 0, False
+
+        with mock.patch.object(migration, '_drain', side_effect=drain):
+            state = migration.run()
+        self.assertEqual(state['phase'], 'done')
+        self.assertEqual(self.db.commands.count(('users', 'collMod')), 1)  # the block left with the old collection
+        self.assertNotIn('write_block', state)
+        self.assertEqual(len(self.db['users'].docs), 3)
+
+    def test_cutover_keeps_the_original_validation_rules(self):
+        rules = {'validator': {'username': {'$type': 'string'}}, 'validationLevel': 'moderate'}
+        for offline in (False, True):
+            with self.subTest(offline=offline):
+                self.db['users__sequential'].docs.clear()
+                self._copy()
+                self.db['id_migrations'].docs[:] = [{'_id': 'users', 'phase': 'cutover', 'resume_token': 't0', 'offline': offline}]
+                migration = id_migration.IdMigration(self.db, 'users', offline=offline)
+                with mock.patch.object(FakeCollection, 'options', return_value=rules), \
+                        mock.patch.object(migration, '_drain', return_value=('t1', 0, 0, False)), \
+                        mock.patch.object(self.db, 'command', wraps=self.db.command) as command:
+                    migration.run()
+                self.assertEqual(command.call_args, mock.call('collMod', 'users', **rules))
+
+    def test_failed_cutover_lifts_the_write_block(self):
+        self._copy()
+        self.db['id_migrations'].docs.append({'_id': 'users', 'phase': 'cutover', 'resume_token': 't0'})
+        migration = id_migration.IdMigration(self.db, 'users')
+        with mock.patch.object(migration, '_drain', side_effect=RuntimeError('stream lost')):
+            with self.assertRaises(RuntimeError):
+                migration.run()
+        self.assertEqual(self.db.commands.count(('users', 'collMod')), 2)
+        self.assertNotIn('write_block', self.db['id_migrations'].docs[0])
+
+
+class IndexPlanTests(FakeMongoTestCase):
+    def test_diff_reports_missing_changed_and_extra(self):
+        users = self.db['users']
+        users.indexes['users_username_unique'] = {'key': [('username', 1)]}  # not unique
+        users.indexes['created_at_1'] = {'key': [('created_at', 1)]}
+        diff = diff_indexes(users)
+        self.assertEqual([m.document['name'] for m in diff['missing']], ['users_email_unique'])
+        self.assertEqual([m.document['name'] for m in diff['changed']], ['users_username_unique'])
+        self.assertEqual(diff['extra'], ['created_at_1'])
+
+    def test_applied_plan_has_no_diff(self):
+        models.ensure_indexes()
+        for name in INDEX_PLAN:
+            diff = diff_indexes(self.db[name])
+            self.assertEqual((diff['missing'], diff['changed'], diff['extra']), ([], [], []))
+
+
+class PaginationTests(SimpleTestCase):
+    def test_cursor_round_trip(self):
+        created_at = datetime(2024, 5, 1, 12, 30, 0, 123000)
+        token = encode_cursor({'_id': 42, 'created_at': created_at}, 'next')
+        self.assertEqual(decode_cursor(token), ('next', created_at, 42))
+
+    def test_tampered_cursor_is_rejected(self):
+        with self.assertRaises(InvalidCursor):
+            decode_cursor('not-a-cursor')
+
+    def test_documents_without_created_at_are_paged_by_id(self):
+        legacy = ObjectId()
+        collection = mock.MagicMock()
+        found = collection.find.return_value.sort.return_value.limit.return_value
+        found.__iter__.side_effect = lambda: iter([{'_id': ObjectId(), 'created_at': datetime(2024, 5, 1)}, {'_id': legacy}, {'_id': ObjectId()}])
+        docs, next_cursor, _ = paginate(collection, {'username': 'alice'}, page_size=2)
+        self.assertEqual(docs[-1], {'_id': legacy})
+        self.assertEqual(decode_cursor(next_cursor), ('next', None, legacy))
+
+        # Newest first: the last dated page runs on into the undated documents
+        dated = encode_cursor(docs[0], 'next')
+        paginate(collection, {'username': 'alice'}, cursor=dated, page_size=2)
+        self.assertIn({'created_at': None}, collection.find.call_args.args[0]['$and'][1]['$or'])
+
+        paginate(collection, {'username': 'alice'}, cursor=next_cursor, page_size=2)
+        self.assertEqual(collection.find.call_args.args[0]['$and'][1], {'created_at': None, '_id': {'$lt': legacy}})
+
+        # Walking back up, every dated document is newer than the undated ones
+        paginate(collection, {'username': 'alice'}, cursor=encode_cursor({'_id': legacy}, 'prev'), page_size=2)
+        self.assertEqual(collection.find.call_args.args[0]['$and'][1], {'$or': [
+            {'created_at': {'$ne': None}}, {'created_at': None, '_id': {'$gt': legacy}},
+        ]})
+
+    def test_page_size_is_clamped(self):
+        self.assertEqual(parse_page_size('100000'), 200)
+        self.assertEqual(parse_page_size('0'), 1)
+        self.assertEqual(parse_page_size('abc', default=100), 100)
+
+
+@override_settings(
+    MONGO_SERVER_SELECTION_TIMEOUT_MS=2000, MONGO_MAX_POOL_SIZE='50', MONGO_MIN_POOL_SIZE='', MONGO_MAX_IDLE_TIME_MS=None,
+    MONGO_WAIT_QUEUE_TIMEOUT_MS=None, MONGO_COMPRESSORS='zstd,zlib', MONGO_READ_PREFERENCE=None,
+    MONGO_WRITE_CONCERN='majority', MONGO_JOURNAL=None,
+)
+class MongoClientTests(SimpleTestCase):
+    def setUp(self):
+        for name in ('_client', '_db', '_pid'):
+            patcher = mock.patch.object(MongoDB, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('backend.mongo.MongoClient', side_effect=lambda *a, **kw: mock.MagicMock())
+        self.client_class = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_settings_map_to_client_options_and_unset_ones_are_omitted(self):
+        self.assertEqual(MongoDB.get_client_options(), {
+            'serverSelectionTimeoutMS': 2000, 'maxPoolSize': 50, 'compressors': 'zstd,zlib', 'w': 'majority',
+        })
+        MongoDB.get_client()
+        kwargs = self.client_class.call_args.kwargs
+        self.assertEqual(kwargs['maxPoolSize'], 50)
+        self.assertNotIn('minPoolSize', kwargs)
+        self.assertEqual(kwargs['event_listeners'], [MongoDB.pool_stats])
+
+    def test_client_is_rebuilt_after_a_fork(self):
+        first = MongoDB.get_client()
+        self.assertIs(MongoDB.get_client(), first)
+        with mock.patch('os.getpid', return_value=-1):
+            second = MongoDB.get_client()
+            self.assertIsNot(second, first)
+            self.assertEqual(MongoDB._pid, -1)
+            self.assertTrue(MongoDB.get_pool_stats()['connected'])
+        self.assertEqual(self.client_class.call_count, 2)
+        first.close.assert_not_called()  # the parent process still owns those sockets
+
+
+class PoolStatsTests(SimpleTestCase):
+    def test_counts_cmap_events(self):
+        stats = PoolStats()
+        event = SimpleNamespace(duration=0.002)
+        for _ in range(3):
+            stats.connection_created(event)
+        stats.connection_closed(event)
+        stats.connection_checked_out(event)
+        stats.connection_checked_out(SimpleNamespace(duration=0.004))
+        stats.connection_checked_in(event)
+        stats.connection_check_out_failed(event)
+        stats.pool_cleared(event)
+        self.assertEqual(stats.snapshot(), {
+            'connections_open': 2, 'checked_out': 1, 'checkouts': 2, 'checkout_failures': 1,
+            'wait_time_avg_ms': 3.0, 'wait_time_max_ms': 4.0, 'pool_clears': 1,
+        })
+        stats.reset()
+        self.assertEqual(stats.snapshot()['checkouts'], 0)
+
+
+class AsyncMongoDBTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch('backend.mongo.AsyncMongoClient', side_effect=lambda *a, **kw: mock.AsyncMock())
+        self.client_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(AsyncMongoDB, '_clients', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def _requests(self, n):
+        return [AsyncMongoDB.get_client() for _ in range(n)]
+
+    def test_one_client_per_loop_closed_with_the_loop(self):
+        clients = asyncio.run(self._requests(3))
+        self.assertEqual(len(set(map(id, clients))), 1)
+        clients[0].close.assert_awaited_once()
+        self.assertEqual(AsyncMongoDB._clients, {})
+
+        # Each loop async_to_sync starts under WSGI gets a client that goes away with it
+        later = asyncio.run(self._requests(1))[0]
+        self.assertIsNot(later, clients[0])
+        later.close.assert_awaited_once()
+        self.assertEqual(self.client_class.call_count, 2)
+
+    def test_explicit_close_is_not_repeated_at_shutdown(self):
+        async def request():
+            client = AsyncMongoDB.get_client()
+            await AsyncMongoDB.close_connection()
+            return client
+
+        asyncio.run(request()).close.assert_awaited_once()
+
+
+class ProjectionTests(SimpleTestCase):
+    def test_no_params_fetches_whole_documents(self):
+        self.assertIsNone(build_projection('journal_entries'))
+
+    def test_fields_always_keep_cursor_keys(self):
+        self.assertEqual(
+            build_projection('mood_entries', fields='mood_description'),
+            {'_id': 1, 'created_at': 1, 'mood_description': 1},
+        )
+
+    def test_unknown_field_is_rejected(self):
+        with self.assertRaises(InvalidFields):
+            build_projection('journal_entries', fields='password_hash')
+
+    def test_summary_truncates_content_server_side(self):
+        projection = build_projection('journal_entries', summary=True, summary_length='50')
+        self.assertNotIn('metadata', projection)
+        self.assertEqual(projection['content'], {'$substrCP': [{'$ifNull': ['$content', '']}, 0, 50]})
+        self.assertIn('content_length', projection)
+
+
+class BSONJSONTests(SimpleTestCase):
+    def setUp(self):
+        self.oid = ObjectId()
+        self.doc = {
+            '_id': 7, 'username': 'alice', 'session': self.oid,
+            'created_at': datetime(2024, 5, 1, 12, 30, 0, 123000),
+        }
+        self.expected = (
+            '{"items":[{"_id":"7","username":"alice","session":"%s",'
+            '"created_at":"2024-05-01T12:30:00.123000"}]}' % self.oid
+        ).encode('utf-8')
+
+    def test_raw_documents_encode_with_string_ids(self):
+        raw = RawBSONDocument(encode(self.doc))
+        self.assertEqual(dumps({'items': [raw]}, use_orjson=False), self.expected)
+
+    def test_orjson_matches_stdlib_output(self):
+        if not ORJSON_AVAILABLE:
+            self.skipTest('orjson not installed')
+        raw = RawBSONDocument(encode(self.doc))
+        self.assertEqual(dumps({'items': [raw]}, use_orjson=True), self.expected)
+
+
+class StubGenAI:
+    """Stands in for google.generativeai and counts what gets constructed"""
+
+    def __init__(self):
+        self.configure_calls = 0
+        self.models_built = 0
+        self.sent = 0
+        self.fail = False
+        stub = self
+
+        class GenerativeModel:
+            def __init__(self, model_name, system_instruction=None):
+                stub.models_built += 1
+                self.system_instruction = system_instruction
+
+            def start_chat(self, history=None):
+                return SimpleNamespace(send_message=lambda message, **kwargs: stub.send(message))
+
+        self.GenerativeModel = GenerativeModel
+        self.types = SimpleNamespace(GenerationConfig=lambda **kwargs: kwargs)
+
+    def configure(self, api_key=None):
+        self.configure_calls += 1
+
+    def send(self, message):
+        self.sent += 1
+        if self.fail:
+            raise RuntimeError('503 unavailable')
+        return SimpleNamespace(text='stub reply')
+
+
+class GeminiProviderTests(SimpleTestCase):
+    def setUp(self):
+        self.genai = StubGenAI()
+        for patcher in (
+            mock.patch.object(chatbot, 'genai', self.genai),
+            mock.patch.object(chatbot, 'GEMINI_AVAILABLE', True),
+            mock.patch.dict('os.environ', {'GEMINI_API_KEY': 'test-key'}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        chatbot.reset_gemini_provider()
+        self.addCleanup(chatbot.reset_gemini_provider)
+
+    def test_configured_once_and_one_model_per_prompt(self):
+        for mood in ['sad', 'sad', 'calm', 'calm', 'unknown', 'neutral']:
+            self.assertEqual(chatbot.get_gemini_provider().generate('hi', mood, []), 'stub reply')
+        self.assertEqual(self.genai.configure_calls, 1)
+        # sad, calm, and the shared neutral prompt for unknown/neutral
+        self.assertEqual(self.genai.models_built, 3)
+
+    def test_concurrent_requests_share_one_model(self):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            replies = list(pool.map(lambda _: chatbot.get_gemini_provider().generate('hi', 'anxious', []), range(32)))
+        self.assertEqual(set(replies), {'stub reply'})
+        self.assertEqual(self.genai.models_built, 1)
+
+    @override_settings(LLM_BREAKER_MIN_CALLS=3, LLM_BREAKER_FAILURE_RATE=1.0)
+    def test_open_circuit_skips_gemini(self):
+        self.genai.fail = True
+        for _ in range(3):
+            self.assertIsNone(chatbot.get_gemini_provider().generate('hi', 'sad', []))
+        self.assertEqual(self.genai.sent, 3)
+        self.assertIsNone(chatbot.get_gemini_provider().generate('hi', 'sad', []))
+        self.assertEqual(self.genai.sent, 3)
+        stats = chatbot.get_gemini_provider().breaker.stats()
+        self.assertEqual((stats['state'], stats['trips'], stats['rejected']), ('open', 1, 1))
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = resilience.CircuitBreaker(
+            'test', window=10, min_calls=4, failure_rate=0.5, reset_timeout=30, clock=lambda: self.now,
+        )
+
+    def test_opens_on_failure_rate_then_half_opens(self):
+        for ok in (True, False, True, False):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record_success() if ok else self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, resilience.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+        self.now = 31
+        self.assertEqual(self.breaker.state, resilience.HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())  # one trial at a time
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, resilience.OPEN)
+
+        self.now = 62
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.stats(), {
+            'state': resilience.CLOSED, 'trips': 2, 'rejected': 2, 'successes': 3, 'failures': 3,
+        })
+
+    def test_budget_releases_caller(self):
+        with self.assertRaises(resilience.BudgetExceeded):
+            resilience.call_with_budget(time.sleep, 0.05, 1)
+
+
+class ProviderRouterTests(FakeMongoTestCase):
+    def test_prefers_the_faster_measured_provider(self):
+        fast, slow = providers.EchoProvider('fast'), providers.EchoProvider('slow')
+        router = providers.ProviderRouter([slow, fast], min_samples=5, explore_every=0)
+        self.assertEqual([p.name for p in router.ranked()], ['slow', 'fast'])  # unmeasured: configured order
+        for _ in range(5):
+            router.windows['slow'].record(0.8, True)
+            router.windows['fast'].record(0.1, True)
+        self.assertEqual([p.name for p in router.ranked()], ['fast', 'slow'])
+        for _ in range(45):  # 90% errors outweigh the latency advantage
+            router.windows['fast'].record(0.1, False)
+        self.assertEqual([p.name for p in router.ranked()], ['slow', 'fast'])
+
+    def test_fails_over_and_records_errors(self):
+        flaky = providers.EchoProvider('flaky', error_rate=1.0)
+        router = providers.ProviderRouter([flaky, providers.EchoProvider('echo')], explore_every=0)
+        self.assertEqual(router.generate('hi', 'calm', []), ('I hear you: hi', 'echo'))
+        stats = router.stats()
+        self.assertEqual((stats['flaky']['calls'], stats['flaky']['error_rate']), (1, 1.0))
+        self.assertEqual(stats['echo']['calls'], 1)
+
+    @override_settings(LLM_PROVIDERS=['echo'])
+    def test_chat_records_the_serving_provider(self):
+        providers.reset_providers()
+        self.addCleanup(providers.reset_providers)
+        request = APIRequestFactory().post('/api/chat/', {'message': 'hi', 'username': 'alice'}, format='json')
+        response = ChatbotView.as_view()(request)
+        self.assertEqual(response.data['provider'], 'echo')
+        self.assertEqual(self.db['chat_messages'].docs[0]['provider'], 'echo')
+
+
+class StreamingChatTests(FakeMongoTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(chat_context, '_conversations', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _stream(self, chunks, provider='gemini'):
+        with mock.patch('api.views.stream_reply', return_value=(provider, chunks)):
+            request = APIRequestFactory().post(
+                '/api/chat/', {'message': 'hi', 'mood': 'calm', 'username': 'alice', 'stream': True}, format='json',
+            )
+            response = ChatbotView.as_view()(request)
+            body = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = []
+        for block in body.split('\n\n')[:-1]:  # every event ends with a blank line
+            event, data = block.split('\n')
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+        return events
+
+    def test_tokens_then_done_with_the_saved_reply(self):
+        events = self._stream(iter(['Hel', 'lo ', 'there']))
+        self.assertEqual(events, [
+            ('token', {'text': 'Hel'}), ('token', {'text': 'lo '}), ('token', {'text': 'there'}),
+            ('done', {'reply': 'Hello there', 'mood': 'calm', 'provider': 'gemini'}),
+        ])
+        saved = self.db['chat_messages'].docs
+        self.assertEqual([(d['user_message'], d['bot_reply'], d['provider']) for d in saved],
+                         [('hi', 'Hello there', 'gemini')])
+        self.assertEqual(chat_context.get_conversation_cache().get('alice')[-1]['bot_reply'], 'Hello there')
+
+    def test_provider_failing_mid_stream_falls_back(self):
+        def chunks():
+            yield 'Hel'
+            raise RuntimeError('connection reset')
+
+        events = self._stream(chunks())
+        self.assertEqual([name for name, _ in events], ['token', 'fallback', 'done'])
+        fallback = events[1][1]['text']
+        self.assertEqual(events[2][1], {'reply': fallback, 'mood': 'calm', 'provider': 'rule-fallback'})
+        self.assertEqual(self.db['chat_messages'].docs[0]['bot_reply'], fallback)
+
+    def test_first_token_wait_is_under_the_latency_budget(self):
+        class Hung(providers.EchoProvider):
+            def _stream(self, user_message, mood, history):
+                time.sleep(1)
+                yield 'too late'
+
+        provider = Hung('hung')
+        provider.timeout = 0.05
+        with self.assertRaises(resilience.BudgetExceeded):
+            list(provider.stream('hi', 'calm', []))
+        self.assertEqual(provider.breaker.stats()['failures'], 1)
+
+
+class ExportTests(FakeMongoTestCase):
+    def _add(self, name, count):
+        start = datetime(2024, 1, 1)
+        self.db[name].docs.extend(
+            {'_id': f'{name}-{i}', 'username': 'alice', 'n': i, 'created_at': start + timedelta(minutes=i)}
+            for i in range(count)
+        )
+
+    def _export(self, collections, fmt='json'):
+        return b''.join(export.stream_export(self.db, 'alice', collections, fmt)).decode('utf-8')
+
+    def test_json_arrays_for_empty_one_and_many(self):
+        self._add('journal_entries', 1)
+        self._add('mood_entries', 3)
+        body = self._export(['chat_messages', 'journal_entries', 'mood_entries'])
+        self.assertTrue(body.startswith('{"username":"alice","chat_messages":[],"journal_entries":[{'))
+        data = json.loads(body)
+        self.assertEqual(list(data), ['username', 'chat_messages', 'journal_entries', 'mood_entries'])
+        self.assertEqual(data['chat_messages'], [])
+        self.assertEqual([d['_id'] for d in data['journal_entries']], ['journal_entries-0'])
+        self.assertEqual([d['n'] for d in data['mood_entries']], [0, 1, 2])
+
+    def test_ndjson_is_one_tagged_document_per_line(self):
+        self._add('mood_entries', 2)
+        self._add('chat_messages', 1)
+        lines = self._export(['mood_entries', 'journal_entries', 'chat_messages'], fmt='ndjson').split('\n')
+        self.assertEqual(lines[-1], '')
+        self.assertEqual([(d['collection'], d['n']) for d in map(json.loads, lines[:-1])],
+                         [('mood_entries', 0), ('mood_entries', 1), ('chat_messages', 0)])
+
+    def test_buffered_flushes_the_tail_chunk(self):
+        with mock.patch.object(export, 'CHUNK_SIZE', 10):
+            self.assertEqual(list(export._buffered(['abcdef', 'ghijkl', 'mn'])), [b'abcdefghijkl', b'mn'])
+            self.assertEqual(list(export._buffered([])), [])
+
+    def test_view_streams_with_the_output_content_type(self):
+        self._add('mood_entries', 2)
+        for output, content_type in (('json', 'application/json'), ('ndjson', 'application/x-ndjson')):
+            request = APIRequestFactory().get(f'/api/export/?username=alice&output={output}&collections=mood_entries')
+            response = ExportView.as_view()(request)
+            self.assertIsInstance(response, StreamingHttpResponse)
+            self.assertEqual(response['Content-Type'], content_type)
+            self.assertIn(f'echosoul-export.{output}', response['Content-Disposition'])
+            self.assertTrue(b''.join(response.streaming_content))
+
+
+class IdSequencerTests(FakeMongoTestCase):
+    def _counter(self, name):
+        return next(d['sequence_value'] for d in self.db['counters'].docs if d['_id'] == name)
+
+    def test_block_boundaries(self):
+        sequencer = counter.IdSequencer(block_size=3)
+        self.assertEqual([sequencer.next_id('users') for _ in range(3)], [1, 2, 3])
+        self.assertEqual(self.db.count('find_one_and_update'), 1)
+        self.assertEqual(sequencer.next_id('users'), 4)  # first id of the next block
+        self.assertEqual((self.db.count('find_one_and_update'), self._counter('users')), (2, 6))
+        self.assertEqual(sequencer.next_id('mood_entries'), 1)  # blocks are per collection
+
+        # A discarded (or forked-away) block leaves a gap of at most one block
+        sequencer.discard('users')
+        self.assertEqual(sequencer.next_id('users'), 7)
+        with mock.patch('os.getpid', return_value=-1):
+            self.assertEqual(sequencer.next_id('users'), 10)
+
+    def test_concurrent_callers_get_unique_ids(self):
+        block_size, per_thread = 7, 50
+        # Two sequencers stand in for two worker processes sharing the counter
+        sequencers = [counter.IdSequencer(block_size=block_size) for _ in range(2)]
+
+        def take(i):
+            return [sequencers[i % 2].next_id('users') for _ in range(per_thread)]
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            batches = list(pool.map(take, range(8)))
+        ids = [i for batch in batches for i in batch]
+        self.assertEqual(len(set(ids)), len(ids))
+        for batch in batches:
+            self.assertEqual(batch, sorted(batch))  # increasing within a process
+        # Only the unused tail of each sequencer's current block is missing
+        reserved = self._counter('users')
+        self.assertLessEqual(max(ids), reserved)
+        self.assertLess(reserved - len(ids), block_size * len(sequencers))
+        self.assertEqual(reserved % block_size, 0)
+
+
+class EventBatchTests(FakeMongoTestCase):
+    def test_reserve_range_uses_one_round_trip(self):
+        sequencer = counter.IdSequencer(block_size=5)
+        self.assertEqual(sequencer.next_id('journal_entries'), 1)
+        self.assertEqual(sequencer.reserve_range('journal_entries', 10), list(range(2, 12)))
+        self.assertEqual(self.db.count('find_one_and_update'), 2)
+        self.assertEqual(sequencer.next_id('journal_entries'), 12)  # rest of the new block
+        self.assertEqual(self.db.count('find_one_and_update'), 2)
+
+    def test_mixed_batch_is_written_per_collection(self):
+        events = [
+            {'type': 'mood', 'username': 'alice', 'mood': 'happy'},
+            {'type': 'journal', 'username': 'alice', 'content': '  dear diary  '},
+            {'type': 'journal', 'username': 'alice', 'content': ''},
+            {'type': 'activity', 'username': 'alice', 'activity_key': 'breathing',
+             'created_at': '2024-05-01T08:30:00+02:00'},
+            {'type': 'journal', 'username': 'alice', 'content': 'second'},
+            {'type': 'sleep', 'username': 'alice'},
+        ]
+        request = APIRequestFactory().post('/api/events/batch/', {'events': events}, format='json')
+        response = EventBatchView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in response.data['results']],
+                         ['created', 'created', 'invalid', 'created', 'created', 'invalid'])
+        self.assertEqual((response.data['created'], response.data['failed']), (4, 2))
+        self.assertEqual(self.db.count('insert_many'), 3)
+        self.assertEqual(self.db.count('find_one_and_update'), 3)
+        journal = self.db['journal_entries'].docs
+        self.assertEqual([d['content'] for d in journal], ['dear diary', 'second'])
+        self.assertEqual(self.db['activity_usages'].docs[0]['created_at'], datetime(2024, 5, 1, 6, 30))
+
+    @override_settings(SESSION_TOKEN_KEYS=['current-key'])
+    def test_session_user_is_resolved_once_per_batch(self):
+        self.db['users'].docs.append({'_id': 1, 'username': 'alice'})
+        token, _ = tokens.issue_token(1, 'alice-before-rename')  # stale hint: the cache can't help
+        events = [{'type': 'mood', 'mood': 'calm'} for _ in range(5)] + [{'type': 'mood', 'username': 'alice', 'mood': 'ok'}]
+        request = APIRequestFactory().post('/api/events/batch/', {'events': events}, format='json',
+                                           HTTP_AUTHORIZATION=f'Bearer {token}')
+        response = EventBatchView.as_view()(request)
+        self.assertEqual(response.data['created'], 6)
+        self.assertEqual(self.db.commands.count(('users', 'find_one')), 1)
+        self.assertEqual({d['username'] for d in self.db['mood_entries'].docs}, {'alice'})
+
+        events.append({'type': 'mood', 'username': 'bob', 'mood': 'sad'})
+        request = APIRequestFactory().post('/api/events/batch/', {'events': events}, format='json',
+                                           HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(EventBatchView.as_view()(request).status_code, 403)
+
+    def test_rejects_oversized_batches(self):
+        with override_settings(EVENTS_BATCH_MAX=2):
+            request = APIRequestFactory().post('/api/events/batch/', {'events': [{}] * 3}, format='json')
+            self.assertEqual(EventBatchView.as_view()(request).status_code, 400)
+
+
+class WriteBehindTests(FakeMongoTestCase):
+    def _buffer(self, **kwargs):
+        buffer = write_behind.WriteBehindBuffer('activity_usages', **kwargs)
+        self.addCleanup(buffer.close)
+        return buffer
+
+    def test_queued_documents_are_flushed_in_batches(self):
+        buffer = self._buffer(batch_size=100, flush_seconds=0.05)
+        for i in range(10):
+            self.assertTrue(buffer.submit({'_id': i, 'username': 'alice'}))
+        buffer.flush()
+        self.assertEqual(len(self.db['activity_usages'].docs), 10)
+        self.assertEqual(self.db.count('insert_one'), 0)
+        self.assertEqual(buffer.stats()['written'], 10)
+        self.assertLess(buffer.stats()['batches'], 10)
+
+    def test_counters_add_up_under_concurrent_submits(self):
+        buffer = self._buffer(batch_size=50, flush_seconds=0.01, max_queued=20, block_seconds=0)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda i: buffer.submit({'_id': i, 'username': 'alice'}), range(400)))
+        buffer.flush()
+        stats = buffer.stats()
+        self.assertEqual(stats['enqueued'] + stats['rejected'], 400)
+        self.assertEqual(stats['written'], stats['enqueued'])
+
+    @override_settings(ACTIVITY_WRITE_BEHIND=True)
+    def test_full_queue_falls_back_to_synchronous_insert(self):
+        gate = threading.Event()
+        collection = self.db['activity_usages']
+        insert_many = collection.insert_many
+        collection.insert_many = lambda docs, ordered=True: (gate.wait(5), insert_many(docs, ordered))
+        buffer = self._buffer(batch_size=1, flush_seconds=0.01, max_queued=1, block_seconds=0.01)
+        patcher = mock.patch.object(write_behind, '_activity_buffer', buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        model = get_model(ActivityUsage)
+        for _ in range(5):
+            self.assertIsNotNone(model.create_entry('alice', 'breathing_exercise'))
+        gate.set()
+        buffer.flush()
+        self.assertEqual(len(collection.docs), 5)
+        self.assertGreater(buffer.stats()['rejected'], 0)
+        self.assertEqual(self.db.count('insert_one'), buffer.stats()['rejected'])
+
+
+class MoodStatsTests(FakeMongoTestCase):
+    now = datetime(2024, 5, 15, 18, 0)
+
+    def _entries(self, *spec):
+        return [
+            {'username': 'alice', 'mood': mood, 'mood_description': mood, 'created_at': datetime(2024, 5, day, 9)}
+            for day, mood in spec
+        ]
+
+    def test_create_entry_increments_the_daily_rollup(self):
+        model = get_model(MoodEntry)
+        model.create_entry('alice', 'feeling great', mood='Happy')
+        model.create_entry('alice', 'meh', mood='sad')
+        rollups = self.db[mood_stats.ROLLUP_COLLECTION].docs
+        self.assertEqual(len(rollups), 1)
+        self.assertEqual((rollups[0]['total'], rollups[0]['moods']), (2, {'happy': 1, 'sad': 1}))
+
+    def test_stats_and_streaks_come_from_rollups(self):
+        mood_stats.record_entries(self.db, self._entries(
+            (1, 'calm'), (2, 'calm'), (3, 'sad'), (13, 'happy'), (14, 'happy'), (14, 'sad'), (15, 'calm'),
+        ))
+        stats = mood_stats.mood_stats(self.db, 'alice', days=7, now=self.now)
+        self.assertEqual((stats['from'], stats['to'], stats['total']), ('2024-05-09', '2024-05-15', 4))
+        self.assertEqual(stats['moods'], {'happy': 2, 'sad': 1, 'calm': 1})
+        self.assertEqual([b['total'] for b in stats['series']], [0, 0, 0, 0, 1, 2, 1])
+        self.assertEqual(stats['streaks'], {'current': 3, 'longest': 3, 'last_entry_day': '2024-05-15'})
+        self.assertEqual(self.db.count('find'), 2)
+
+        weekly = mood_stats.mood_stats(self.db, 'alice', days=15, period='week', now=self.now)
+        self.assertEqual([(b['period'], b['total']) for b in weekly['series']],
+                         [('2024-W18', 3), ('2024-W19', 0), ('2024-W20', 4)])
+
+    def test_rebuild_matches_incremental_rollups(self):
+        entries = self._entries((1, 'calm'), (1, 'Calm'), (2, 'sad'))
+        mood_stats.record_entries(self.db, entries)
+        expected = sorted((d['day'], d['total'], d['moods']) for d in self.db[mood_stats.ROLLUP_COLLECTION].docs)
+        self.db[mood_stats.ROLLUP_COLLECTION].docs.append(
+            {'_id': ObjectId(), 'username': 'alice', 'day': datetime(2024, 4, 1), 'total': 5, 'moods': {'sad': 5}})
+        self.db['mood_entries'].docs.extend(entries)
+
+        self.assertEqual(mood_stats.rebuild_rollups(self.db), (3, 2, 1))
+        rebuilt = sorted((d['day'], d['total'], d['moods']) for d in self.db[mood_stats.ROLLUP_COLLECTION].docs)
+        self.assertEqual(rebuilt, expected)
+
+
+class ActivityAnalyticsTests(SimpleTestCase):
+    def _index_keys(self, collection_name, unique=None):
+        return [
+            [field for field, _ in index.document['key'].items()]
+            for index in INDEX_PLAN[collection_name]
+            if unique is None or index.document.get('unique', False) == unique
+        ]
+
+    def test_user_pipeline_starts_on_the_per_user_index(self):
+        start, end = datetime(2024, 5, 1), datetime(2024, 5, 31)
+        match = activity_analytics.user_pipeline('alice', start, end, 'Europe/Paris')[0]['$match']
+        self.assertEqual(match, {'username': 'alice', 'created_at': {'$gte': start, '$lt': end}})
+        self.assertIn(['username', 'created_at', '_id'], self._index_keys('activity_usages'))
+
+    def test_merge_target_has_a_unique_key_index(self):
+        merge = activity_analytics.daily_stats_pipeline(datetime(2024, 5, 1, 13))[-1]['$merge']
+        self.assertIn(merge['on'], self._index_keys(merge['into'], unique=True))
+        match = activity_analytics.daily_stats_pipeline(datetime(2024, 5, 1, 13))[0]['$match']
+        self.assertEqual(match['created_at'], {'$gte': datetime(2024, 5, 1)})
+
+    def test_facets_become_histograms(self):
+        result = activity_analytics.shape_user_result({
+            'by_activity': [{'_id': 'breathing', 'count': 4, 'total_duration_sec': 240.0,
+                             'first_at': datetime(2024, 5, 1), 'last_at': datetime(2024, 5, 9)}],
+            'by_hour': [{'_id': {'activity_key': 'breathing', 'hour': 7}, 'count': 3},
+                        {'_id': {'activity_key': 'breathing', 'hour': 22}, 'count': 1}],
+            'by_weekday': [{'_id': {'activity_key': 'breathing', 'weekday': 1}, 'count': 4}],
+        })
+        self.assertEqual(result['activities'][0]['avg_duration_sec'], 60.0)
+        self.assertEqual((result['by_hour']['breathing'][7], result['by_hour']['breathing'][22]), (3, 1))
+        self.assertEqual(result['by_weekday']['breathing'], [4, 0, 0, 0, 0, 0, 0])
+
+    def test_rejects_unknown_time_zone(self):
+        request = APIRequestFactory().get('/api/activity-usage/analytics/?username=alice&tz=Mars/Olympus')
+        self.assertEqual(ActivityAnalyticsView.as_view()(request).status_code, 400)
+
+
+class ConversationCacheTests(FakeMongoTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(chat_context, '_conversations', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('api.views.generate_reply', side_effect=self._reply)
+        self.generate = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.factory = APIRequestFactory()
+
+    def _reply(self, message, mood, history):
+        return f'reply to {message}', 'stub'
+
+    def _chat(self, message):
+        request = self.factory.post('/api/chat/', {'message': message, 'mood': 'calm', 'username': 'alice'}, format='json')
+        return ChatbotView.as_view()(request)
+
+    def test_steady_state_chat_does_no_history_reads(self):
+        for message in ['one', 'two', 'three']:
+            self.assertEqual(self._chat(message).status_code, 200)
+        self.assertEqual(self.db.count('find'), 1)
+        self.assertEqual(self.db.count('insert_one'), 3)
+        # The write-through window carries the earlier exchanges into the prompt
+        history = self.generate.call_args[0][2]
+        self.assertEqual([turn['content'] for turn in history],
+                         ['one', 'reply to one', 'two', 'reply to two'])
+
+    def test_clearing_history_invalidates_the_window(self):
+        self._chat('one')
+        request = self.factory.delete('/api/chat/history/?username=alice')
+        self.assertEqual(ChatHistoryView.as_view()(request).status_code, 200)
+        self._chat('two')
+        self.assertEqual(self.db.count('find'), 2)
+        self.assertEqual(self.generate.call_args[0][2], [])
+
+
+class ChatHistoryTests(FakeMongoTestCase):
+    def setUp(self):
+        super().setUp()
+        start = datetime(2024, 1, 1)
+        self.db['chat_messages'].docs = [
+            {'_id': ObjectId(), 'username': 'alice', 'message': f'm{i}', 'created_at': start + timedelta(minutes=i)}
+            for i in range(5)
+        ]
+
+    def _get(self, query):
+        request = APIRequestFactory().get(f'/api/chat/history/?username=alice&{query}')
+        response = ChatHistoryView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_default_page_is_the_latest_in_chronological_order(self):
+        data = self._get('limit=2')
+        self.assertEqual([m['message'] for m in data['messages']], ['m3', 'm4'])
+        self.assertIsNotNone(data['next'])
+
+    def test_explicit_order_pages_from_the_oldest(self):
+        data = self._get('limit=2&order=asc')
+        self.assertEqual([m['message'] for m in data['messages']], ['m0', 'm1'])
+
+    def test_async_view_pages_the_same_way(self):
+        request = APIRequestFactory().get('/api/async/chat/history/?username=alice&limit=2')
+        with mock.patch('api.async_views.AsyncMongoDB.get_db', return_value=self.db):
+            response = asyncio.run(AsyncChatHistoryView.as_view()(request))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m['message'] for m in json.loads(response.content)['messages']], ['m3', 'm4'])
+
+
+@override_settings(CHAT_RESPONSE_CACHE_ENABLED=True)
+class ResponseCacheTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(response_cache, '_responses', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        router = mock.Mock()
+        router.generate.return_value = ('cached reply', 'gemini')
+        self.generate = router.generate
+        patcher = mock.patch.object(chatbot, 'get_router', return_value=router)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_repeated_prompt_is_served_from_cache(self):
+        for message in ['Hi!', 'hi', '  HI  ']:
+            self.assertEqual(chatbot.generate_reply(message, 'sad', [])[0], 'cached reply')
+        self.assertEqual(self.generate.call_count, 1)
+        self.assertEqual(response_cache.get_response_cache().stats()['hits'], 2)
+
+    def test_mood_and_recent_history_are_part_of_the_key(self):
+        chatbot.generate_reply('hi', 'sad', [])
+        chatbot.generate_reply('hi', 'happy', [])
+        chatbot.generate_reply('hi', 'sad', [{'role': 'user', 'content': 'my dog is sick'}])
+        self.assertEqual(self.generate.call_count, 3)
+
+    def test_crisis_messages_always_reach_the_provider(self):
+        for _ in range(2):
+            chatbot.generate_reply('I want to kill myself', 'sad', [])
+        self.assertEqual(self.generate.call_count, 2)
+        self.assertEqual(response_cache.get_response_cache().stats()['size'], 0)
+
+    @override_settings(CHAT_RESPONSE_CACHE_ENABLED=False)
+    def test_disabled_by_default(self):
+        chatbot.generate_reply('hi', 'sad', [])
+        chatbot.generate_reply('hi', 'sad', [])
+        self.assertEqual(self.generate.call_count, 2)
@@ -0,0 +1,137 @@
+"""Stateless signed session tokens.
+
+A token is ``<kid>.<payload>.<signature>``:
+
+- payload: base64url-encoded compact JSON claims {sub, usr, iat, exp, auth}.
+  `sub` is the user id and identifies the user. `usr` is the username at
+  issue time, which goes stale after a rename, so it is only used as a
+  lookup hint. `auth` is the time of the password login that started the
+  session.
+- signature: HMAC-SHA256 over ``<kid>.<payload>``.
+
+Checking a token needs no database read, only one HMAC and one JSON decode.
+
+Keys come from SESSION_TOKEN_KEYS, and default to SECRET_KEY. The first key
+signs. Every listed key verifies, and `kid` names the key that was used, so
+a key can be rotated by adding the new one in front and dropping the old one
+once SESSION_TOKEN_TTL has passed.
+
+Tokens expire after SESSION_TOKEN_TTL seconds. Clients trade them for fresh
+ones at /api/token/refresh/ until SESSION_TOKEN_MAX_AGE after the login. That
+refresh always reads the user fresh, so a password change (which sets
+`tokens_valid_after`) ends every older session at its next refresh.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def _setting(name, default):
+    try:
+        from django.conf import settings
+        return getattr(settings, name, default)
+    except Exception:
+        return default
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class Keyring:
+    """HMAC keys derived from the configured secrets, by key id"""
+
+    def __init__(self, secrets):
+        if not secrets:
+            raise ValueError('At least one session token key is required')
+        self.secrets = tuple(secrets)
+        self.macs = {}
+        for secret in self.secrets:
+            key = hashlib.sha256(b'echosoul.session-token:' + secret.encode('utf-8')).digest()
+            kid = hashlib.sha256(key).hexdigest()[:8]
+            self.macs.setdefault(kid, hmac.new(key, digestmod=hashlib.sha256))
+        self.signing_kid = next(iter(self.macs))
+
+    def sign(self, kid, message):
+        mac = self.macs[kid].copy()
+        mac.update(message)
+        return mac.digest()
+
+
+_keyring = None
+_keyring_lock = threading.Lock()
+
+
+def get_keyring():
+    """The keyring for the current settings; rebuilt when the configured keys change"""
+    global _keyring
+    secrets = tuple(_setting('SESSION_TOKEN_KEYS', None) or [_setting('SECRET_KEY', '')])
+    keyring = _keyring
+    if keyring is None or keyring.secrets != secrets:
+        with _keyring_lock:
+            keyring = _keyring = Keyring(secrets)
+    return keyring
+
+
+def issue_token(user_id, username, auth_time=None, now=None):
+    """Return (token, expires_at) for a user; `auth_time` carries over from the login on refresh"""
+    now = int(now if now is not None else time.time())
+    expires_at = now + int(_setting('SESSION_TOKEN_TTL', 3600))
+    claims = {
+        'sub': str(user_id),
+        'usr': username,
+        'iat': now,
+        'exp': expires_at,
+        'auth': int(auth_time if auth_time is not None else now),
+    }
+    keyring = get_keyring()
+    signing_input = f"{keyring.signing_kid}.{_b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))}"
+    signature = keyring.sign(keyring.signing_kid, signing_input.encode('ascii'))
+    return f'{signing_input}.{_b64encode(signature)}', expires_at
+
+
+def verify_token(token, now=None):
+    """Return the claims of a valid token, or raise InvalidToken"""
+    try:
+        kid, payload, signature = token.split('.')
+    except (AttributeError, ValueError):
+        raise InvalidToken('Malformed token')
+    keyring = get_keyring()
+    if kid not in keyring.macs:
+        raise InvalidToken('Unknown signing key')
+    expected = keyring.sign(kid, f'{kid}.{payload}'.encode('ascii', 'replace'))
+    try:
+        valid = hmac.compare_digest(expected, _b64decode(signature))
+        claims = json.loads(_b64decode(payload)) if valid else None
+    except ValueError:
+        raise InvalidToken('Malformed token')
+    if not valid:
+        raise InvalidToken('Bad signature')
+    if not isinstance(claims, dict):
+        raise InvalidToken('Malformed token')
+    if claims.get('exp', 0) <= (now if now is not None else time.time()):
+        raise InvalidToken('Token expired')
+    return claims
+
+
+def can_refresh(claims, user, now=None):
+    """True if a session may be extended for `user` (the current users document)"""
+    now = now if now is not None else time.time()
+    # `sub` is the identity; after a rename the fresh token carries the new username
+    if not user or str(user.get('_id')) != claims.get('sub'):
+        return False
+    if claims.get('auth', 0) + int(_setting('SESSION_TOKEN_MAX_AGE', 30 * 24 * 3600)) <= now:
+        return False
+    # Epoch seconds of the last password change
+    return claims.get('auth', 0) >= user.get('tokens_valid_after', 0)
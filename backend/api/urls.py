@@ -1,14 +1,28 @@
 from django.urls import path
-from .views import SignupView, LoginView, MoodEntryView, ChangePasswordView, ChatbotView, ChatHistoryView, UpdateProfileView, ActivityUsageView, JournalEntryView
+from .async_views import AsyncActivityUsageView, AsyncChatbotView, AsyncChatHistoryView, AsyncJournalEntryView, AsyncMoodEntryView
+from .views import SignupView, LoginView, TokenRefreshView, MoodEntryView, MoodStatsView, ChangePasswordView, ChatbotView, ChatHistoryView, UpdateProfileView, RenameJobView, ActivityUsageView, ActivityAnalyticsView, JournalEntryView, EventBatchView, ExportView, MetricsView
 
 urlpatterns = [
     path('signup/', SignupView.as_view(), name='signup'),
     path('login/', LoginView.as_view(), name='login'),
+    path('token/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
     path('mood/', MoodEntryView.as_view(), name='mood-entry'),
+    path('mood/stats/', MoodStatsView.as_view(), name='mood-stats'),
     path('change-password/', ChangePasswordView.as_view(), name='change-password'),
     path('chat/', ChatbotView.as_view(), name='chatbot'),
     path('chat/history/', ChatHistoryView.as_view(), name='chat-history'),
     path('profile/update/', UpdateProfileView.as_view(), name='update-profile'),
+    path('profile/rename-status/', RenameJobView.as_view(), name='rename-status'),
     path('activity-usage/', ActivityUsageView.as_view(), name='activity-usage'),
+    path('activity-usage/analytics/', ActivityAnalyticsView.as_view(), name='activity-analytics'),
     path('journal/', JournalEntryView.as_view(), name='journal-entry'),
+    path('events/batch/', EventBatchView.as_view(), name='event-batch'),
+    path('export/', ExportView.as_view(), name='export'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    # Async variants for ASGI deployments (see api/async_views.py)
+    path('async/chat/', AsyncChatbotView.as_view(), name='async-chatbot'),
+    path('async/chat/history/', AsyncChatHistoryView.as_view(), name='async-chat-history'),
+    path('async/mood/', AsyncMoodEntryView.as_view(), name='async-mood-entry'),
+    path('async/journal/', AsyncJournalEntryView.as_view(), name='async-journal-entry'),
+    path('async/activity-usage/', AsyncActivityUsageView.as_view(), name='async-activity-usage'),
 ]
\ No newline at end of file
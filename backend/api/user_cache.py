@@ -0,0 +1,80 @@
+"""Per-process cache of user records, keyed by username and by email.
+
+`User.find_by_identifier` reads through it, and session tokens find their
+user in it (see api/authentication.py). Misses are not cached, so a new
+signup is found at once. Writes to a user (profile update, password change,
+rehash on login) invalidate both keys of the old and new record.
+
+Entries live for USER_CACHE_TTL seconds (0 disables the cache). Other worker
+processes can serve a record up to that old after a write. So nothing that
+grants access trusts a cached record. Login refuses a wrong password from
+the cache, but confirms a correct one against a fresh read. Write paths
+also read the record fresh from MongoDB.
+"""
+import threading
+
+from .cache import TTLCache
+
+
+def _setting(name, default):
+    try:
+        from django.conf import settings
+        return getattr(settings, name, default)
+    except Exception:
+        return default
+
+
+class UserCache:
+    def __init__(self, maxsize=10000, ttl=60):
+        self.enabled = ttl > 0
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, identifier):
+        """Cached record whose username (preferred) or email is `identifier`, or None"""
+        if not self.enabled or not identifier:
+            return None
+        user = self._local.get(f'username:{identifier}') or self._local.get(f'email:{identifier}')
+        return dict(user) if user is not None else None
+
+    def set(self, user):
+        if not self.enabled:
+            return
+        user = dict(user)
+        if user.get('username'):
+            self._local.set(f"username:{user['username']}", user)
+        if user.get('email'):
+            self._local.set(f"email:{user['email']}", user)
+
+    def invalidate(self, *users):
+        """Drop records (dicts) or bare usernames/emails from the cache"""
+        for user in users:
+            if not user:
+                continue
+            if isinstance(user, dict):
+                keys = [f"username:{user.get('username')}", f"email:{user.get('email')}"]
+            else:
+                keys = [f'username:{user}', f'email:{user}']
+            for key in keys:
+                self._local.delete(key)
+
+    def clear(self):
+        self._local.clear()
+
+    def stats(self):
+        return dict(self._local.stats(), enabled=self.enabled)
+
+
+_users = None
+_users_lock = threading.Lock()
+
+
+def get_user_cache():
+    global _users
+    if _users is None:
+        with _users_lock:
+            if _users is None:
+                _users = UserCache(
+                    maxsize=int(_setting('USER_CACHE_SIZE', 10000)),
+                    ttl=float(_setting('USER_CACHE_TTL', 60)),
+                )
+    return _users
@@ -1,41 +1,162 @@
+"""Password hashing.
+
+Stored hashes are self-describing: ``$<scheme>$<params>$<salt>$<hash>``
+with base64 salt and hash, e.g.::
+
+    $scrypt$n=16384,r=8,p=1$<salt>$<hash>
+    $pbkdf2-sha256$i=310000$<salt>$<hash>
+
+PASSWORD_HASH_SCHEME ('scrypt' or 'pbkdf2-sha256') and its parameters pick
+the format for new hashes. Any stored format can still be verified,
+including the legacy 64-hex-salt + PBKDF2-SHA512 hex strings.
+`needs_rehash` reports hashes made with other settings, so login can
+upgrade them transparently.
+
+Hashing is CPU-bound. Views call it through `run_hasher`, which runs it in a
+bounded thread pool. hashlib releases the GIL while hashing, so at most
+PASSWORD_HASH_WORKERS cores are spent on it, and other requests keep running
+during a burst of logins. When more than PASSWORD_HASH_MAX_PENDING calls are
+already waiting, `run_hasher` raises HasherBusy instead of queueing.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import binascii
 import hashlib
+import hmac
 import os
-import binascii
+import threading
+
+LEGACY_ITERATIONS = 100000
+SCHEMES = ('scrypt', 'pbkdf2-sha256')
+
+
+def _setting(name, default):
+    try:
+        from django.conf import settings
+        return getattr(settings, name, default)
+    except Exception:
+        return default
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _unb64(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def current_params():
+    """(scheme, params) used for new hashes"""
+    scheme = _setting('PASSWORD_HASH_SCHEME', 'scrypt')
+    if scheme == 'scrypt' and not hasattr(hashlib, 'scrypt'):
+        scheme = 'pbkdf2-sha256'  # Python built without OpenSSL scrypt
+    if scheme == 'scrypt':
+        return scheme, {
+            'n': int(_setting('PASSWORD_SCRYPT_N', 2 ** 14)),
+            'r': int(_setting('PASSWORD_SCRYPT_R', 8)),
+            'p': int(_setting('PASSWORD_SCRYPT_P', 1)),
+        }
+    if scheme == 'pbkdf2-sha256':
+        return scheme, {'i': int(_setting('PASSWORD_PBKDF2_ITERATIONS', 310000))}
+    raise ValueError(f"PASSWORD_HASH_SCHEME must be one of {', '.join(SCHEMES)}")
+
+
+def _derive(scheme, params, password, salt):
+    secret = password.encode('utf-8')
+    if scheme == 'scrypt':
+        n, r, p = params['n'], params['r'], params['p']
+        return hashlib.scrypt(secret, salt=salt, n=n, r=r, p=p, dklen=32, maxmem=256 * n * r * p + 2 ** 20)
+    if scheme == 'pbkdf2-sha256':
+        return hashlib.pbkdf2_hmac('sha256', secret, salt, params['i'])
+    raise ValueError(f'Unknown password hash scheme: {scheme}')
+
+
+def _parse(stored_password):
+    """Return (scheme, params, salt, hash) for a stored hash"""
+    if not stored_password.startswith('$'):
+        # Legacy: 64 hex chars of salt (used as ASCII bytes) + hex PBKDF2-SHA512
+        return 'legacy', {}, stored_password[:64].encode('ascii'), binascii.unhexlify(stored_password[64:])
+    _, scheme, params, salt, digest = stored_password.split('$')
+    parsed = {key: int(value) for key, value in (item.split('=') for item in params.split(','))}
+    return scheme, parsed, _unb64(salt), _unb64(digest)
+
 
 def hash_password(password):
-    """
-    Hash a password for storing.
-    Uses PBKDF2 with a random salt.
-    """
-    # Generate a random salt
-    salt = hashlib.sha256(os.urandom(60)).hexdigest().encode('ascii')
-    # Hash the password with the salt
-    pwdhash = hashlib.pbkdf2_hmac('sha512', password.encode('utf-8'), 
-                                salt, 100000)
-    pwdhash = binascii.hexlify(pwdhash)
-    # Return the salt and hash concatenated
-    return (salt + pwdhash).decode('ascii')
+    """Hash a password for storing, with the configured scheme and a random salt."""
+    scheme, params = current_params()
+    salt = os.urandom(16)
+    digest = _derive(scheme, params, password, salt)
+    encoded = ','.join(f'{key}={value}' for key, value in params.items())
+    return f'${scheme}${encoded}${_b64(salt)}${_b64(digest)}'
+
 
 def verify_password(stored_password, provided_password):
-    """
-    Verify a stored password against one provided by user
-    """
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    salt = stored_password[:64]
-    stored_hash = stored_password[64:]
-    
-    logger.info(f"Salt length: {len(salt)}")
-    logger.info(f"Stored hash length: {len(stored_hash)}")
-    
-    pwdhash = hashlib.pbkdf2_hmac('sha512', 
-                                  provided_password.encode('utf-8'), 
-                                  salt.encode('ascii'), 
-                                  100000)
-    pwdhash = binascii.hexlify(pwdhash).decode('ascii')
-    
-    logger.info(f"Generated hash length: {len(pwdhash)}")
-    logger.info(f"Hash match: {pwdhash == stored_hash}")
-    
-    return pwdhash == stored_hash
\ No newline at end of file
+    """Verify a stored password (any supported format) against one provided by user."""
+    try:
+        scheme, params, salt, expected = _parse(stored_password)
+    except (ValueError, binascii.Error):
+        return False
+    if scheme == 'legacy':
+        digest = hashlib.pbkdf2_hmac('sha512', provided_password.encode('utf-8'), salt, LEGACY_ITERATIONS)
+    else:
+        digest = _derive(scheme, params, provided_password, salt)
+    return hmac.compare_digest(digest, expected)
+
+
+def needs_rehash(stored_password):
+    """True if the hash was not made with the current scheme and parameters."""
+    try:
+        scheme, params, _, _ = _parse(stored_password)
+    except (ValueError, binascii.Error):
+        return True
+    return (scheme, params) != current_params()
+
+
+class HasherBusy(Exception):
+    pass
+
+
+_pool = None
+_slots = None
+_pool_lock = threading.Lock()
+_counts = {'workers': 0, 'capacity': 0, 'in_flight': 0, 'completed': 0, 'rejected': 0}
+_counts_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool, _slots
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                workers = int(_setting('PASSWORD_HASH_WORKERS', 0)) or os.cpu_count() or 2
+                capacity = workers + int(_setting('PASSWORD_HASH_MAX_PENDING', 64))
+                with _counts_lock:
+                    _counts.update(workers=workers, capacity=capacity)
+                _slots = threading.BoundedSemaphore(capacity)
+                _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+    return _pool, _slots
+
+
+def run_hasher(fn, *args):
+    """Run hash_password/verify_password in the bounded hashing pool and wait for the result."""
+    pool, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        with _counts_lock:
+            _counts['rejected'] += 1
+        raise HasherBusy('Too many password checks in progress')
+    with _counts_lock:
+        _counts['in_flight'] += 1
+    try:
+        return pool.submit(fn, *args).result()
+    finally:
+        with _counts_lock:
+            _counts['in_flight'] -= 1
+            _counts['completed'] += 1
+        slots.release()
+
+
+def hasher_stats():
+    _get_pool()
+    with _counts_lock:
+        return dict(_counts)
@@ -1,38 +1,86 @@
 from datetime import datetime
 import json
 import logging
+import time
 
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from bson import ObjectId
+from pymongo import DESCENDING, ReturnDocument
 from rest_framework.permissions import AllowAny
 import os
 
 from backend.mongo import MongoDB
-from .chatbot import generate_gemini_response
-from .models import User, ActivityUsage, JournalEntry
-from .utils import hash_password, verify_password
+from .activity_analytics import (
+    InvalidAnalyticsQuery, dashboard_activity_stats, parse_analytics_params, user_activity_analytics,
+)
+from .authentication import OptionalSessionTokenAuthentication, resolve_username, token_user, tokens_required
+from .bson_json import RAW_CODEC_OPTIONS
+from .chat_context import get_conversation_cache, load_recent_exchanges
+from .chatbot import generate_reply, history_to_messages, rule_based_reply, stream_reply
+from .events import ingest_events, max_events
+from .export import EXPORT_COLLECTIONS, stream_export
+from .models import User, MoodEntry, ActivityUsage, JournalEntry, get_model
+from .mood_stats import InvalidStatsQuery, mood_stats, parse_stats_params
+from .pagination import InvalidCursor, paginate, parse_order, parse_page_size
+from .projection import InvalidFields, projection_from_params
+from .providers import get_router
+from .rename_jobs import (
+    JOBS_COLLECTION as RENAME_JOBS_COLLECTION, create_job as create_rename_job, describe as describe_rename_job,
+    is_reserved as is_username_reserved, submit as submit_rename_job,
+)
+from .tokens import can_refresh, issue_token
+from .response_cache import get_response_cache
+from .user_cache import get_user_cache
+from .utils import HasherBusy, hash_password, hasher_stats, needs_rehash, run_hasher, verify_password
+from .write_behind import get_activity_buffer
 
 logger = logging.getLogger(__name__)
 print("views.py")
+
+def _is_true(value):
+    return value is True or str(value or '').lower() in ('1', 'true', 'yes')
+
+def _token_claims(request):
+    """Claims of the request's session token, or None for unauthenticated requests"""
+    return request.auth if isinstance(request.auth, dict) else None
+
+def _session_username(claims):
+    """Current username of the session's user (found by the token's `sub`), or None"""
+    user = token_user(claims) if claims else None
+    return user.get('username') if user else None
+
+def _acting_username(request, supplied, optional=False):
+    """Username the request acts on (see api/authentication.py); returns (username, error Response or None)"""
+    username, denied = resolve_username(_token_claims(request), supplied, optional)
+    if denied:
+        return None, Response({'error': denied[0]}, status=denied[1])
+    return username, None
+
+def _sse(event, data):
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 @method_decorator(csrf_exempt, name='dispatch')
 class SignupView(APIView):
     permission_classes = [AllowAny]
+    authentication_classes = [OptionalSessionTokenAuthentication]
 
     def post(self, request):
         try:
             data = request.data
-            user_model = User()
+            user_model = get_model(User)
             
-            # Check if username already exists
-            if user_model.find_by_username(data.get('username')):
+            # Check if username or email already exists
+            username_taken, email_taken = user_model.find_conflicts(data.get('username'), data.get('email'))
+            # A name being renamed away from stays reserved until its documents have moved
+            if username_taken or is_username_reserved(MongoDB.get_db(), data.get('username')):
                 return Response({'error': 'Username already exists'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Check if email already exists
-            if user_model.find_by_email(data.get('email')):
+            if email_taken:
                 return Response({'error': 'Email already exists'}, status=status.HTTP_400_BAD_REQUEST)
             
             # Create new user
@@ -46,7 +94,7 @@ class SignupView(APIView):
             user = user_model.create_user(
                 username=user_data['username'],
                 email=user_data['email'],
-                password_hash=hash_password(data.get('password')),
+                password_hash=run_hasher(hash_password, data.get('password')),
                 phone=user_data.get('phone'),
                 address=user_data.get('address')
             )
@@ -56,10 +104,32 @@ class SignupView(APIView):
             else:
                 return Response({'error': 'Failed to create user'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
                 
+        except HasherBusy:
+            return Response({'error': 'Server busy, try again'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception as e:
             logger.error(f"Error in signup: {e}")
             return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@method_decorator(csrf_exempt, name='dispatch')
+class TokenRefreshView(APIView):
+    permission_classes = [AllowAny]
+    authentication_classes = [OptionalSessionTokenAuthentication]
+
+    def post(self, request):
+        """Trade a valid session token for a fresh one. Reads the user once, to honour password changes and renames."""
+        claims = _token_claims(request)
+        if not claims:
+            return Response({'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
+        try:
+            user_data = get_model(User).find_by_id(claims.get('sub'))
+            if not can_refresh(claims, user_data):
+                return Response({'error': 'Session expired, please log in again'}, status=status.HTTP_401_UNAUTHORIZED)
+            token, expires_at = issue_token(user_data['_id'], user_data['username'], auth_time=claims.get('auth'))
+            return Response({'token': token, 'token_expires_at': expires_at}, status=status.HTTP_200_OK)
+        except Exception as e:
+            logger.error(f"Token refresh error: {e}")
+            return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 @method_decorator(csrf_exempt, name='dispatch')
 class JournalEntryView(APIView):
     permission_classes = [AllowAny]
@@ -68,27 +138,25 @@ class JournalEntryView(APIView):
         return MongoDB.get_db()['journal_entries']
 
     def get(self, request):
-        """Get journal entries for a user. Query params: username, optional limit"""
+        """Get a page of journal entries for a user. Query params: username, optional limit, cursor, order, fields, summary"""
         try:
-            username = request.query_params.get('username')
+            username, denied = _acting_username(request, request.query_params.get('username'))
+            if denied:
+                return denied
             if not username:
                 return Response({'error': 'username is required'}, status=status.HTTP_400_BAD_REQUEST)
-            try:
-                limit = int(request.query_params.get('limit') or 100)
-            except Exception:
-                limit = 100
             col = self.get_collection()
-            cursor = col.find({'username': username}).sort('created_at', -1).limit(limit)
-            items = []
-            for doc in cursor:
-                try:
-                    doc['_id'] = str(doc['_id'])
-                except Exception:
-                    pass
-                if isinstance(doc.get('created_at'), datetime):
-                    doc['created_at'] = doc['created_at'].isoformat()
-                items.append(doc)
-            return Response({'journal_entries': items, 'count': len(items), 'username': username}, status=status.HTTP_200_OK)
+            docs, next_cursor, prev_cursor = paginate(
+                col, {'username': username},
+                cursor=request.query_params.get('cursor'),
+                page_size=parse_page_size(request.query_params.get('limit'), default=100),
+                order=parse_order(request.query_params.get('order'), DESCENDING),
+                codec_options=RAW_CODEC_OPTIONS,
+                projection=projection_from_params('journal_entries', request.query_params),
+            )
+            return Response({'journal_entries': docs, 'count': len(docs), 'username': username, 'next': next_cursor, 'prev': prev_cursor}, status=status.HTTP_200_OK)
+        except (InvalidCursor, InvalidFields) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logger.error(f"Error fetching journal entries: {e}")
             return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -97,13 +165,15 @@ class JournalEntryView(APIView):
         """Create a new journal entry. Body: { username, content, metadata? }"""
         try:
             data = request.data
-            username = data.get('username')
+            username, denied = _acting_username(request, data.get('username'))
+            if denied:
+                return denied
             content = (data.get('content') or '').strip()
             metadata = data.get('metadata') or {}
             if not username or not content:
                 return Response({'error': 'username and content are required'}, status=status.HTTP_400_BAD_REQUEST)
 
-            model = JournalEntry()
+            model = get_model(JournalEntry)
             created = model.create_entry(username=username, content=content, metadata=metadata)
             if created:
                 return Response({'message': 'Journal entry saved', 'id': str(created['_id'])}, status=status.HTTP_201_CREATED)
@@ -117,20 +187,32 @@ class ChatHistoryView(APIView):
     permission_classes = [AllowAny]
 
     def get(self, request):
+        """Get a page of chat messages. Query params: username, optional limit, cursor, order, fields, summary
+
+        Without `order`, returns the latest page in chronological order; `next` then leads to older
+        messages. An explicit order=asc|desc pages through the whole history in that order.
+        """
         try:
-            username = request.query_params.get('username')
+            username, denied = _acting_username(request, request.query_params.get('username'))
+            if denied:
+                return denied
             if not username:
                 return Response({'error': 'username is required'}, status=status.HTTP_400_BAD_REQUEST)
             db = MongoDB.get_db()
             chats = db['chat_messages']
-            cursor = chats.find({'username': username}).sort('created_at', 1)
-            items = []
-            for doc in cursor:
-                doc['_id'] = str(doc['_id'])
-                if isinstance(doc.get('created_at'), datetime):
-                    doc['created_at'] = doc['created_at'].isoformat()
-                items.append(doc)
-            return Response({'username': username, 'count': len(items), 'messages': items}, status=status.HTTP_200_OK)
+            latest = not request.query_params.get('order')
+            docs, next_cursor, prev_cursor = paginate(
+                chats, {'username': username},
+                cursor=request.query_params.get('cursor'),
+                page_size=parse_page_size(request.query_params.get('limit')),
+                order=parse_order(request.query_params.get('order'), DESCENDING),
+                codec_options=RAW_CODEC_OPTIONS,
+                projection=projection_from_params('chat_messages', request.query_params),
+            )
+            items = docs[::-1] if latest else docs
+            return Response({'username': username, 'count': len(items), 'messages': items, 'next': next_cursor, 'prev': prev_cursor}, status=status.HTTP_200_OK)
+        except (InvalidCursor, InvalidFields) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logger.error(f"Chat history error: {e}")
             return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -154,13 +236,16 @@ class ChatHistoryView(APIView):
             if not do_delete:
                 return Response({'error': 'Invalid action'}, status=status.HTTP_400_BAD_REQUEST)
 
-            username = data.get('username') or request.query_params.get('username')
+            username, denied = _acting_username(request, data.get('username') or request.query_params.get('username'))
+            if denied:
+                return denied
             if not username:
                 return Response({'message': 'No username provided; nothing to clear', 'deleted': 0}, status=status.HTTP_200_OK)
 
             db = MongoDB.get_db()
             chats = db['chat_messages']
             res = chats.delete_many({'username': username})
+            get_conversation_cache().invalidate(username)
             return Response({'message': 'Chat history cleared', 'deleted': getattr(res, 'deleted_count', 0)}, status=status.HTTP_200_OK)
         except Exception as e:
             logger.error(f"Chat history post-clear error: {e}")
@@ -188,6 +273,9 @@ class ChatHistoryView(APIView):
                     username = (data or {}).get('username')
                 except Exception:
                     username = None
+            username, denied = _acting_username(request, username)
+            if denied:
+                return denied
             if not username:
                 # Idempotent no-op if username missing
                 return Response({'message': 'No username provided; nothing to clear', 'deleted': 0}, status=status.HTTP_200_OK)
@@ -195,6 +283,7 @@ class ChatHistoryView(APIView):
             db = MongoDB.get_db()
             chats = db['chat_messages']
             res = chats.delete_many({'username': username})
+            get_conversation_cache().invalidate(username)
             return Response({'message': 'Chat history cleared', 'deleted': getattr(res, 'deleted_count', 0)}, status=status.HTTP_200_OK)
         except Exception as e:
             logger.error(f"Chat history delete error: {e}")
@@ -205,77 +294,104 @@ class ChatbotView(APIView):
     permission_classes = [AllowAny]
 
     def post(self, request):
+        """Reply to a chat message. Body: { message, mood, username?, stream? }.
+        With stream=true (or ?stream=1) the reply is sent as Server-Sent Events.
+        """
         try:
             data = request.data
             user_message = (data.get('message') or '').strip()
             mood = (data.get('mood') or 'calm').strip().lower()
-            username = data.get('username')
+            username, denied = _acting_username(request, data.get('username'), optional=True)
+            if denied:
+                return denied
 
             if not user_message:
                 return Response({'error': 'message is required'}, status=status.HTTP_400_BAD_REQUEST)
 
             # Prepare recent conversation context (best-effort)
-            prior_messages = []
-            if username:
-                try:
-                    db = MongoDB.get_db()
-                    chats = db['chat_messages']
-                    # fetch last 6 exchanges (approx 12 turns)
-                    cursor = chats.find({'username': username}).sort('created_at', -1).limit(12)
-                    history = list(cursor)[::-1]  # chronological
-                    for h in history:
-                        um = (h.get('user_message') or '').strip()
-                        br = (h.get('bot_reply') or '').strip()
-                        if um:
-                            prior_messages.append({"role": "user", "content": um})
-                        if br:
-                            prior_messages.append({"role": "assistant", "content": br})
-                except Exception as he:
-                    logger.warning(f"Failed to load prior messages: {he}")
-
-            # Try Google Gemini first (only provider)
+            prior_messages = self._load_prior_messages(username)
+
+            if _is_true(data.get('stream')) or _is_true(request.query_params.get('stream')):
+                response = StreamingHttpResponse(
+                    self._stream_reply(user_message, mood, username, prior_messages),
+                    content_type='text/event-stream',
+                )
+                response['Cache-Control'] = 'no-cache'
+                response['X-Accel-Buffering'] = 'no'  # keep nginx from buffering the stream
+                return response
+
+            # Best available LLM provider (see api/providers.py)
             try:
-                gm_reply = generate_gemini_response(user_message, mood, prior_messages)
+                llm_reply, provider = generate_reply(user_message, mood, prior_messages)
             except Exception as ge:
-                logger.warning(f"Gemini generation failed: {ge}")
-                gm_reply = None
-            if gm_reply:
-                try:
-                    if username:
-                        db = MongoDB.get_db()
-                        chats = db['chat_messages']
-                        chats.insert_one({
-                            'username': username,
-                            'mood': mood,
-                            'user_message': user_message,
-                            'bot_reply': gm_reply,
-                            'provider': 'gemini',
-                            'created_at': datetime.utcnow(),
-                        })
-                except Exception as se:
-                    logger.warning(f"Failed to save chat message (gemini): {se}")
-                return Response({'reply': gm_reply, 'mood': mood, 'provider': 'gemini'}, status=status.HTTP_200_OK)
+                logger.warning(f"LLM generation failed: {ge}")
+                llm_reply, provider = None, None
+            if llm_reply:
+                self._save_exchange(username, mood, user_message, llm_reply, provider)
+                return Response({'reply': llm_reply, 'mood': mood, 'provider': provider}, status=status.HTTP_200_OK)
             # Final fallback: rule-based
             rb_reply = self._rule_based_reply(mood, user_message, username)
-            try:
-                if username:
-                    db = MongoDB.get_db()
-                    chats = db['chat_messages']
-                    chats.insert_one({
-                        'username': username,
-                        'mood': mood,
-                        'user_message': user_message,
-                        'bot_reply': rb_reply,
-                        'provider': 'rule-fallback',
-                        'created_at': datetime.utcnow(),
-                    })
-            except Exception as se:
-                logger.warning(f"Failed to save chat message (rule): {se}")
+            self._save_exchange(username, mood, user_message, rb_reply, 'rule-fallback')
             return Response({'reply': rb_reply, 'mood': mood, 'provider': 'rule-fallback'}, status=status.HTTP_200_OK)
         except Exception as e:
             logger.error(f"Chatbot error: {e}")
             return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def _load_prior_messages(self, username):
+        if not username:
+            return []
+        try:
+            db = MongoDB.get_db()
+            chats = db['chat_messages']
+            # last 12 exchanges, served from the conversation cache once warm
+            history = load_recent_exchanges(chats, username)
+            return history_to_messages(history)
+        except Exception as he:
+            logger.warning(f"Failed to load prior messages: {he}")
+            return []
+
+    def _save_exchange(self, username, mood, user_message, reply, provider):
+        if not username:
+            return
+        try:
+            db = MongoDB.get_db()
+            chats = db['chat_messages']
+            doc = {
+                'username': username,
+                'mood': mood,
+                'user_message': user_message,
+                'bot_reply': reply,
+                'provider': provider,
+                'created_at': datetime.utcnow(),
+            }
+            chats.insert_one(doc)
+            get_conversation_cache().append(username, doc)
+        except Exception as se:
+            logger.warning(f"Failed to save chat message ({provider}): {se}")
+
+    def _stream_reply(self, user_message, mood, username, prior_messages):
+        """Yield SSE events: `token` per provider chunk, `fallback` if the
+        provider fails (the client replaces any partial text with it), then
+        `done` with the assembled reply once it has been saved.
+        """
+        parts = []
+        provider = None
+        try:
+            provider, chunks = stream_reply(user_message, mood, prior_messages)
+            for text in chunks:
+                parts.append(text)
+                yield _sse('token', {'text': text})
+            if not ''.join(parts).strip():
+                raise RuntimeError('empty reply')
+            reply = ''.join(parts).strip()
+        except Exception as ge:
+            logger.warning(f"{provider or 'LLM'} streaming failed after {len(parts)} chunks: {ge}")
+            provider = 'rule-fallback'
+            reply = self._rule_based_reply(mood, user_message, username)
+            yield _sse('fallback', {'text': reply})
+        self._save_exchange(username, mood, user_message, reply, provider)
+        yield _sse('done', {'reply': reply, 'mood': mood, 'provider': provider})
+
     def _style_for_mood(self, mood: str) -> str:
         mapping = {
             'happy': 'Celebrate gently, be upbeat and encouraging. Keep it playful but grounded.',
@@ -288,19 +404,7 @@ class ChatbotView(APIView):
         return mapping.get(mood, mapping['neutral'])
 
     def _rule_based_reply(self, mood: str, message: str, username=None) -> str:
-        name = (username or 'friend')
-        base = message.lower()
-        if mood in ['sad']:
-            return f"Hey {name}, I’m really sorry you’re going through this. It’s okay to feel heavy—try a small kindness for yourself, like a short walk or writing down one supportive thought. I’m here to listen."
-        if mood in ['angry']:
-            return f"I hear how strongly you feel, {name}. Your feelings matter. Would it help to take 3 slow breaths with a 4-6 count, or jot the main trigger down to revisit when calmer? I’m with you."
-        if mood in ['anxious']:
-            return f"Thanks for sharing, {name}. Let’s ground together: name 5 things you see, 4 you can touch, 3 you hear, 2 you smell, 1 you taste. Small steps are okay—you’re not alone."
-        if mood in ['happy']:
-            return f"Love the energy, {name}! What helped you feel this way today? Maybe bookmark it as a ‘go-to boost’ for tougher days. Keep shining!"
-        if mood in ['calm']:
-            return f"That sounds peaceful, {name}. You might anchor this with a short reflection or a few deep breaths to savor the calm. What would you like to explore next?"
-        return f"I’m here with you, {name}. Tell me more about what’s on your mind, and we’ll take it one step at a time."
+        return rule_based_reply(mood, message, username)
 
 @method_decorator(csrf_exempt, name='dispatch')
 class ChangePasswordView(APIView):
@@ -309,30 +413,44 @@ class ChangePasswordView(APIView):
     def post(self, request):
         try:
             data = request.data
-            identifier = data.get('identifier')  # username or email
+            claims = _token_claims(request)
+            identifier = data.get('identifier') or _session_username(claims)  # username or email
             current_password = data.get('current_password')
             new_password = data.get('new_password')
 
             if not identifier or not current_password or not new_password:
                 return Response({'error': 'identifier, current_password and new_password are required'}, status=status.HTTP_400_BAD_REQUEST)
 
-            user_model = User()
-            user_data = user_model.find_by_username(identifier)
-            if not user_data:
-                user_data = user_model.find_by_email(identifier)
+            if not claims and tokens_required():
+                return Response({'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
+
+            user_model = get_model(User)
+            user_data = user_model.find_by_identifier(identifier, cached=False)
             if not user_data:
                 return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+            if claims and claims.get('sub') != str(user_data['_id']):
+                return Response({'error': 'identifier does not match the session token'}, status=status.HTTP_403_FORBIDDEN)
 
             # Verify current password
-            if not verify_password(user_data['password_hash'], current_password):
+            if not run_hasher(verify_password, user_data['password_hash'], current_password):
                 return Response({'error': 'Incorrect current password'}, status=status.HTTP_400_BAD_REQUEST)
 
             # Update to new password hash
             db = MongoDB.get_db()
             users = db['users']
-            users.update_one({'_id': user_data['_id']}, { '$set': { 'password_hash': hash_password(new_password), 'updated_at': datetime.utcnow() } })
-
-            return Response({'message': 'Password updated successfully'}, status=status.HTTP_200_OK)
+            # tokens_valid_after stops sessions from before the change being refreshed
+            changed_at = int(time.time())
+            users.update_one({'_id': user_data['_id']}, { '$set': {
+                'password_hash': run_hasher(hash_password, new_password),
+                'tokens_valid_after': changed_at,
+                'updated_at': datetime.utcnow(),
+            } })
+            get_user_cache().invalidate(user_data)
+
+            token, expires_at = issue_token(user_data['_id'], user_data['username'], now=changed_at)
+            return Response({'message': 'Password updated successfully', 'token': token, 'token_expires_at': expires_at}, status=status.HTTP_200_OK)
+        except HasherBusy:
+            return Response({'error': 'Server busy, try again'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception as e:
             logger.error(f"Error changing password: {e}")
             return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -340,6 +458,7 @@ class ChangePasswordView(APIView):
 @method_decorator(csrf_exempt, name='dispatch')
 class LoginView(APIView):
     permission_classes = [AllowAny]
+    authentication_classes = [OptionalSessionTokenAuthentication]
 
     def post(self, request):
         try:
@@ -356,14 +475,19 @@ class LoginView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            user_model = User()
-            user_data = user_model.find_by_username(username)
-            logger.info(f"Find by username result: {user_data is not None}")
-            
-            # If username not found, try finding by email
-            if not user_data:
-                user_data = user_model.find_by_email(username)
-                logger.info(f"Find by email result: {user_data is not None}")
+            # A wrong password is refused from the user cache without a query. Dropping the entry lets
+            # a retry see a password that was changed on another worker.
+            cache = get_user_cache()
+            cached = cache.get(username)
+            if cached is not None and not run_hasher(verify_password, cached['password_hash'], password):
+                logger.warning(f"Invalid password for user: {username}")
+                cache.invalidate(cached)
+                return Response({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
+
+            # A success is only granted against the stored record: a cached one can predate a
+            # password change on another worker, and its old password must not open a new session
+            user_data = get_model(User).find_by_identifier(username, cached=False)
+            logger.info(f"Find user result: {user_data is not None}")
                 
             if not user_data:
                 logger.warning(f"User not found for login: {username}")
@@ -372,14 +496,29 @@ class LoginView(APIView):
                     status=status.HTTP_401_UNAUTHORIZED
                 )
             
-            # Verify password using our utility function
-            password_valid = verify_password(user_data['password_hash'], password)
+            if cached is not None and cached['password_hash'] == user_data['password_hash']:
+                password_valid = True  # this hash was verified above
+            else:
+                password_valid = run_hasher(verify_password, user_data['password_hash'], password)
             logger.info(f"Password verification result: {password_valid}")
             
             if password_valid:
+                if needs_rehash(user_data['password_hash']):
+                    # Hashed with an older scheme or work factor: upgrade it now that we have the password
+                    try:
+                        MongoDB.get_db()['users'].update_one(
+                            {'_id': user_data['_id'], 'password_hash': user_data['password_hash']},
+                            {'$set': {'password_hash': run_hasher(hash_password, password)}},
+                        )
+                        get_user_cache().invalidate(user_data)
+                    except Exception as e:
+                        logger.warning(f"Password rehash failed for user {username}: {e}")
                 logger.info(f"Login successful for user: {username}")
+                token, expires_at = issue_token(user_data['_id'], user_data['username'])
                 return Response({
                     'message': 'Login successful',
+                    'token': token,
+                    'token_expires_at': expires_at,
                     'user': {
                         'id': str(user_data['_id']),
                         'username': user_data['username'],
@@ -394,6 +533,9 @@ class LoginView(APIView):
                     {'error': 'Invalid credentials'}, 
                     status=status.HTTP_401_UNAUTHORIZED
                 )
+        except HasherBusy:
+            logger.warning("Login rejected: password hashing pool is full")
+            return Response({'error': 'Server busy, try again'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception as e:
             logger.error(f"Error during login: {e}")
             return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -406,23 +548,25 @@ class MoodEntryView(APIView):
         return MongoDB.get_db()['mood_entries']
 
     def get(self, request):
-        """Return mood entries for a given username via query param username"""
+        """Return a page of mood entries for a given username. Query params: username, optional limit, cursor, order, fields, summary"""
         try:
-            username = request.query_params.get('username')
+            username, denied = _acting_username(request, request.query_params.get('username'))
+            if denied:
+                return denied
             if not username:
                 return Response({'error': 'username is required'}, status=status.HTTP_400_BAD_REQUEST)
             col = self.get_mood_collection()
-            cursor = col.find({'username': username}).sort('created_at', -1)
-            items = []
-            for doc in cursor:
-                try:
-                    doc['_id'] = str(doc['_id'])
-                except Exception:
-                    pass
-                if isinstance(doc.get('created_at'), datetime):
-                    doc['created_at'] = doc['created_at'].isoformat()
-                items.append(doc)
-            return Response({'mood_entries': items, 'count': len(items), 'username': username}, status=status.HTTP_200_OK)
+            docs, next_cursor, prev_cursor = paginate(
+                col, {'username': username},
+                cursor=request.query_params.get('cursor'),
+                page_size=parse_page_size(request.query_params.get('limit')),
+                order=parse_order(request.query_params.get('order'), DESCENDING),
+                codec_options=RAW_CODEC_OPTIONS,
+                projection=projection_from_params('mood_entries', request.query_params),
+            )
+            return Response({'mood_entries': docs, 'count': len(docs), 'username': username, 'next': next_cursor, 'prev': prev_cursor}, status=status.HTTP_200_OK)
+        except (InvalidCursor, InvalidFields) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logger.error(f"Error fetching mood entries: {e}")
             return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -430,7 +574,9 @@ class MoodEntryView(APIView):
     def post(self, request):
         try:
             data = request.data
-            username = data.get('username')
+            username, denied = _acting_username(request, data.get('username'))
+            if denied:
+                return denied
             mood = data.get('mood')
             mood_description = data.get('mood_description', mood)
             
@@ -441,11 +587,11 @@ class MoodEntryView(APIView):
                 )
             
             # Use the MoodEntry model to create entry
-            from .models import MoodEntry
-            mood_model = MoodEntry()
+            mood_model = get_model(MoodEntry)
             mood_entry = mood_model.create_entry(
                 username=username,
-                mood_description=mood_description
+                mood_description=mood_description,
+                mood=mood
             )
             
             if mood_entry:
@@ -465,6 +611,27 @@ class MoodEntryView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+@method_decorator(csrf_exempt, name='dispatch')
+class MoodStatsView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        """Mood counts per day, week or month from the daily rollups. Query params: username, optional days (default 30), period=day|week|month"""
+        try:
+            username, denied = _acting_username(request, request.query_params.get('username'))
+            if denied:
+                return denied
+            if not username:
+                return Response({'error': 'username is required'}, status=status.HTTP_400_BAD_REQUEST)
+            period, days = parse_stats_params(request.query_params)
+            stats = mood_stats(MongoDB.get_db(), username, days=days, period=period)
+            return Response(stats, status=status.HTTP_200_OK)
+        except InvalidStatsQuery as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error fetching mood stats: {e}")
+            return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 @method_decorator(csrf_exempt, name='dispatch')
 class ActivityUsageView(APIView):
     permission_classes = [AllowAny]
@@ -473,27 +640,25 @@ class ActivityUsageView(APIView):
         return MongoDB.get_db()['activity_usages']
 
     def get(self, request):
-        """Return activity usage entries for a username. Query params: username, optional limit"""
+        """Return a page of activity usage entries for a username. Query params: username, optional limit, cursor, order, fields, summary"""
         try:
-            username = request.query_params.get('username')
+            username, denied = _acting_username(request, request.query_params.get('username'))
+            if denied:
+                return denied
             if not username:
                 return Response({'error': 'username is required'}, status=status.HTTP_400_BAD_REQUEST)
-            try:
-                limit = int(request.query_params.get('limit') or 100)
-            except Exception:
-                limit = 100
             col = self.get_collection()
-            cursor = col.find({'username': username}).sort('created_at', -1).limit(limit)
-            items = []
-            for doc in cursor:
-                try:
-                    doc['_id'] = str(doc['_id'])
-                except Exception:
-                    pass
-                if isinstance(doc.get('created_at'), datetime):
-                    doc['created_at'] = doc['created_at'].isoformat()
-                items.append(doc)
-            return Response({'activity_usages': items, 'count': len(items), 'username': username}, status=status.HTTP_200_OK)
+            docs, next_cursor, prev_cursor = paginate(
+                col, {'username': username},
+                cursor=request.query_params.get('cursor'),
+                page_size=parse_page_size(request.query_params.get('limit'), default=100),
+                order=parse_order(request.query_params.get('order'), DESCENDING),
+                codec_options=RAW_CODEC_OPTIONS,
+                projection=projection_from_params('activity_usages', request.query_params),
+            )
+            return Response({'activity_usages': docs, 'count': len(docs), 'username': username, 'next': next_cursor, 'prev': prev_cursor}, status=status.HTTP_200_OK)
+        except (InvalidCursor, InvalidFields) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logger.error(f"Error fetching activity usages: {e}")
             return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -502,13 +667,15 @@ class ActivityUsageView(APIView):
         """Create an activity usage entry. Body: { username, activity_key, metadata? }"""
         try:
             data = request.data
-            username = data.get('username')
+            username, denied = _acting_username(request, data.get('username'))
+            if denied:
+                return denied
             activity_key = (data.get('activity_key') or '').strip()
             metadata = data.get('metadata') or {}
             if not username or not activity_key:
                 return Response({'error': 'username and activity_key are required'}, status=status.HTTP_400_BAD_REQUEST)
 
-            usage_model = ActivityUsage()
+            usage_model = get_model(ActivityUsage)
             created = usage_model.create_entry(username=username, activity_key=activity_key, metadata=metadata)
             if created:
                 return Response({'message': 'Activity usage saved', 'id': str(created['_id'])}, status=status.HTTP_201_CREATED)
@@ -517,6 +684,122 @@ class ActivityUsageView(APIView):
             logger.error(f"Error saving activity usage: {e}")
             return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@method_decorator(csrf_exempt, name='dispatch')
+class ActivityAnalyticsView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        """Activity usage analytics. Query params: username (live per-user pipeline) or scope=all (materialized daily stats), optional days, tz"""
+        try:
+            scope = request.query_params.get('scope')
+            username = request.query_params.get('username')
+            if username or scope != 'all':
+                username, denied = _acting_username(request, username)
+                if denied:
+                    return denied
+            if not username and scope != 'all':
+                return Response({'error': 'username or scope=all is required'}, status=status.HTTP_400_BAD_REQUEST)
+            days, tz = parse_analytics_params(request.query_params)
+            db = MongoDB.get_db()
+            if username:
+                data = user_activity_analytics(db, username, days=days, tz=tz)
+            else:
+                data = dashboard_activity_stats(db, days=days)
+            return Response(data, status=status.HTTP_200_OK)
+        except InvalidAnalyticsQuery as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error computing activity analytics: {e}")
+            return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class EventBatchView(APIView):
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        """Ingest a mixed batch of events. Body: { events: [{ type: mood|journal|activity, username, ...fields, created_at? }] }"""
+        try:
+            events = request.data.get('events') if isinstance(request.data, dict) else request.data
+            if not isinstance(events, list) or not events:
+                return Response({'error': 'events must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+            limit = max_events()
+            if len(events) > limit:
+                return Response({'error': f'at most {limit} events per batch'}, status=status.HTTP_400_BAD_REQUEST)
+            # Resolved once per batch: with a token that is at most one users read, however many events
+            acting, denied = _acting_username(request, None)
+            if denied:
+                return denied
+            if acting:
+                for event in events:
+                    if isinstance(event, dict):
+                        if event.get('username') and event['username'] != acting:
+                            return Response({'error': 'username does not match the session token'},
+                                            status=status.HTTP_403_FORBIDDEN)
+                        event['username'] = acting
+
+            results = ingest_events(MongoDB.get_db(), events)
+            created = sum(1 for r in results if r['status'] == 'created')
+            return Response({
+                'results': results,
+                'created': created,
+                'failed': len(results) - created,
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            logger.error(f"Error ingesting event batch: {e}")
+            return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ExportView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        """Stream a user's full history. Query params: username, optional collections (comma separated), output=json|ndjson (not `format`, which DRF reserves for renderer selection)"""
+        try:
+            username, denied = _acting_username(request, request.query_params.get('username'))
+            if denied:
+                return denied
+            if not username:
+                return Response({'error': 'username is required'}, status=status.HTTP_400_BAD_REQUEST)
+            fmt = (request.query_params.get('output') or 'json').lower()
+            if fmt not in ('json', 'ndjson'):
+                return Response({'error': 'output must be json or ndjson'}, status=status.HTTP_400_BAD_REQUEST)
+            requested = request.query_params.get('collections')
+            collections = [c.strip() for c in requested.split(',') if c.strip()] if requested else list(EXPORT_COLLECTIONS)
+            unknown = [c for c in collections if c not in EXPORT_COLLECTIONS]
+            if unknown:
+                return Response({'error': f"Unknown collections: {', '.join(unknown)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+            db = MongoDB.get_db()
+            content_type = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+            response = StreamingHttpResponse(stream_export(db, username, collections, fmt), content_type=content_type)
+            response['Content-Disposition'] = f'attachment; filename="echosoul-export.{fmt}"'
+            return response
+        except Exception as e:
+            logger.error(f"Export error: {e}")
+            return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class MetricsView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        """Process-local runtime metrics for scraping"""
+        try:
+            responses = get_response_cache()
+            activity_buffer = get_activity_buffer()
+            return Response({
+                'mongo_pool': MongoDB.get_pool_stats(),
+                'chat_context_cache': get_conversation_cache().stats(),
+                'chat_response_cache': responses.stats() if responses else None,
+                'llm_providers': get_router().stats(),
+                'activity_write_behind': activity_buffer.stats() if activity_buffer else None,
+                'password_hasher': hasher_stats(),
+                'user_cache': get_user_cache().stats(),
+            }, status=status.HTTP_200_OK)
+        except Exception as e:
+            logger.error(f"Metrics error: {e}")
+            return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 @method_decorator(csrf_exempt, name='dispatch')
 class UpdateProfileView(APIView):
     permission_classes = [AllowAny]
@@ -524,7 +807,8 @@ class UpdateProfileView(APIView):
     def post(self, request):
         try:
             data = request.data
-            identifier = (data.get('identifier') or '').strip()  # current username or email
+            claims = _token_claims(request)
+            identifier = (data.get('identifier') or _session_username(claims) or '').strip()  # current username or email
             new_username = (data.get('username') or '').strip()
             new_email = (data.get('email') or '').strip()
             new_phone = (data.get('phone') or '').strip()
@@ -532,52 +816,62 @@ class UpdateProfileView(APIView):
 
             if not identifier:
                 return Response({'error': 'identifier is required'}, status=status.HTTP_400_BAD_REQUEST)
+            if not claims and tokens_required():
+                return Response({'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
 
-            user_model = User()
-            user_data = user_model.find_by_username(identifier)
-            if not user_data:
-                user_data = user_model.find_by_email(identifier)
+            user_model = get_model(User)
+            user_data = user_model.find_by_identifier(identifier, cached=False)
             if not user_data:
                 return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+            if claims and claims.get('sub') != str(user_data['_id']):
+                return Response({'error': 'identifier does not match the session token'}, status=status.HTTP_403_FORBIDDEN)
 
             db = MongoDB.get_db()
             users = db['users']
 
             updates = {'updated_at': datetime.utcnow()}
             if new_username and new_username != user_data.get('username'):
-                existing = user_model.find_by_username(new_username)
-                if existing and str(existing['_id']) != str(user_data['_id']):
-                    return Response({'error': 'Username already exists'}, status=status.HTTP_400_BAD_REQUEST)
                 updates['username'] = new_username
             if new_email and new_email != user_data.get('email'):
-                existing_email = user_model.find_by_email(new_email)
-                if existing_email and str(existing_email['_id']) != str(user_data['_id']):
-                    return Response({'error': 'Email already exists'}, status=status.HTTP_400_BAD_REQUEST)
                 updates['email'] = new_email
+            username_taken, email_taken = user_model.find_conflicts(
+                updates.get('username'), updates.get('email'), exclude_id=user_data['_id'],
+            )
+            if username_taken or is_username_reserved(db, updates.get('username'), user_id=user_data['_id']):
+                return Response({'error': 'Username already exists'}, status=status.HTTP_400_BAD_REQUEST)
+            if email_taken:
+                return Response({'error': 'Email already exists'}, status=status.HTTP_400_BAD_REQUEST)
             if new_phone:
                 updates['phone'] = new_phone
             if new_address:
                 updates['address'] = new_address
 
+            # Related records follow a rename in the background (see api/rename_jobs.py). The job is
+            # recorded first so a crash right after the rename still leaves it for resume_rename_jobs.
+            old_username = user_data.get('username')
+            rename_job = None
+            if 'username' in updates and old_username:
+                rename_job = create_rename_job(db, user_data['_id'], old_username, updates['username'])
+
+            refreshed = user_data
             if len(updates) > 1:
-                users.update_one({'_id': user_data['_id']}, {'$set': updates})
+                try:
+                    refreshed = users.find_one_and_update(
+                        {'_id': user_data['_id']}, {'$set': updates}, return_document=ReturnDocument.AFTER,
+                    )
+                except Exception:
+                    if rename_job:
+                        db[RENAME_JOBS_COLLECTION].delete_one({'_id': rename_job['_id']})
+                    raise
+                get_user_cache().invalidate(user_data, refreshed)
 
-            old_username = user_data.get('username')
-            final_username = updates.get('username', old_username)
-            if final_username and old_username and final_username != old_username:
+            if rename_job:
+                get_conversation_cache().invalidate(old_username, updates['username'])
                 try:
-                    mood_entries = db['mood_entries']
-                    chat_messages = db['chat_messages']
-                    activity_usages = db['activity_usages']
-                    journal_entries = db['journal_entries']
-                    mood_entries.update_many({'username': old_username}, {'$set': {'username': final_username}})
-                    chat_messages.update_many({'username': old_username}, {'$set': {'username': final_username}})
-                    activity_usages.update_many({'username': old_username}, {'$set': {'username': final_username}})
-                    journal_entries.update_many({'username': old_username}, {'$set': {'username': final_username}})
-                except Exception as me:
-                    logger.warning(f"Failed to migrate related records for username change {old_username}->{final_username}: {me}")
-
-            refreshed = users.find_one({'_id': user_data['_id']})
+                    submit_rename_job(rename_job['_id'])
+                except Exception as je:
+                    logger.warning(f"Failed to start rename job {rename_job['_id']} ({old_username}->{updates['username']}): {je}")
+
             result_user = {
                 'id': str(refreshed['_id']),
                 'username': refreshed.get('username'),
@@ -585,7 +879,38 @@ class UpdateProfileView(APIView):
                 'phone': refreshed.get('phone'),
                 'address': refreshed.get('address'),
             }
-            return Response({'message': 'Profile updated', 'user': result_user}, status=status.HTTP_200_OK)
+            body = {'message': 'Profile updated', 'user': result_user}
+            if rename_job:
+                body['rename_job'] = {'id': str(rename_job['_id']), 'status': 'pending'}
+            if claims:
+                # Tokens name the user; a renamed user needs one for the new username
+                body['token'], body['token_expires_at'] = issue_token(
+                    refreshed['_id'], refreshed.get('username'), auth_time=claims.get('auth'),
+                )
+            return Response(body, status=status.HTTP_200_OK)
         except Exception as e:
             logger.error(f"Update profile error: {e}")
             return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class RenameJobView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        """Status and per-collection progress of a background rename. Query params: id"""
+        # ObjectId(None) would mint a fresh id instead of failing
+        raw_id = request.query_params.get('id')
+        if not raw_id or not ObjectId.is_valid(raw_id):
+            return Response({'error': 'a valid id is required'}, status=status.HTTP_400_BAD_REQUEST)
+        job_id = ObjectId(raw_id)
+        try:
+            job = MongoDB.get_db()[RENAME_JOBS_COLLECTION].find_one({'_id': job_id})
+            if not job:
+                return Response({'error': 'Rename job not found'}, status=status.HTTP_404_NOT_FOUND)
+            claims = _token_claims(request)
+            if claims and claims.get('sub') != str(job['user_id']):
+                return Response({'error': 'Rename job belongs to another user'}, status=status.HTTP_403_FORBIDDEN)
+            return Response(describe_rename_job(job), status=status.HTTP_200_OK)
+        except Exception as e:
+            logger.error(f"Rename job status error: {e}")
+            return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -0,0 +1,203 @@
+"""Write-behind buffer for telemetry-style inserts (activity usage).
+
+With ACTIVITY_WRITE_BEHIND on, ActivityUsage.create_entry assigns the ID and
+queues the document instead of inserting it on the request path. A background
+thread drains the queue in `insert_many` batches once WRITE_BEHIND_BATCH_SIZE
+documents are waiting or WRITE_BEHIND_FLUSH_SECONDS have passed.
+
+The queue is bounded (WRITE_BEHIND_MAX_QUEUED). When it is full, callers
+block for up to WRITE_BEHIND_BLOCK_MS. If it is still full after that,
+submit() returns False and the caller writes synchronously, so events are
+slowed down rather than dropped. The queue is flushed at interpreter exit.
+WRITE_BEHIND_DURABILITY picks the write concern of the flushes: 'w0'
+(fire-and-forget), 'w1' (acknowledged by the primary) or 'journaled'.
+
+Queued events are lost if the process is killed before a flush, and reads
+can miss them for up to one flush interval.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from pymongo.errors import BulkWriteError
+from pymongo.write_concern import WriteConcern
+
+from backend.mongo import MongoDB
+
+logger = logging.getLogger(__name__)
+
+WRITE_CONCERNS = {
+    'w0': WriteConcern(w=0),
+    'w1': WriteConcern(w=1),
+    'journaled': WriteConcern(w=1, j=True),
+}
+DUPLICATE_KEY = 11000
+
+
+def _setting(name, default):
+    try:
+        from django.conf import settings
+        return getattr(settings, name, default)
+    except Exception:
+        return default
+
+
+class WriteBehindBuffer:
+    def __init__(self, collection_name, batch_size=500, flush_seconds=0.5, max_queued=10000,
+                 block_seconds=0.05, durability='w1'):
+        if durability not in WRITE_CONCERNS:
+            raise ValueError(f"durability must be one of {', '.join(WRITE_CONCERNS)}")
+        self.collection_name = collection_name
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.block_seconds = block_seconds
+        self.write_concern = WRITE_CONCERNS[durability]
+        self.durability = durability
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.enqueued = 0
+        self.rejected = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked child: the parent's queue and thread did not come along
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                self._thread = None
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._run, name=f'write-behind-{self.collection_name}', daemon=True,
+                )
+                self._thread.start()
+
+    def submit(self, doc):
+        """Queue a document for insertion; False means the caller must write it itself"""
+        self._ensure_started()
+        try:
+            self._queue.put(doc, timeout=self.block_seconds)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_seconds)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        collection = MongoDB.get_db()[self.collection_name].with_options(write_concern=self.write_concern)
+        for attempt in (1, 2):
+            try:
+                collection.insert_many(batch, ordered=False)
+                with self._lock:
+                    self.written += len(batch)
+                return
+            except BulkWriteError as e:
+                # A retried batch may already be partly written; those _ids are fine
+                errors = [err for err in e.details.get('writeErrors', []) if err.get('code') != DUPLICATE_KEY]
+                with self._lock:
+                    self.written += len(batch) - len(errors)
+                    self.failed += len(errors)
+                if errors:
+                    logger.error(f"Write-behind {self.collection_name}: {len(errors)} of {len(batch)} documents failed")
+                return
+            except Exception as e:
+                if attempt == 2:
+                    with self._lock:
+                        self.failed += len(batch)
+                    logger.error(f"Write-behind {self.collection_name}: dropped {len(batch)} documents: {e}")
+                    return
+                logger.warning(f"Write-behind {self.collection_name} flush failed, retrying: {e}")
+                time.sleep(min(1.0, self.flush_seconds))
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+                with self._lock:
+                    self.batches += 1
+                for _ in batch:
+                    self._queue.task_done()
+            elif self._stop.is_set():
+                return
+
+    def flush(self):
+        """Block until everything queued so far has been written (or has failed)"""
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self, timeout=10.0):
+        """Flush the queue and stop the background thread"""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        self._stop.set()
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.error(f"Write-behind {self.collection_name}: {self._queue.qsize()} documents not flushed at shutdown")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'durability': self.durability,
+                'queued': self._queue.qsize(),
+                'max_queued': self._queue.maxsize,
+                'enqueued': self.enqueued,
+                'rejected': self.rejected,
+                'written': self.written,
+                'failed': self.failed,
+                'batches': self.batches,
+            }
+
+
+_activity_buffer = None
+_activity_buffer_lock = threading.Lock()
+
+
+def get_activity_buffer():
+    """Return the process-wide activity usage buffer, or None when write-behind is off"""
+    global _activity_buffer
+    if not _setting('ACTIVITY_WRITE_BEHIND', False):
+        return None
+    if _activity_buffer is None:
+        with _activity_buffer_lock:
+            if _activity_buffer is None:
+                _activity_buffer = WriteBehindBuffer(
+                    'activity_usages',
+                    batch_size=int(_setting('WRITE_BEHIND_BATCH_SIZE', 500)),
+                    flush_seconds=float(_setting('WRITE_BEHIND_FLUSH_SECONDS', 0.5)),
+                    max_queued=int(_setting('WRITE_BEHIND_MAX_QUEUED', 10000)),
+                    block_seconds=float(_setting('WRITE_BEHIND_BLOCK_MS', 50)) / 1000,
+                    durability=_setting('WRITE_BEHIND_DURABILITY', 'w1'),
+                )
+                atexit.register(_activity_buffer.close)
+    return _activity_buffer
@@ -1,3 +1,3 @@
-from .mongo import MongoDB
+from .mongo import AsyncMongoDB, MongoDB
 
-__all__ = ['MongoDB']
\ No newline at end of file
+__all__ = ['MongoDB', 'AsyncMongoDB']
\ No newline at end of file
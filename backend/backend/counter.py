@@ -1,65 +1,166 @@
 from backend.mongo import MongoDB
+from pymongo import ReturnDocument
 import logging
+import os
+import threading
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_BLOCK_SIZE = 1000
+
+
+def _block_size_from_settings():
+    try:
+        from django.conf import settings
+        return int(getattr(settings, 'ID_BLOCK_SIZE', DEFAULT_BLOCK_SIZE))
+    except Exception:
+        return int(os.getenv('ID_BLOCK_SIZE', DEFAULT_BLOCK_SIZE))
+
+
+class IdSequencer:
+    """Hands out sequential IDs from ranges reserved in the counters collection.
+
+    Each reservation is a single ``$inc`` of ``block_size`` on the collection's
+    counter document; IDs inside the range are then served from memory under a
+    lock. IDs are strictly increasing within a process. Across processes they
+    stay unique but interleave by block, and IDs left in a block when a process
+    exits are never used.
+    """
+
+    def __init__(self, block_size=None):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._blocks = {}  # collection_name -> [next_id, last_id]
+        self._pid = os.getpid()
+
+    def _get_block_size(self):
+        if self.block_size is None:
+            self.block_size = max(1, _block_size_from_settings())
+        return self.block_size
+
+    def _reserve(self, collection_name, count):
+        """Reserve ``count`` IDs and return the last one (a single round-trip)."""
+        counters_collection = MongoDB.get_db()['counters']
+        result = counters_collection.find_one_and_update(
+            {'_id': collection_name},
+            {'$inc': {'sequence_value': count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return result['sequence_value']
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # Forked child: the parent's blocks are shared with it, drop them.
+            self._blocks.clear()
+            self._pid = os.getpid()
+
+    def next_id(self, collection_name):
+        """Return the next ID for a collection, reserving a new block if needed"""
+        with self._lock:
+            self._check_pid()
+            block = self._blocks.get(collection_name)
+            if block is None or block[0] > block[1]:
+                size = self._get_block_size()
+                last_id = self._reserve(collection_name, size)
+                block = [last_id - size + 1, last_id]
+                self._blocks[collection_name] = block
+            next_id = block[0]
+            block[0] += 1
+            return next_id
+
+    def reserve_range(self, collection_name, count):
+        """Return ``count`` IDs for a collection with at most one round-trip.
+
+        IDs left in the current block are used first; any shortfall is
+        reserved together with a fresh block in a single ``$inc``.
+        """
+        if count <= 0:
+            return []
+        with self._lock:
+            self._check_pid()
+            block = self._blocks.get(collection_name)
+            ids = []
+            if block is not None and block[0] <= block[1]:
+                take = min(count, block[1] - block[0] + 1)
+                ids.extend(range(block[0], block[0] + take))
+                block[0] += take
+            shortfall = count - len(ids)
+            if shortfall:
+                size = shortfall + self._get_block_size()
+                last_id = self._reserve(collection_name, size)
+                first_id = last_id - size + 1
+                ids.extend(range(first_id, first_id + shortfall))
+                self._blocks[collection_name] = [first_id + shortfall, last_id]
+            return ids
+
+    def discard(self, collection_name=None):
+        """Forget locally reserved IDs for one collection (or all of them)"""
+        with self._lock:
+            if collection_name is None:
+                self._blocks.clear()
+            else:
+                self._blocks.pop(collection_name, None)
+
+
+sequencer = IdSequencer()
+
+
 class Counter:
     """Manages sequential ID counters for collections"""
-    
+
     @staticmethod
     def get_next_id(collection_name):
         """Get the next sequential ID for a collection"""
         try:
-            db = MongoDB.get_db()
-            counters_collection = db['counters']
-            
-            # Find and update the counter, or create if it doesn't exist
-            result = counters_collection.find_one_and_update(
-                {'_id': collection_name},
-                {'$inc': {'sequence_value': 1}},
-                upsert=True,
-                return_document=True
-            )
-            
-            # If this is the first time, initialize to 1
-            if result['sequence_value'] == 1:
-                return 1
-            
-            return result['sequence_value']
-            
+            return sequencer.next_id(collection_name)
         except Exception as e:
             logger.error(f"Error getting next ID for {collection_name}: {e}")
             raise
-    
+
+    @staticmethod
+    def get_next_ids(collection_name, count):
+        """Get ``count`` sequential IDs for a collection in one step"""
+        try:
+            return sequencer.reserve_range(collection_name, count)
+        except Exception as e:
+            logger.error(f"Error getting {count} IDs for {collection_name}: {e}")
+            raise
+
     @staticmethod
     def reset_counter(collection_name, start_value=0):
         """Reset counter for a collection to start_value"""
         try:
             db = MongoDB.get_db()
             counters_collection = db['counters']
-            
+
             counters_collection.update_one(
                 {'_id': collection_name},
                 {'$set': {'sequence_value': start_value}},
                 upsert=True
             )
-            
+            sequencer.discard(collection_name)
+
             logger.info(f"Reset counter for {collection_name} to {start_value}")
-            
+
         except Exception as e:
             logger.error(f"Error resetting counter for {collection_name}: {e}")
             raise
-    
+
     @staticmethod
     def get_current_count(collection_name):
-        """Get current counter value for a collection"""
+        """Get current counter value for a collection.
+
+        This is the highest reserved ID, which may be ahead of the highest ID
+        actually inserted while processes still hold unused blocks.
+        """
         try:
             db = MongoDB.get_db()
             counters_collection = db['counters']
-            
+
             result = counters_collection.find_one({'_id': collection_name})
             return result['sequence_value'] if result else 0
-            
+
         except Exception as e:
             logger.error(f"Error getting current count for {collection_name}: {e}")
             return 0
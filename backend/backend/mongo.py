@@ -1,7 +1,9 @@
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient, MongoClient, monitoring
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+import asyncio
 import logging
 import os
+import threading
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -11,53 +13,231 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Django setting name -> MongoClient keyword argument
+CLIENT_OPTION_SETTINGS = {
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': 'serverSelectionTimeoutMS',
+    'MONGO_MAX_POOL_SIZE': 'maxPoolSize',
+    'MONGO_MIN_POOL_SIZE': 'minPoolSize',
+    'MONGO_MAX_IDLE_TIME_MS': 'maxIdleTimeMS',
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': 'waitQueueTimeoutMS',
+    'MONGO_COMPRESSORS': 'compressors',
+    'MONGO_READ_PREFERENCE': 'readPreference',
+    'MONGO_WRITE_CONCERN': 'w',
+    'MONGO_JOURNAL': 'journal',
+}
+
+
+def _setting(name, default=None):
+    """Read a value from Django settings, falling back to the environment"""
+    try:
+        from django.conf import settings
+        return getattr(settings, name)
+    except Exception:
+        return os.getenv(name, default)
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool counters collected from pymongo's CMAP events"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connections_open = 0
+            self.checked_out = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.wait_time_total = 0.0
+            self.wait_time_max = 0.0
+            self.pool_clears = 0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'connections_open': self.connections_open,
+                'checked_out': self.checked_out,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'wait_time_avg_ms': round(self.wait_time_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                'wait_time_max_ms': round(self.wait_time_max * 1000, 3),
+                'pool_clears': self.pool_clears,
+            }
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_open -= 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        wait = getattr(event, 'duration', 0.0) or 0.0
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.wait_time_total += wait
+            self.wait_time_max = max(self.wait_time_max, wait)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+
 class MongoDB:
     _client = None
     _db = None
+    _pid = None
+    _lock = threading.Lock()
+    pool_stats = PoolStats()
+
+    @classmethod
+    def get_client_options(cls):
+        """Build MongoClient keyword arguments from settings; unset values are omitted"""
+        options = {'serverSelectionTimeoutMS': 5000}
+        for setting_name, option in CLIENT_OPTION_SETTINGS.items():
+            value = _setting(setting_name)
+            if value is None or value == '':
+                continue
+            if isinstance(value, str) and value.isdigit():
+                value = int(value)
+            options[option] = value
+        return options
 
     @classmethod
     def get_client(cls):
+        if cls._client is not None and cls._pid != os.getpid():
+            # The client was created before a fork (e.g. gunicorn prefork);
+            # its sockets and monitor threads belong to the parent process.
+            logger.info("Fork detected; discarding inherited MongoDB client")
+            cls._client = None
+            cls._db = None
+            cls.pool_stats.reset()
         if cls._client is None:
-            try:
-                # Try to get from Django settings first, fallback to environment variables
-                try:
-                    from django.conf import settings
-                    mongo_uri = settings.MONGO_URI
-                except:
-                    mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
-                
-                cls._client = MongoClient(
-                    mongo_uri,
-                    serverSelectionTimeoutMS=5000
-                )
-                # Test the connection
-                cls._client.admin.command('ping')
-                logger.info("Successfully connected to MongoDB")
-            except (ConnectionFailure, ServerSelectionTimeoutError) as e:
-                logger.error(f"Failed to connect to MongoDB: {e}")
-                raise
+            with cls._lock:
+                if cls._client is None:
+                    cls._connect()
         return cls._client
 
+    @classmethod
+    def _connect(cls):
+        try:
+            mongo_uri = _setting('MONGO_URI', 'mongodb://localhost:27017/')
+            client = MongoClient(
+                mongo_uri,
+                event_listeners=[cls.pool_stats],
+                **cls.get_client_options()
+            )
+            # Test the connection
+            client.admin.command('ping')
+            cls._client = client
+            cls._pid = os.getpid()
+            logger.info("Successfully connected to MongoDB")
+        except (ConnectionFailure, ServerSelectionTimeoutError) as e:
+            logger.error(f"Failed to connect to MongoDB: {e}")
+            raise
+
     @classmethod
     def get_db(cls):
+        client = cls.get_client()
         if cls._db is None:
-            client = cls.get_client()
-            
-            # Try to get from Django settings first, fallback to environment variables
-            try:
-                from django.conf import settings
-                db_name = settings.MONGO_DB
-            except:
-                db_name = os.getenv('MONGO_DB', 'echosoul')
-            
+            db_name = _setting('MONGO_DB', 'echosoul')
             cls._db = client[db_name]
             logger.info(f"Connected to database: {db_name}")
         return cls._db
 
+    @classmethod
+    def get_pool_stats(cls):
+        """Return connection pool statistics for this process"""
+        stats = cls.pool_stats.snapshot()
+        stats['pid'] = os.getpid()
+        stats['connected'] = cls._client is not None and cls._pid == os.getpid()
+        return stats
+
     @classmethod
     def close_connection(cls):
         if cls._client:
             cls._client.close()
             cls._client = None
             cls._db = None
-            logger.info("MongoDB connection closed")
\ No newline at end of file
+            logger.info("MongoDB connection closed")
+
+
+class AsyncMongoDB:
+    """Async counterpart of MongoDB for ASGI views (pymongo's native async API).
+
+    An AsyncMongoClient is bound to the event loop it runs on, so every running
+    loop gets its own client. A watcher task on that loop closes the client when
+    the loop shuts down: asyncio.run() and the ASGI servers cancel pending tasks
+    before closing their loop. Under WSGI, async_to_sync runs each async view in
+    a new loop, so these clients live for one request; serve the async views
+    with ASGI to keep one client (and its pool) per worker.
+    """
+    _clients = {}  # event loop -> AsyncMongoClient
+    _pid = None
+
+    @classmethod
+    def get_client(cls):
+        loop = asyncio.get_running_loop()
+        if cls._pid != os.getpid():
+            # Clients inherited through a fork belong to the parent's loops
+            cls._clients = {}
+            cls._pid = os.getpid()
+        client = cls._clients.get(loop)
+        if client is None:
+            mongo_uri = _setting('MONGO_URI', 'mongodb://localhost:27017/')
+            client = AsyncMongoClient(
+                mongo_uri,
+                event_listeners=[MongoDB.pool_stats],
+                **MongoDB.get_client_options()
+            )
+            cls._clients[loop] = client
+            loop.create_task(cls._close_with_loop(loop, client))
+            logger.info("Created async MongoDB client")
+        return client
+
+    @classmethod
+    async def _close_with_loop(cls, loop, client):
+        try:
+            await loop.create_future()  # only ever cancelled, when the loop shuts down
+        finally:
+            if cls._clients.get(loop) is client:
+                del cls._clients[loop]
+                await client.close()
+
+    @classmethod
+    def get_db(cls):
+        return cls.get_client()[_setting('MONGO_DB', 'echosoul')]
+
+    @classmethod
+    async def close_connection(cls):
+        """Close the client of the running loop"""
+        client = cls._clients.pop(asyncio.get_running_loop(), None)
+        if client:
+            await client.close()
+            logger.info("Async MongoDB connection closed")
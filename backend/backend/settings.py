@@ -103,6 +103,132 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 MONGO_URI = "mongodb://localhost:27017/"
 MONGO_DB = "echosoul_db"
 
+# Number of sequential IDs each process reserves per counter round-trip
+ID_BLOCK_SIZE = int(os.getenv('ID_BLOCK_SIZE', 1000))
+
+# MongoClient tuning (unset values fall back to pymongo defaults)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+MONGO_MAX_POOL_SIZE = os.getenv('MONGO_MAX_POOL_SIZE')
+MONGO_MIN_POOL_SIZE = os.getenv('MONGO_MIN_POOL_SIZE')
+MONGO_MAX_IDLE_TIME_MS = os.getenv('MONGO_MAX_IDLE_TIME_MS')
+MONGO_WAIT_QUEUE_TIMEOUT_MS = os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS')
+MONGO_COMPRESSORS = os.getenv('MONGO_COMPRESSORS')  # e.g. "zstd,snappy,zlib"
+MONGO_READ_PREFERENCE = os.getenv('MONGO_READ_PREFERENCE')  # e.g. "secondaryPreferred"
+MONGO_WRITE_CONCERN = os.getenv('MONGO_WRITE_CONCERN')  # e.g. "1" or "majority"
+MONGO_JOURNAL = os.getenv('MONGO_JOURNAL')
+
+# Build collection indexes the first time each model is used in a process.
+# Turn off when `python manage.py initdb` runs as a deploy step instead.
+MONGO_ENSURE_INDEXES_ON_STARTUP = os.getenv('MONGO_ENSURE_INDEXES_ON_STARTUP', 'true').lower() in ('1', 'true', 'yes')
+
+# Responses are encoded by api/bson_json.py (orjson when installed)
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'api.authentication.SessionTokenAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.BSONJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Signed session tokens issued by login (see api/tokens.py). The first key
+# signs and all keys verify; rotate by prepending a new key. Defaults to
+# SECRET_KEY. With SESSION_TOKENS_REQUIRED off, requests without a token may
+# still name a username directly.
+SESSION_TOKEN_KEYS = [key for key in os.getenv('SESSION_TOKEN_KEYS', '').split(',') if key]
+SESSION_TOKEN_TTL = int(os.getenv('SESSION_TOKEN_TTL', '3600'))
+SESSION_TOKEN_MAX_AGE = 30 * 24 * 3600
+SESSION_TOKENS_REQUIRED = os.getenv('SESSION_TOKENS_REQUIRED', 'false').lower() in ('1', 'true', 'yes')
+
+# Keyset pagination for history endpoints (?limit= is clamped to the max)
+API_DEFAULT_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+
+# Write-behind for activity usage telemetry (see api/write_behind.py).
+# Durability of the background flushes: 'w0', 'w1' or 'journaled'.
+ACTIVITY_WRITE_BEHIND = os.getenv('ACTIVITY_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+WRITE_BEHIND_BATCH_SIZE = 500
+WRITE_BEHIND_FLUSH_SECONDS = 0.5
+WRITE_BEHIND_MAX_QUEUED = 10000
+WRITE_BEHIND_BLOCK_MS = 50
+WRITE_BEHIND_DURABILITY = os.getenv('WRITE_BEHIND_DURABILITY', 'w1')
+
+# Max events accepted by one POST /api/events/batch/
+EVENTS_BATCH_MAX = 500
+
+# Documents fetched per cursor batch by the streaming export endpoint
+EXPORT_BATCH_SIZE = 500
+
+# Recent-conversation window cache for the chatbot ('local' per process, or 'django' to use CACHES)
+CHAT_CONTEXT_CACHE_BACKEND = os.getenv('CHAT_CONTEXT_CACHE_BACKEND', 'local')
+CHAT_CONTEXT_CACHE_SIZE = 10000
+CHAT_CONTEXT_CACHE_TTL = 900
+
+# Per-process cache of user records for login lookups (TTL 0 disables it)
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '60'))
+
+# Opt-in reply cache for short repeated prompts (crisis/self-harm messages always bypass it)
+CHAT_RESPONSE_CACHE_ENABLED = os.getenv('CHAT_RESPONSE_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+CHAT_RESPONSE_CACHE_SIZE = 5000
+CHAT_RESPONSE_CACHE_TTL = 3600
+CHAT_RESPONSE_CACHE_HISTORY_TURNS = 2
+CHAT_RESPONSE_CACHE_MAX_MESSAGE_CHARS = 200
+
+# LLM provider resilience: hard per-call latency budget and a failure-rate
+# circuit breaker (see api/resilience.py)
+LLM_TIMEOUT_SECONDS = float(os.getenv('LLM_TIMEOUT_SECONDS', '8'))
+LLM_MAX_CONCURRENCY = 32
+LLM_BREAKER_WINDOW = 20
+LLM_BREAKER_MIN_CALLS = 5
+LLM_BREAKER_FAILURE_RATE = 0.5
+LLM_BREAKER_RESET_SECONDS = 30
+LLM_BREAKER_HALF_OPEN_CALLS = 1
+
+# Chat providers in priority order (see api/providers.py); 'echo' is a local
+# offline stub. LLM_PROVIDER_CLASSES maps extra names to dotted class paths.
+LLM_PROVIDERS = [name.strip() for name in os.getenv('LLM_PROVIDERS', 'gemini').split(',') if name.strip()]
+LLM_PROVIDER_CLASSES = {}
+LLM_ROUTER_WINDOW = 200
+LLM_ROUTER_MIN_SAMPLES = 10
+LLM_ROUTER_EXPLORE_EVERY = 50
+
+# Password hashing (see api/utils.py): scheme for new hashes ('scrypt' or
+# 'pbkdf2-sha256') and its work factor. Stored hashes made with other
+# settings are upgraded on the user's next login.
+PASSWORD_HASH_SCHEME = os.getenv('PASSWORD_HASH_SCHEME', 'scrypt')
+PASSWORD_SCRYPT_N = int(os.getenv('PASSWORD_SCRYPT_N', str(2 ** 14)))
+PASSWORD_SCRYPT_R = 8
+PASSWORD_SCRYPT_P = 1
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv('PASSWORD_PBKDF2_ITERATIONS', '310000'))
+# Threads that hash/verify passwords (0 = one per CPU) and how many more
+# calls may wait for them before requests get a 503
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '0'))
+PASSWORD_HASH_MAX_PENDING = 64
+
+# Background username renames (see api/rename_jobs.py): jobs run at once,
+# collections move concurrently in batches, and a stalled job can be taken
+# over once its lease expires. RENAME_JOBS_ASYNC=False runs them inline.
+RENAME_JOBS_ASYNC = True
+RENAME_JOB_WORKERS = 2
+RENAME_JOB_CONCURRENCY = 4
+RENAME_JOB_BATCH_SIZE = 1000
+RENAME_JOB_LEASE_SECONDS = 60
+
+# Batch migrations run by management commands (see api/batch_migration.py):
+# documents per bulk_write, an optional documents/second ceiling (0 = none)
+# and how often progress is printed
+MIGRATION_CHUNK_SIZE = int(os.getenv('MIGRATION_CHUNK_SIZE', '1000'))
+MIGRATION_MAX_RATE = float(os.getenv('MIGRATION_MAX_RATE', '0'))
+MIGRATION_REPORT_SECONDS = 5
+
+# migrate_to_sequential_ids cuts over once a catch-up pass replays at most
+# ID_MIGRATION_CUTOVER_LAG writes, or after ID_MIGRATION_CATCH_UP_PASSES passes;
+# the writes still pending are replayed while the collection is write-blocked
+ID_MIGRATION_CUTOVER_LAG = int(os.getenv('ID_MIGRATION_CUTOVER_LAG', '1000'))
+ID_MIGRATION_CATCH_UP_PASSES = int(os.getenv('ID_MIGRATION_CATCH_UP_PASSES', '10'))
+
 # Note: Django will use MongoDB through custom database operations
 # since we're using pymongo directly instead of djongo
 DATABASES = {
@@ -5,6 +5,22 @@
 
 const API_URL = 'http://127.0.0.1:8000/api';
 
+// Remember the session token from login (and from password/profile changes)
+const saveToken = (data) => {
+  if (data && data.token) {
+    localStorage.setItem('token', JSON.stringify({ token: data.token, expiresAt: data.token_expires_at }));
+  }
+};
+
+// Request headers plus `Authorization: Bearer <token>` while the token is unexpired
+const authHeaders = (headers = {}) => {
+  const saved = JSON.parse(localStorage.getItem('token') || 'null');
+  if (!saved || saved.expiresAt * 1000 <= Date.now()) {
+    return headers;
+  }
+  return { ...headers, Authorization: `Bearer ${saved.token}` };
+};
+
 /**
  * Authentication API calls
  */
@@ -52,6 +68,7 @@ export const authAPI = {
       
       // Store user data in localStorage for persistence
       localStorage.setItem('user', JSON.stringify(data.user));
+      saveToken(data);
       
       return data;
     } catch (error) {
@@ -63,6 +80,7 @@ export const authAPI = {
   // Logout user
   logout: () => {
     localStorage.removeItem('user');
+    localStorage.removeItem('token');
   },
   
   // Get current user from localStorage
@@ -76,13 +94,14 @@ export const authAPI = {
     try {
       const response = await fetch(`${API_URL}/change-password/`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: authHeaders({ 'Content-Type': 'application/json' }),
         body: JSON.stringify({ identifier, current_password, new_password }),
       });
       const data = await response.json();
       if (!response.ok) {
         throw new Error(data.error || 'Failed to change password');
       }
+      saveToken(data);
       return data;
     } catch (error) {
       console.error('Change password error:', error);
@@ -94,7 +113,7 @@ export const authAPI = {
     try {
       const response = await fetch(`${API_URL}/profile/update/`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: authHeaders({ 'Content-Type': 'application/json' }),
         body: JSON.stringify({ identifier, username, email, phone, address }),
       });
       const data = await response.json();
@@ -104,7 +123,8 @@ export const authAPI = {
       if (data.user) {
         localStorage.setItem('user', JSON.stringify(data.user));
       }
-      return data; // { message, user }
+      saveToken(data);
+      return data; // { message, user, token? }
     } catch (error) {
       console.error('Update profile error:', error);
       throw error;
@@ -121,7 +141,7 @@ export const journalAPI = {
     try {
       const response = await fetch(`${API_URL}/journal/`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: authHeaders({ 'Content-Type': 'application/json' }),
         body: JSON.stringify({ username, content, metadata }),
       });
       const data = await response.json();
@@ -137,7 +157,9 @@ export const journalAPI = {
   // Get journal entries for a user
   getEntries: async ({ username, limit = 100 }) => {
     try {
-      const response = await fetch(`${API_URL}/journal/?username=${encodeURIComponent(username)}&limit=${encodeURIComponent(limit)}`);
+      const response = await fetch(`${API_URL}/journal/?username=${encodeURIComponent(username)}&limit=${encodeURIComponent(limit)}`, {
+        headers: authHeaders(),
+      });
       const data = await response.json();
       if (!response.ok) {
         throw new Error(data.error || 'Failed to fetch journal entries');
@@ -159,7 +181,7 @@ export const activityAPI = {
     try {
       const response = await fetch(`${API_URL}/activity-usage/`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: authHeaders({ 'Content-Type': 'application/json' }),
         body: JSON.stringify({ username, activity_key, metadata }),
       });
       const data = await response.json();
@@ -175,7 +197,9 @@ export const activityAPI = {
   // Fetch a user's activity usage history
   getUsage: async ({ username, limit = 100 }) => {
     try {
-      const response = await fetch(`${API_URL}/activity-usage/?username=${encodeURIComponent(username)}&limit=${encodeURIComponent(limit)}`);
+      const response = await fetch(`${API_URL}/activity-usage/?username=${encodeURIComponent(username)}&limit=${encodeURIComponent(limit)}`, {
+        headers: authHeaders(),
+      });
       const data = await response.json();
       if (!response.ok) {
         throw new Error(data.error || 'Failed to fetch activity usage');
@@ -197,7 +221,7 @@ export const chatAPI = {
     try {
       const response = await fetch(`${API_URL}/chat/`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: authHeaders({ 'Content-Type': 'application/json' }),
         body: JSON.stringify({ message, mood, username }),
       });
       const data = await response.json();
@@ -216,6 +240,7 @@ export const chatAPI = {
       // First try DELETE without body
       let response = await fetch(`${API_URL}/chat/history/?username=${encodeURIComponent(username)}`, {
         method: 'DELETE',
+        headers: authHeaders(),
       });
       let data = null;
       try { data = await response.json(); } catch (_) { data = null; }
@@ -223,7 +248,7 @@ export const chatAPI = {
         // Fallback: POST with action payload
         response = await fetch(`${API_URL}/chat/history/`, {
           method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
+          headers: authHeaders({ 'Content-Type': 'application/json' }),
           body: JSON.stringify({ username, action: 'clear' }),
         });
         try { data = await response.json(); } catch (_) { data = null; }
@@ -239,17 +264,18 @@ export const chatAPI = {
     }
   },
   // Get chat history for a user
-  getHistory: async (username) => {
+  getHistory: async (username, limit = 200) => {
     try {
-      const response = await fetch(`${API_URL}/chat/history/?username=${encodeURIComponent(username)}`, {
+      // Without an order the server returns the latest page, oldest message first
+      const response = await fetch(`${API_URL}/chat/history/?username=${encodeURIComponent(username)}&limit=${encodeURIComponent(limit)}`, {
         method: 'GET',
-        headers: { 'Content-Type': 'application/json' },
+        headers: authHeaders({ 'Content-Type': 'application/json' }),
       });
       const data = await response.json();
       if (!response.ok) {
         throw new Error(data.error || 'Failed to fetch chat history');
       }
-      return data; // { username, count, messages: [...] }
+      return data; // { username, count, messages: [...], next }
     } catch (error) {
       console.error('Chat history error:', error);
       throw error;
@@ -266,9 +292,9 @@ export const moodAPI = {
     try {
       const response = await fetch(`${API_URL}/mood/`, {
         method: 'POST',
-        headers: {
+        headers: authHeaders({
           'Content-Type': 'application/json',
-        },
+        }),
         body: JSON.stringify(moodData),
       });
       
@@ -288,20 +314,29 @@ export const moodAPI = {
   // Get mood entries for a user
   getMoodEntries: async (username) => {
     try {
-      const response = await fetch(`${API_URL}/mood/?username=${encodeURIComponent(username)}`, {
-        method: 'GET',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-      });
-      
-      const data = await response.json();
-      
-      if (!response.ok) {
-        throw new Error(data.error || 'Failed to fetch mood entries');
-      }
-      
-      return data;
+      // Follow the `next` cursors so callers get every entry, not just the first page
+      const entries = [];
+      let cursor = null;
+      let data;
+      do {
+        const query = `username=${encodeURIComponent(username)}&limit=200${cursor ? `&cursor=${encodeURIComponent(cursor)}` : ''}`;
+        const response = await fetch(`${API_URL}/mood/?${query}`, {
+          method: 'GET',
+          headers: authHeaders({
+            'Content-Type': 'application/json',
+          }),
+        });
+
+        data = await response.json();
+
+        if (!response.ok) {
+          throw new Error(data.error || 'Failed to fetch mood entries');
+        }
+        entries.push(...(data.mood_entries || []));
+        cursor = data.next;
+      } while (cursor);
+
+      return { ...data, count: entries.length, mood_entries: entries, next: null };
     } catch (error) {
       console.error('Get mood entries error:', error);
       throw error;